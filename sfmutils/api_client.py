@@ -1,13 +1,37 @@
 import urllib.parse as urlparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class ApiClient:
     """
     A client for SFM-UI's API.
+
+    Requests are made with a session, so connections are reused. Failed requests are retried.
+    While a page of results is being consumed, the next page is fetched in the background.
     """
-    def __init__(self, base_url):
+    def __init__(self, base_url, retries=3, backoff_factor=.5, pool_size=10, prefetch=True):
+        """
+        :param base_url: base url of the API
+        :param retries: number of times to retry a failed request
+        :param backoff_factor: factor for the delay between retries
+        :param pool_size: number of connections to keep open and maximum number of concurrent requests
+        :param prefetch: if True, fetch the next page of results in the background
+        """
         self.base_url = base_url
+        self.pool_size = pool_size
+        self.prefetch = prefetch
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=Retry(total=retries, backoff_factor=backoff_factor,
+                                                status_forcelist=(500, 502, 503, 504)))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._prefetch_executor = None
+        self._prefetch_executor_lock = threading.Lock()
 
     @staticmethod
     def _clean_params(params):
@@ -22,19 +46,32 @@ class ApiClient:
                     clean_params[k] = v
         return clean_params
 
+    def _get_json(self, url, params=None):
+        resp = self.session.get(url, params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _prefetch(self, url):
+        with self._prefetch_executor_lock:
+            if self._prefetch_executor is None:
+                self._prefetch_executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                             thread_name_prefix="api_client_prefetch")
+        return self._prefetch_executor.submit(self._get_json, url)
+
     def _get(self, url_part, params):
         url = urlparse.urljoin(self.base_url, url_part)
-        resp = requests.get(url, params=self._clean_params(params))
-        resp.raise_for_status()
-        while resp:
-            resp_json = resp.json()
+        resp_json = self._get_json(url, params=self._clean_params(params))
+        while resp_json:
+            next_url = resp_json['next']
+            next_future = self._prefetch(next_url) if next_url and self.prefetch else None
             for item in resp_json['results']:
                 yield item
-            if resp_json['next']:
-                resp = requests.get(resp_json['next'])
-                resp.raise_for_status()
+            if next_future:
+                resp_json = next_future.result()
+            elif next_url:
+                resp_json = self._get_json(next_url)
             else:
-                resp = None
+                resp_json = None
 
     def warcs(self, collection_id=None, seed_ids=None, harvest_date_start=None, harvest_date_end=None,
               created_date_start=None, created_date_end=None):
@@ -58,6 +95,30 @@ class ApiClient:
         params["created_date_end"] = created_date_end
         return self._get("/api/v1/warcs/", params)
 
+    def concurrent_warcs(self, queries, max_workers=None):
+        """
+        Iterator over WARC model objects for several queries, which are performed concurrently.
+
+        For example, queries may be for different collections or for batches of seeds.
+        WARCs are returned in the order of the queries. WARCs returned by more than one
+        query are only returned once.
+
+        :param queries: list of maps of keyword arguments for warcs()
+        :param max_workers: maximum number of queries to perform at a time. Defaults to the pool size.
+        :return: WARC iterator
+        """
+        if not queries:
+            return
+        with ThreadPoolExecutor(max_workers=max_workers or self.pool_size,
+                                thread_name_prefix="api_client_query") as executor:
+            futures = [executor.submit(lambda query: list(self.warcs(**query)), query) for query in queries]
+            warc_ids = set()
+            for future in futures:
+                for warc in future.result():
+                    if warc["warc_id"] not in warc_ids:
+                        warc_ids.add(warc["warc_id"])
+                        yield warc
+
     def collections(self, collection_id_startswith=None):
         """
         Iterator over Collection model objects.
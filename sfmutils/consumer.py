@@ -4,12 +4,39 @@ from kombu.mixins import ConsumerProducerMixin
 import json
 import os
 import codecs
+import copy
+import shutil
 import signal
+import threading
+import time
+import uuid
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 log = logging.getLogger(__name__)
 
 EXCHANGE = "sfm_exchange"
 
+# When handling messages concurrently, each message is handled in a subdirectory of this directory
+# in the working path.
+DELIVERIES_DIR = "deliveries"
+
+
+def _json_serialize(message):
+    return json.dumps(message, separators=(',', ':')).encode("utf-8")
+
+
+# Map of serializer names to content type, content encoding and function that serializes a message to bytes.
+SERIALIZERS = OrderedDict([("json", ("application/json", "utf-8", _json_serialize))])
+if msgpack is not None:
+    SERIALIZERS["msgpack"] = ("application/x-msgpack", "binary", lambda message: msgpack.packb(message,
+                                                                                              use_bin_type=True))
+
 
 class BaseConsumer(ConsumerProducerMixin):
     """
@@ -21,9 +48,18 @@ class BaseConsumer(ConsumerProducerMixin):
 
     Subclasses should override on_message().
 
-    To send a message, use self.producer.publish().
+    To send a message, use self._publish_message().
+
+    Messages are sent using the serializer named by self.serializer. Messages using any of the
+    available serializers are consumed.
+
+    If concurrency is greater than 1, up to that many messages are handled at a time, each by a
+    copy of the consumer in a worker thread. Each copy has its own working path, which is a
+    subdirectory of the deliveries directory of the working path, and persists its message
+    there for resuming.
     """
-    def __init__(self, mq_config=None, persist_messages=False, working_path=None):
+    def __init__(self, mq_config=None, persist_messages=False, working_path=None, serializer="json",
+                 concurrency=None, prefetch_count=None):
         # Handle SIGTERM
         def stop(signum, frame):
             log.info("Stopping for SIGTERM")
@@ -56,6 +92,20 @@ class BaseConsumer(ConsumerProducerMixin):
         self.routing_key = None
 
         self.result = None
+        if serializer not in SERIALIZERS:
+            raise ValueError("{} is not an available serializer".format(serializer))
+        self.serializer = serializer
+        # When set, messages are published by an AsyncPublisher.
+        self.async_publisher = None
+        self._owns_async_publisher = False
+        # Number of messages to handle at a time. None to handle in the consuming thread.
+        self.concurrency = concurrency
+        # Number of unacknowledged messages to prefetch. Defaults to concurrency.
+        self.prefetch_count = prefetch_count
+        self._delivery_executor = None
+        self._delivery_semaphore = None
+        # True for a copy that handles a message in a worker thread.
+        self._in_delivery_thread = False
 
     def get_consumers(self, Consumer, channel):
         assert self.mq_config
@@ -80,8 +130,9 @@ class BaseConsumer(ConsumerProducerMixin):
 
         consumer = Consumer(queues=queues,
                             callbacks=[self._callback],
-                            auto_declare=False)
-        consumer.qos(prefetch_count=1, apply_global=True)
+                            auto_declare=False,
+                            accept=[content_type for content_type, _, _ in SERIALIZERS.values()])
+        consumer.qos(prefetch_count=self.prefetch_count or self.concurrency or 1, apply_global=True)
         return [consumer]
 
     def _callback(self, message, message_obj):
@@ -89,7 +140,14 @@ class BaseConsumer(ConsumerProducerMixin):
         Callback for receiving harvest message.
         """
         message_obj.ack()
-        self.routing_key = message_obj.delivery_info["routing_key"]
+        if self._is_concurrent():
+            self._submit_delivery(message_obj.delivery_info["routing_key"], message)
+            return
+
+        self._handle_message(message_obj.delivery_info["routing_key"], message)
+
+    def _handle_message(self, routing_key, message):
+        self.routing_key = routing_key
         self.message = message
 
         # Persist the message
@@ -115,6 +173,95 @@ class BaseConsumer(ConsumerProducerMixin):
                 os.remove(self.message_filepath)
                 log.debug("Deleted %s", self.message_filepath)
 
+    def _is_concurrent(self):
+        return bool(self.concurrency and self.concurrency > 1)
+
+    def _submit_delivery(self, routing_key=None, message=None, delivery_id=None):
+        """
+        Handles a message with a copy of this consumer in a worker thread. Blocks while all workers are busy.
+
+        :param delivery_id: id of a delivery to resume from its persisted message
+        :return: a future for the delivery
+        """
+        assert self.working_path
+        if self._delivery_executor is None:
+            self._delivery_executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                         thread_name_prefix="delivery_worker")
+            self._delivery_semaphore = threading.BoundedSemaphore(self.concurrency)
+        # So that only a single thread uses the producer.
+        if self.mq_config:
+            self.start_async_publishing(min_interval_secs=self._async_publishing_min_interval_secs())
+        self._delivery_semaphore.acquire()
+        try:
+            consumer = self._copy_for_delivery(
+                os.path.join(self.working_path, DELIVERIES_DIR, delivery_id or uuid.uuid4().hex))
+            future = self._delivery_executor.submit(consumer._handle_delivery, routing_key, message,
+                                                    resume=delivery_id is not None)
+        except Exception:
+            self._delivery_semaphore.release()
+            raise
+        future.add_done_callback(lambda f: self._delivery_semaphore.release())
+        return future
+
+    def _copy_for_delivery(self, working_path):
+        """
+        Returns a copy of this consumer for handling a single message in a worker thread.
+
+        Subclasses that keep per-message state should extend this to reset that state.
+        """
+        consumer = copy.copy(self)
+        consumer.working_path = working_path
+        if not os.path.exists(working_path):
+            os.makedirs(working_path)
+        consumer.message_filepath = os.path.join(working_path, "last_message.json")
+        consumer.message = None
+        consumer.routing_key = None
+        consumer.result = None
+        consumer.concurrency = None
+        consumer._delivery_executor = None
+        consumer._delivery_semaphore = None
+        consumer._owns_async_publisher = False
+        consumer._in_delivery_thread = True
+        return consumer
+
+    def _handle_delivery(self, routing_key, message, resume=False):
+        """
+        Handles a message in a worker thread and then removes the working path.
+        """
+        try:
+            if resume:
+                self.message_from_file(self.message_filepath, delete=True)
+            else:
+                self._handle_message(routing_key, message)
+        except Exception as e:
+            log.exception("Error handling message: %s", e)
+        finally:
+            self._release_delivery()
+            shutil.rmtree(self.working_path, ignore_errors=True)
+
+    def _release_delivery(self):
+        """
+        Called when a copy of this consumer has finished handling a message.
+        """
+        pass
+
+    def _worker_start_method(self):
+        """
+        Returns the multiprocessing start method for worker processes, or None for the default.
+
+        Forking while other threads are running can deadlock the child on a lock held at the time,
+        e.g., a logging handler's lock. So when handling a message in a worker thread, workers are
+        started by a fork server instead.
+        """
+        return "forkserver" if self._in_delivery_thread else None
+
+    def _async_publishing_min_interval_secs(self):
+        """
+        Returns the minimum interval between messages with the same coalesce key for the publisher
+        shared by the copies of this consumer.
+        """
+        return 0
+
     def on_persist_exception(self, exception):
         """
         Called when an exception is thrown persisting a message.
@@ -160,6 +307,9 @@ class BaseConsumer(ConsumerProducerMixin):
     def resume_from_file(self):
         """
         If a persisted message exists, invoke that message.
+
+        If handling messages concurrently, messages persisted in the deliveries directory are
+        also resumed.
         """
         if os.path.exists(self.message_filepath):
             log.info("%s exists, so resuming", self.message_filepath)
@@ -167,29 +317,196 @@ class BaseConsumer(ConsumerProducerMixin):
         else:
             log.info("%s does not exist, so not resuming", self.message_filepath)
 
-    def _publish_message(self, routing_key, message, trunate_debug_length=None):
-        message_body = json.dumps(message, indent=4)
-        if self.mq_config:
-            if trunate_debug_length:
-                log.debug("Sending message to %s with routing_key %s. The first %s characters of the body is: %s",
-                          self.exchange.name, routing_key,
-                          trunate_debug_length, message_body[:trunate_debug_length])
+        deliveries_path = os.path.join(self.working_path, DELIVERIES_DIR)
+        if self._is_concurrent() and os.path.exists(deliveries_path):
+            for delivery_id in sorted(os.listdir(deliveries_path)):
+                if os.path.exists(os.path.join(deliveries_path, delivery_id, "last_message.json")):
+                    log.info("Resuming delivery %s", delivery_id)
+                    self._submit_delivery(delivery_id=delivery_id)
+
+    def start_async_publishing(self, min_interval_secs=0):
+        """
+        Publishes messages from a background thread until stop_async_publishing() is called.
+
+        :param min_interval_secs: minimum interval between messages with the same coalesce key
+        """
+        if self.async_publisher is None:
+            self.async_publisher = AsyncPublisher(self._send_message, min_interval_secs=min_interval_secs)
+            self._owns_async_publisher = True
+
+    def stop_async_publishing(self):
+        """
+        Waits for queued messages to be published and stops publishing from a background thread.
+
+        A publisher shared with the consumer that this consumer was copied from is not stopped.
+        """
+        if self.async_publisher is not None:
+            if self._owns_async_publisher:
+                self.async_publisher.stop()
+                self.async_publisher = None
+                self._owns_async_publisher = False
             else:
-                log.debug("Sending message to %s with routing_key %s. The body is: %s", self.exchange.name, routing_key,
-                          message_body)
-            self.producer.publish(body=message,
+                self.async_publisher.flush()
+
+    def _publish_message(self, routing_key, message, trunate_debug_length=None, coalesce_key=None, merge_fn=None):
+        """
+        Publishes a message.
+
+        :param coalesce_key: when publishing asynchronously, a message with this key that has not
+        yet been published is replaced by this message.
+        :param merge_fn: function that is passed the replaced message and this message and returns
+        the message to publish.
+        """
+        if self.async_publisher is not None:
+            self.async_publisher.publish(routing_key, message, coalesce_key=coalesce_key, merge_fn=merge_fn,
+                                         trunate_debug_length=trunate_debug_length)
+        else:
+            self._send_message(routing_key, message, trunate_debug_length=trunate_debug_length)
+
+    def _send_message(self, routing_key, message, trunate_debug_length=None):
+        # The message is serialized once, for both sending and logging.
+        content_type, content_encoding, serialize = SERIALIZERS[self.serializer]
+        message_body = serialize(message) if self.mq_config else None
+        if self.mq_config:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Sending message to %s with routing_key %s. %s", self.exchange.name, routing_key,
+                          self._debug_body(message, message_body, trunate_debug_length))
+            self.producer.publish(body=message_body,
                                   routing_key=routing_key,
                                   retry=True,
-                                  exchange=self.exchange)
-        else:
-            if trunate_debug_length:
-                log.debug(
-                    "Skipping sending message to sfm_exchange with routing_key %s. The first %s characters of the body "
-                    "is: %s",
-                    routing_key, trunate_debug_length, message_body[:trunate_debug_length])
-            else:
-                log.debug("Skipping sending message to sfm_exchange with routing_key %s. The body is: %s",
-                          routing_key, message_body)
+                                  exchange=self.exchange,
+                                  content_type=content_type,
+                                  content_encoding=content_encoding)
+        elif log.isEnabledFor(logging.DEBUG):
+            log.debug("Skipping sending message to sfm_exchange with routing_key %s. %s", routing_key,
+                      self._debug_body(message, message_body, trunate_debug_length))
+
+    def _debug_body(self, message, message_body, trunate_debug_length):
+        if message_body is None or self.serializer != "json":
+            message_body = _json_serialize(message)
+        message_body = message_body.decode("utf-8")
+        if trunate_debug_length:
+            return "The first {} characters of the body is: {}".format(trunate_debug_length,
+                                                                       message_body[:trunate_debug_length])
+        return "The body is: {}".format(message_body)
+
+
+class AsyncPublisher:
+    """
+    Publishes messages from a background thread, so that a slow broker does not block the caller.
+
+    Messages are published in the order in which they are queued. A message queued with a
+    coalesce key replaces a queued message with the same key, keeping its place in the queue.
+    Messages with the same coalesce key are published at most every min_interval_secs. A message
+    waiting for the interval does not hold up the messages queued after it.
+    """
+    def __init__(self, publish_fn, min_interval_secs=0):
+        """
+        :param publish_fn: function that is passed the routing key, message and keyword arguments
+        :param min_interval_secs: minimum interval between messages with the same coalesce key
+        """
+        self.publish_fn = publish_fn
+        self.min_interval_secs = min_interval_secs
+        self._pending = deque()
+        # Map of coalesce keys to queued entries
+        self._coalescing = {}
+        # Map of coalesce keys to when last published
+        self._last_published = {}
+        self._condition = threading.Condition()
+        self._publishing = False
+        self._flushing = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="async_publisher_thread")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def publish(self, routing_key, message, coalesce_key=None, merge_fn=None, **kwargs):
+        with self._condition:
+            if not self._stopped:
+                entry = self._coalescing.get(coalesce_key) if coalesce_key else None
+                if entry is not None:
+                    entry[1] = merge_fn(entry[1], message) if merge_fn else message
+                else:
+                    entry = [routing_key, message, coalesce_key, kwargs]
+                    self._pending.append(entry)
+                    if coalesce_key:
+                        self._coalescing[coalesce_key] = entry
+                self._condition.notify_all()
+                return
+        # Once stopped, publish synchronously.
+        self.publish_fn(routing_key, message, **kwargs)
+
+    def flush(self):
+        """
+        Waits for all queued messages to be published. The minimum interval is ignored.
+        """
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                while self._pending or self._publishing:
+                    self._condition.wait()
+            finally:
+                self._flushing -= 1
+
+    def stop(self):
+        self.flush()
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _wait_secs(self, coalesce_key):
+        if not coalesce_key or self._flushing or not self.min_interval_secs \
+                or coalesce_key not in self._last_published:
+            return 0
+        return self._last_published[coalesce_key] + self.min_interval_secs - time.monotonic()
+
+    def _next_entry(self):
+        """
+        Returns the index of the first queued entry that may be published, or None and the number
+        of seconds until one may be.
+        """
+        wait_secs = None
+        for index, entry in enumerate(self._pending):
+            entry_wait_secs = self._wait_secs(entry[2])
+            if entry_wait_secs <= 0:
+                return index, 0
+            wait_secs = entry_wait_secs if wait_secs is None else min(wait_secs, entry_wait_secs)
+        return None, wait_secs
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending:
+                        index, wait_secs = self._next_entry()
+                        if index is not None:
+                            break
+                        self._condition.wait(wait_secs)
+                    elif self._stopped:
+                        return
+                    else:
+                        self._condition.wait()
+                entry = self._pending[index]
+                del self._pending[index]
+                routing_key, message, coalesce_key, kwargs = entry
+                if coalesce_key:
+                    del self._coalescing[coalesce_key]
+                    now = time.monotonic()
+                    # Keys published longer ago than the interval no longer delay publishing.
+                    self._last_published = {key: published for key, published in self._last_published.items()
+                                            if now - published < self.min_interval_secs}
+                    self._last_published[coalesce_key] = now
+                self._publishing = True
+            try:
+                self.publish_fn(routing_key, message, **kwargs)
+            except Exception as e:
+                log.exception("Error publishing message with routing key %s: %s", routing_key, e)
+            finally:
+                with self._condition:
+                    self._publishing = False
+                    self._condition.notify_all()
 
 
 class MqConfig:
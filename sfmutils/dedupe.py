@@ -0,0 +1,185 @@
+import logging
+import os
+import sqlite3
+import tempfile
+from array import array
+
+log = logging.getLogger(__name__)
+
+"""
+A seen ids keeps track of the ids of the items that have been yielded, for the purpose of deduping.
+
+A seen ids should implement the signature of SeenIds.
+"""
+
+DEDUPE_MEMORY = "memory"
+DEDUPE_COMPACT = "compact"
+DEDUPE_DISK = "disk"
+DEDUPE_MODES = (DEDUPE_MEMORY, DEDUPE_COMPACT, DEDUPE_DISK)
+
+
+class SeenIds:
+    """
+    A seen ids implementation backed by a dictionary.
+    """
+    def __init__(self):
+        self.ids = {}
+
+    def add(self, item_id):
+        """
+        Adds an id.
+
+        :param item_id: the id of the item
+        :return: True if the id had not been seen before.
+        """
+        if item_id in self.ids:
+            return False
+        self.ids[item_id] = True
+        return True
+
+    def close(self):
+        """
+        Releases any resources.
+        """
+        pass
+
+
+class CompactSeenIds(SeenIds):
+    """
+    A seen ids implementation for 64-bit integer ids, backed by an open addressing hash
+    table stored in an array. The table is grown once it is more than half full, so this
+    takes 16 to 32 bytes per id.
+
+    Ids may be ints or strings of ints, which are treated as the same id. Other ids are kept
+    in a dictionary.
+    """
+    _MULTIPLIER = 0x9E3779B97F4A7C15
+    _MAX_ID = 2 ** 64
+
+    def __init__(self, capacity_bits=16):
+        SeenIds.__init__(self)
+        self._bits = capacity_bits
+        self._table = array('Q', bytes(8 * 2 ** capacity_bits))
+        self._count = 0
+        # 0 marks an empty slot, so track it separately.
+        self._has_zero = False
+
+    def add(self, item_id):
+        key = self._key(item_id)
+        if key is None:
+            return SeenIds.add(self, item_id)
+        if key == 0:
+            if self._has_zero:
+                return False
+            self._has_zero = True
+            return True
+        if not self._insert(self._table, self._bits, key):
+            return False
+        self._count += 1
+        if self._count * 2 > len(self._table):
+            self._grow()
+        return True
+
+    @classmethod
+    def _key(cls, item_id):
+        if isinstance(item_id, int):
+            key = item_id
+        elif isinstance(item_id, str) and item_id.isdigit() and (item_id == "0" or item_id[0] != "0"):
+            key = int(item_id)
+        else:
+            return None
+        return key if 0 <= key < cls._MAX_ID else None
+
+    @classmethod
+    def _insert(cls, table, bits, key):
+        # Fibonacci hashing of the key, then linear probing.
+        mask = len(table) - 1
+        i = ((key * cls._MULTIPLIER) % cls._MAX_ID) >> (64 - bits)
+        while True:
+            slot = table[i]
+            if slot == 0:
+                table[i] = key
+                return True
+            if slot == key:
+                return False
+            i = (i + 1) & mask
+
+    def _grow(self):
+        bits = self._bits + 1
+        table = array('Q', bytes(8 * 2 ** bits))
+        for key in self._table:
+            if key:
+                self._insert(table, bits, key)
+        self._bits = bits
+        self._table = table
+
+
+class DiskSeenIds(SeenIds):
+    """
+    A seen ids implementation that keeps up to max_ids_in_memory ids in memory and spills
+    the rest to a temporary SQLite database.
+
+    Ids are compared as strings.
+    """
+    def __init__(self, path=None, max_ids_in_memory=1000000, cache_kib=64 * 1024):
+        """
+        :param path: directory for the database. If not provided, the system temp directory is used.
+        :param max_ids_in_memory: number of ids to keep in memory before writing them to the database
+        :param cache_kib: size of the database's page cache
+        """
+        SeenIds.__init__(self)
+        self.max_ids_in_memory = max_ids_in_memory
+        fd, self.db_filepath = tempfile.mkstemp(suffix=".sqlite", prefix="seen_ids_", dir=path)
+        os.close(fd)
+        self._conn = sqlite3.connect(self.db_filepath)
+        # Only needed for the life of the iteration, so durability doesn't matter.
+        self._conn.execute("PRAGMA journal_mode = OFF")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.execute("PRAGMA cache_size = -{}".format(cache_kib))
+        self._conn.execute("CREATE TABLE seen_ids (id TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._buffer = set()
+        self._stored_count = 0
+
+    def add(self, item_id):
+        key = str(item_id)
+        if key in self._buffer:
+            return False
+        if self._stored_count and self._conn.execute("SELECT 1 FROM seen_ids WHERE id = ?", (key,)).fetchone():
+            return False
+        self._buffer.add(key)
+        if len(self._buffer) >= self.max_ids_in_memory:
+            self._flush()
+        return True
+
+    def _flush(self):
+        log.debug("Writing %s seen ids to %s", len(self._buffer), self.db_filepath)
+        self._conn.executemany("INSERT INTO seen_ids (id) VALUES (?)", ((key,) for key in sorted(self._buffer)))
+        self._conn.commit()
+        self._stored_count += len(self._buffer)
+        self._buffer = set()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if os.path.exists(self.db_filepath):
+            os.remove(self.db_filepath)
+
+
+def create_seen_ids(mode=DEDUPE_MEMORY, path=None, max_ids_in_memory=None):
+    """
+    Returns a seen ids for the dedupe mode.
+
+    :param mode: DEDUPE_MEMORY, DEDUPE_COMPACT, or DEDUPE_DISK
+    :param path: directory for DEDUPE_DISK
+    :param max_ids_in_memory: maximum number of ids kept in memory for DEDUPE_DISK
+    """
+    if mode is None or mode == DEDUPE_MEMORY:
+        return SeenIds()
+    elif mode == DEDUPE_COMPACT:
+        return CompactSeenIds()
+    elif mode == DEDUPE_DISK:
+        if max_ids_in_memory:
+            return DiskSeenIds(path=path, max_ids_in_memory=max_ids_in_memory)
+        return DiskSeenIds(path=path)
+    raise ValueError("{} is not a dedupe mode".format(mode))
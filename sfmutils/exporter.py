@@ -1,4 +1,4 @@
-from sfmutils.consumer import BaseConsumer, MqConfig, EXCHANGE
+from sfmutils.consumer import BaseConsumer, MqConfig, EXCHANGE, SERIALIZERS
 from sfmutils.api_client import ApiClient
 import logging
 import os
@@ -7,15 +7,35 @@ from json.encoder import JSONEncoder
 import petl
 from petl.util.base import dicts as _dicts
 from petl.io.sources import write_source_from_arg
-import codecs
 import iso8601
 import argparse
 import sys
 import shutil
-import tempfile
 import re
+import time
+import multiprocessing
+from queue import Full
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from sfmutils.result import BaseResult, Msg, STATUS_SUCCESS, STATUS_FAILURE, STATUS_RUNNING
 from sfmutils.utils import datetime_now
+from sfmutils.dedupe import DEDUPE_MEMORY, DEDUPE_MODES
+import gzip
+import io
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 from itertools import islice
 import xlsxwriter
 
@@ -25,6 +45,45 @@ CODE_WARC_MISSING = "warc_missing"
 CODE_NO_WARCS = "no_warcs"
 CODE_UNSUPPORTED_EXPORT_FORMAT = "unsupported_export_format"
 CODE_BAD_REQUEST = "bad_request"
+CODE_UNSUPPORTED_COMPRESSION = "unsupported_compression"
+
+# Map of compressions to file extensions.
+COMPRESSIONS = {
+    "gzip": "gz",
+    "zstd": "zst"
+}
+# Formats that may be compressed.
+COMPRESSIBLE_FORMATS = ("csv", "tsv", "json", "json_full", "dehydrate")
+# Map of columnar formats, which compress internally, to maps of compressions to their codecs.
+COLUMNAR_COMPRESSIONS = {
+    "parquet": {"gzip": "gzip", "zstd": "zstd"},
+    "arrow": {"zstd": "zstd"}
+}
+# Maximum number of seed ids in a request to the API. If use too many, will cause problems calling API.
+SEED_BATCH_SIZE = 20
+# Number of threads for checking WARC files.
+STAT_WORKERS = 16
+# Maximum number of rows in a row group of a columnar format.
+MAX_ROW_GROUP_SIZE = 64 * 1024
+
+# Number of items sent to a segment writer at a time.
+WRITER_BATCH_SIZE = 1000
+
+# Minimum number of seconds between progress status messages.
+PROGRESS_INTERVAL_SECS = 60
+# Number of items between checks whether to send a progress status message.
+PROGRESS_CHECK_ITEMS = 1000
+
+# Suffix of the directory next to the export path that segments are written to.
+STAGING_SUFFIX = ".staging"
+
+# Added to HTML segments.
+HTML_PREFIX = b"<html><head><meta charset='utf-8'></head>\n"
+HTML_SUFFIX = b"</html>"
+
+# Files in the working path for resuming an export.
+CHECKPOINT_FILENAME = "export_checkpoint.json"
+CHECKPOINT_SEEN_IDS_FILENAME = "export_checkpoint_seen_ids"
 
 
 class ExportResult(BaseResult):
@@ -39,9 +98,210 @@ class ExportResult(BaseResult):
         return "Export"
 
 
+class ExportProgress:
+    """
+    Keeps track of the progress of an export and periodically reports it.
+
+    Items are counted as they are iterated. WARCs and bytes done are based on the position
+    of the warc iter.
+    """
+
+    def __init__(self, warc_sizes, report_fn=None, interval_secs=PROGRESS_INTERVAL_SECS):
+        """
+        :param warc_sizes: map of WARC paths to sizes, in the order that they are iterated
+        :param report_fn: function called with this progress, no more than every interval_secs
+        :param interval_secs: minimum number of seconds between reports
+        """
+        self.warc_sizes = list(warc_sizes.values())
+        self.report_fn = report_fn
+        self.interval_secs = interval_secs
+        self.warc_iter = None
+        self.items = 0
+        self.segments = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+
+    def track(self, warc_iter, iter_items):
+        """
+        Returns an iterator over the items from the warc iter that counts them.
+        """
+        self.warc_iter = warc_iter
+        for iter_item in iter_items:
+            self.items += 1
+            if not self.items % PROGRESS_CHECK_ITEMS:
+                self.report()
+            yield iter_item
+
+    def segment_done(self):
+        self.segments += 1
+        self.report()
+
+    def report(self, force=False):
+        """
+        Calls the report function, unless it was called within interval_secs.
+        """
+        now = time.monotonic()
+        if self.report_fn and (force or now - self._last_report >= self.interval_secs):
+            self._last_report = now
+            self.report_fn(self)
+
+    def to_map(self):
+        elapsed_secs = time.monotonic() - self.started
+        warcs_done = min(self.warc_iter.position[0], len(self.warc_sizes)) if self.warc_iter else 0
+        bytes_done = sum(self.warc_sizes[:warcs_done])
+        bytes_total = sum(self.warc_sizes)
+        eta_secs = None
+        if bytes_done and elapsed_secs:
+            eta_secs = int(elapsed_secs * (bytes_total - bytes_done) / bytes_done)
+        return {
+            "warcs": warcs_done,
+            "warcs_total": len(self.warc_sizes),
+            "bytes": bytes_done,
+            "bytes_total": bytes_total,
+            "items": self.items,
+            "items_per_sec": round(self.items / elapsed_secs, 1) if elapsed_secs else None,
+            "segments": self.segments,
+            "eta_secs": eta_secs
+        }
+
+
+class ExportCheckpoint:
+    """
+    Keeps track of how far an export has reached, so that it can be resumed after the last
+    completed segment.
+
+    When a segment has been written, its filepath and the position of the warc iter after its
+    last item are saved. When deduping, the ids of the items are appended to a seen ids file as
+    they are yielded, and the size of the file after the segment's last item is saved.
+    """
+
+    def __init__(self, path, message, warc_paths, dedupe=False):
+        """
+        :param path: directory for the checkpoint files
+        :param message: the export message. A checkpoint is only loaded for the same message.
+        :param warc_paths: the WARCs being exported. A checkpoint is only loaded for the same WARCs.
+        :param dedupe: if True, keep track of the ids of the items
+        """
+        self.filepath = os.path.join(path, CHECKPOINT_FILENAME)
+        self.seen_ids_filepath = os.path.join(path, CHECKPOINT_SEEN_IDS_FILENAME)
+        self.message = message
+        self.warc_paths = list(warc_paths)
+        self.dedupe = dedupe
+        # Filepaths of the completed segments
+        self.segment_filepaths = []
+        # Position of the warc iter after the last completed segment
+        self.position = None
+        # Size of the seen ids file after the last completed segment
+        self.seen_ids_size = 0
+        self.warc_iter = None
+        self._seen_ids_file = None
+        # Size of the seen ids file once the tracked items have been written to it
+        self._tracked_seen_ids_size = 0
+        # Positions and seen ids file sizes of segments that have ended, but are still being written
+        self._segment_ends = deque()
+
+    def load(self):
+        """
+        Loads the checkpoint, if there is one for this export.
+
+        :return: True if loaded
+        """
+        if not os.path.exists(self.filepath):
+            return False
+        with open(self.filepath) as f:
+            checkpoint = json.load(f)
+        if checkpoint["message"] != self.message or checkpoint["warc_paths"] != self.warc_paths:
+            log.debug("Checkpoint %s is for another export", self.filepath)
+            return False
+        self.segment_filepaths = checkpoint["segment_filepaths"]
+        self.position = tuple(checkpoint["position"])
+        self.seen_ids_size = checkpoint["seen_ids_size"]
+        if self.dedupe:
+            # Drop any ids appended after the checkpoint was saved.
+            with open(self.seen_ids_filepath, "ab") as f:
+                f.truncate(self.seen_ids_size)
+        return True
+
+    def remove(self):
+        for filepath in (self.filepath, self.seen_ids_filepath):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def iter_kwargs(self):
+        """
+        Returns additional keyword arguments for the warc iter's iter() to continue from the checkpoint.
+        """
+        iter_kwargs = {}
+        if self.position:
+            iter_kwargs["start_position"] = self.position
+            if self.dedupe and self.seen_ids_size:
+                iter_kwargs["dedupe_ids"] = self._seen_ids()
+        return iter_kwargs
+
+    def _seen_ids(self):
+        with open(self.seen_ids_filepath, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def track(self, warc_iter, iter_items):
+        """
+        Returns an iterator over the items from the warc iter that keeps track of their ids.
+        """
+        self.warc_iter = warc_iter
+        if not self.dedupe:
+            yield from iter_items
+            return
+        self._tracked_seen_ids_size = self.seen_ids_size
+        self._seen_ids_file = open(self.seen_ids_filepath, "ab")
+        try:
+            # Drop any ids of items that were not in a completed segment.
+            self._seen_ids_file.truncate(self.seen_ids_size)
+            self._seen_ids_file.seek(0, os.SEEK_END)
+            for iter_item in iter_items:
+                self._seen_ids_file.write(json.dumps(iter_item.id).encode("utf-8"))
+                self._seen_ids_file.write(b"\n")
+                yield iter_item
+        finally:
+            self._tracked_seen_ids_size = self._seen_ids_file.tell()
+            self._seen_ids_file.close()
+            self._seen_ids_file = None
+
+    def segment_end(self):
+        """
+        Marks the end of the items of a segment, which may not have been written yet.
+        """
+        seen_ids_size = self._tracked_seen_ids_size
+        if self._seen_ids_file is not None:
+            self._seen_ids_file.flush()
+            seen_ids_size = self._seen_ids_file.tell()
+        self._segment_ends.append((self.warc_iter.position if self.warc_iter else None, seen_ids_size))
+
+    def segment_done(self, filepath):
+        """
+        Saves the checkpoint for a segment that has been written.
+
+        Segments must be done in the order that they ended.
+        """
+        self.position, self.seen_ids_size = self._segment_ends.popleft()
+        self.segment_filepaths.append(filepath)
+        checkpoint = {
+            "message": self.message,
+            "warc_paths": self.warc_paths,
+            "segment_filepaths": self.segment_filepaths,
+            "position": self.position,
+            "seen_ids_size": self.seen_ids_size
+        }
+        tmp_filepath = "{}.tmp".format(self.filepath)
+        with open(tmp_filepath, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_filepath, self.filepath)
+        log.debug("Saved checkpoint after %s", filepath)
+
+
 class BaseExporter(BaseConsumer):
     def __init__(self, api_base_url, warc_iter_cls, table_cls, working_path, mq_config=None, warc_base_path=None,
-                 limit_item_types=None, host=None):
+                 limit_item_types=None, host=None, warc_iter_workers=None, use_warc_index=False,
+                 segment_writers=None, writer_queue_size=100, progress_interval_secs=PROGRESS_INTERVAL_SECS):
         BaseConsumer.__init__(self, mq_config=mq_config, working_path=working_path, persist_messages=True)
         self.api_client = ApiClient(api_base_url)
         self.warc_iter_cls = warc_iter_cls
@@ -50,6 +310,22 @@ class BaseExporter(BaseConsumer):
         # This is for unit tests only.
         self.warc_base_path = warc_base_path
         self.host = host or os.environ.get("HOSTNAME", "localhost")
+        # Number of processes for iterating over WARCs. None to iterate in this process.
+        self.warc_iter_workers = warc_iter_workers
+        # If True, build and use sidecar indexes of the WARCs.
+        self.use_warc_index = use_warc_index
+        # Number of processes for formatting and writing table segments. None to write in this process.
+        self.segment_writers = segment_writers
+        # Maximum number of batches of items queued for each segment writer.
+        self.writer_queue_size = writer_queue_size
+        # Map of paths of the WARCs being exported to their sizes.
+        self.warc_sizes = OrderedDict()
+        # Minimum number of seconds between progress status messages.
+        self.progress_interval_secs = progress_interval_secs
+        self.progress = None
+        self.checkpoint = None
+        # Compression of the segments, if requested and supported by the format.
+        self.compression = None
 
     def on_message(self):
         assert self.message
@@ -59,6 +335,9 @@ class BaseExporter(BaseConsumer):
 
         self.result = ExportResult()
         self.result.started = datetime_now()
+        self.progress = None
+        self.checkpoint = None
+        self.compression = None
 
         # Send status indicating that it is running
         self._send_response_message(STATUS_RUNNING, self.routing_key, export_id, self.result)
@@ -74,10 +353,9 @@ class BaseExporter(BaseConsumer):
         if (collection_id or seed_ids) and not (collection_id and seed_ids):
             harvest_date_start = self.message.get("harvest_date_start")
             harvest_date_end = self.message.get("harvest_date_end")
-            # Only request seed ids if < 20. If use too many, will cause problems calling API.
-            # 20 is an arbitrary number
-            warc_paths = self._get_warc_paths(collection_id, seed_ids if len(seed_ids) <= 20 else None,
-                                              harvest_date_start, harvest_date_end)
+            warc_paths = self._get_warc_paths(collection_id, seed_ids, harvest_date_start, harvest_date_end)
+            self.progress = ExportProgress(self.warc_sizes, report_fn=self._send_progress_message,
+                                           interval_secs=self.progress_interval_secs)
             export_format = self.message["format"]
             export_segment_size = self.message["segment_size"]
             export_path = self.message["path"]
@@ -86,55 +364,88 @@ class BaseExporter(BaseConsumer):
                 self.message["item_date_start"]) if "item_date_start" in self.message else None
             item_date_end = iso8601.parse_date(
                 self.message["item_date_end"]) if "item_date_end" in self.message else None
-            temp_path = os.path.join(self.working_path, "tmp")
-            base_filepath = os.path.join(temp_path, export_id)
+            # Segments are written to a staging directory next to the export path, so on the same filesystem.
+            staging_path = "{}{}".format(export_path.rstrip(os.sep), STAGING_SUFFIX)
+            base_filepath = os.path.join(staging_path, export_id)
 
             if warc_paths:
 
-                # Clean the temp directory
-                if os.path.exists(temp_path):
-                    shutil.rmtree(temp_path)
-                os.makedirs(temp_path)
+                self.checkpoint = ExportCheckpoint(self.working_path, self.message, warc_paths, dedupe=dedupe)
+                if os.path.exists(staging_path) and self.checkpoint.load():
+                    # Keep the completed segments
+                    log.info("Resuming export %s after %s segments", export_id,
+                             len(self.checkpoint.segment_filepaths))
+                else:
+                    self.checkpoint.remove()
+                    # Clean up after a failed export
+                    if os.path.exists(staging_path):
+                        shutil.rmtree(staging_path)
+                    os.makedirs(staging_path)
 
                 # We get a lot of bang from PETL
                 export_formats = {
                     "csv": ("csv", petl.tocsv),
                     "tsv": ("tsv", petl.totsv),
-                    "html": ("html", petl.tohtml),
+                    "html": ("html", partial(_wrapped_export, petl.tohtml, HTML_PREFIX, HTML_SUFFIX)),
                     "xlsx": ("xlsx", to_xlsx),
                     "json": ("json", to_lineoriented_json)
                 }
+                if pyarrow:
+                    export_formats["parquet"] = ("parquet", to_parquet)
+                    export_formats["arrow"] = ("arrow", to_arrow)
                 # Other possibilities: XML, databases, HDFS
-                if export_format == "json_full":
+                dedupe_mode = self.message.get("dedupe_mode", DEDUPE_MEMORY)
+                compression = self.message.get("compression")
+                columnar_compression = None
+                if compression and export_format in COLUMNAR_COMPRESSIONS:
+                    columnar_compression = COLUMNAR_COMPRESSIONS[export_format].get(compression)
+                    if not columnar_compression:
+                        log.warning("Not compressing %s with %s", export_format, compression)
+                    compression = None
+                elif compression and export_format not in COMPRESSIBLE_FORMATS:
+                    log.warning("Not compressing %s", export_format)
+                    compression = None
+                self.compression = compression
+                if dedupe_mode not in DEDUPE_MODES:
+                    self.result.errors.append(
+                        Msg(CODE_BAD_REQUEST, "{} is not a supported dedupe mode".format(dedupe_mode)))
+                    self.result.success = False
+                elif compression and (compression not in COMPRESSIONS or (compression == "zstd" and not zstandard)):
+                    self.result.errors.append(
+                        Msg(CODE_UNSUPPORTED_COMPRESSION, "{} is not supported".format(compression)))
+                    self.result.success = False
+                elif export_format == "json_full":
                     self._full_json_export(warc_paths, base_filepath, dedupe, item_date_start, item_date_end, seed_uids,
                                            export_segment_size)
                 elif export_format == "dehydrate":
                     tables = self.table_cls(warc_paths, dedupe, item_date_start, item_date_end, seed_uids,
                                             export_segment_size)
-                    for idx, table in enumerate(tables):
-                        filepath = "{}_{}.txt".format(base_filepath, str(idx + 1).zfill(3))
-                        log.info("Exporting to %s", filepath)
-                        petl.totext(table, filepath, template="{{{}}}\n".format(tables.id_field()))
+                    tables.iter_kwargs = self._iter_kwargs()
+                    tables.progress = self.progress
+                    tables.checkpoint = self.checkpoint
+                    self._table_export(tables, base_filepath, self._extension("txt"), self._compressed_export_fn(
+                        partial(petl.totext, template="{{{}}}\n".format(tables.id_field()))))
                 elif export_format in export_formats:
                     tables = self.table_cls(warc_paths, dedupe, item_date_start, item_date_end, seed_uids,
                                             export_segment_size)
-                    for idx, table in enumerate(tables):
-                        filepath = "{}_{}.{}".format(base_filepath, str(idx + 1).zfill(3),
-                                                     export_formats[export_format][0])
-                        log.info("Exporting to %s", filepath)
-                        export_formats[export_format][1](table, filepath)
-                        if export_format == 'html':
-                            self._file_fix(filepath, prefix="<html><head><meta charset='utf-8'></head>\n",
-                                           suffix="</html>")
+                    tables.iter_kwargs = self._iter_kwargs()
+                    tables.progress = self.progress
+                    tables.checkpoint = self.checkpoint
+                    export_fn = export_formats[export_format][1]
+                    if export_format in ("parquet", "arrow"):
+                        export_fn = partial(export_fn, column_types=tables._column_types(),
+                                            batch_size=min(export_segment_size or MAX_ROW_GROUP_SIZE,
+                                                           MAX_ROW_GROUP_SIZE))
+                        if columnar_compression:
+                            export_fn = partial(export_fn, compression=columnar_compression)
+                    self._table_export(tables, base_filepath, self._extension(export_formats[export_format][0]),
+                                       self._compressed_export_fn(export_fn))
                 else:
                     self.result.errors.append(
                         Msg(CODE_UNSUPPORTED_EXPORT_FORMAT, "{} is not supported".format(export_format)))
                     self.result.success = False
-
-                # Move files from temp path to export path
-                if os.path.exists(export_path):
-                    shutil.rmtree(export_path)
-                shutil.move(temp_path, export_path)
+                self.checkpoint.remove()
+                self._publish(staging_path, export_path)
 
             else:
                 self.result.errors.append(Msg(CODE_NO_WARCS, "No WARC files from which to export"))
@@ -145,37 +456,234 @@ class BaseExporter(BaseConsumer):
             self.result.success = False
 
         self.result.ended = datetime_now()
+        if self.progress:
+            log.info("Export %s progress: %s", export_id, self.progress.to_map())
         self._send_response_message(STATUS_SUCCESS if self.result.success else STATUS_FAILURE, self.routing_key,
-                                    export_id, self.result)
+                                    export_id, self.result, progress=self.progress)
 
-    def _file_fix(self, filepath, prefix=None, suffix=None):
+    @staticmethod
+    def _publish(staging_path, export_path):
         """
-        create a temp file to save the large file object, don't
-        need to load file to memory
+        Moves the segments from the staging directory to the export directory, replacing any
+        previous export.
+
+        Each segment is renamed, so it is not copied and appears complete or not at all.
         """
-        with tempfile.NamedTemporaryFile(dir=self.working_path, delete=False) as outfile:
-            if prefix:
-                outfile.write(prefix)
-            shutil.copyfileobj(open(filepath, 'r'), outfile)
-            if suffix:
-                outfile.write(suffix)
-        shutil.move(outfile.name, filepath)
+        if os.path.exists(export_path):
+            for filename in os.listdir(export_path):
+                filepath = os.path.join(export_path, filename)
+                if os.path.isdir(filepath) and not os.path.islink(filepath):
+                    shutil.rmtree(filepath)
+                else:
+                    os.remove(filepath)
+        else:
+            os.makedirs(export_path)
+        for filename in sorted(os.listdir(staging_path)):
+            os.replace(os.path.join(staging_path, filename), os.path.join(export_path, filename))
+        os.rmdir(staging_path)
+        log.debug("Published %s", export_path)
+
+    def _table_export(self, tables, base_filepath, extension, export_fn):
+        """
+        Exports each segment of the tables to a file with export_fn(table, filepath).
+
+        :return: the filepaths of the segments
+        """
+        if self.segment_writers and self.segment_writers > 1:
+            return self._parallel_table_export(tables, base_filepath, extension, export_fn)
+
+        filepaths = self._completed_segment_filepaths()
+        for table in tables:
+            filepath = "{}_{}.{}".format(base_filepath, str(len(filepaths) + 1).zfill(3), extension)
+            log.info("Exporting to %s", filepath)
+            export_fn(table, filepath)
+            filepaths.append(filepath)
+            self._segment_end()
+            self._segment_done(filepath)
+        return filepaths
+
+    def _parallel_table_export(self, tables, base_filepath, extension, export_fn):
+        """
+        Exports each segment of the tables, with a pool of writer processes formatting and writing
+        segments concurrently while this process produces the items from the WARCs.
+
+        Each writer is fed by a queue of at most writer_queue_size batches of items, so up to
+        segment_writers * writer_queue_size * WRITER_BATCH_SIZE items are buffered.
+        """
+        context = multiprocessing.get_context(self._worker_start_method())
+        filepaths = self._completed_segment_filepaths()
+        writers = deque()
+        queue = None
+        writer = None
+        segment_count = 0
+        batch = []
+        try:
+            for iter_item in tables.iter_items():
+                if writer is None or (tables.segment_row_size and segment_count == tables.segment_row_size):
+                    if writer is not None:
+                        self._put_writer_batch(queue, writer, batch)
+                        self._put_writer_batch(queue, writer, None)
+                        batch = []
+                    # Wait for the oldest writer if all are busy.
+                    if len(writers) == self.segment_writers:
+                        self._join_writer(*writers.popleft())
+                    filepath = "{}_{}.{}".format(base_filepath, str(len(filepaths) + 1).zfill(3), extension)
+                    log.info("Exporting to %s", filepath)
+                    queue = context.Queue(self.writer_queue_size)
+                    writer = context.Process(target=_write_segment, args=(tables, export_fn, filepath, queue),
+                                             name="segment_writer_{}".format(len(filepaths) + 1))
+                    writer.start()
+                    writers.append((writer, filepath, queue))
+                    filepaths.append(filepath)
+                    segment_count = 0
+                batch.append(iter_item.item)
+                segment_count += 1
+                if segment_count == tables.segment_row_size:
+                    self._segment_end()
+                if len(batch) == WRITER_BATCH_SIZE:
+                    self._put_writer_batch(queue, writer, batch)
+                    batch = []
+            if writer is not None:
+                if segment_count != tables.segment_row_size:
+                    self._segment_end()
+                self._put_writer_batch(queue, writer, batch)
+                self._put_writer_batch(queue, writer, None)
+            while writers:
+                self._join_writer(*writers.popleft())
+        except BaseException:
+            # Otherwise, the writers wait for more items forever. They may inherit the SIGTERM handler, so are killed.
+            for writer, _, writer_queue in writers:
+                writer.kill()
+                writer.join()
+                # Don't wait at exit to flush items that will never be read.
+                writer_queue.cancel_join_thread()
+            raise
+        return filepaths
+
+    @staticmethod
+    def _put_writer_batch(queue, writer, batch):
+        """
+        Puts a batch of items (or None to end the segment) on a writer's queue, blocking while the queue
+        is full unless the writer has died.
+        """
+        while True:
+            try:
+                queue.put(batch, timeout=1)
+                return
+            except Full:
+                if not writer.is_alive():
+                    raise Exception("{} exited with {}".format(writer.name, writer.exitcode))
+
+    def _join_writer(self, writer, filepath, queue):
+        # The queue is referenced until the writer is done, since a writer that isn't forked may not have
+        # received it yet.
+        writer.join()
+        if writer.exitcode != 0:
+            raise Exception("Writing {} failed with {}".format(filepath, writer.exitcode))
+        log.debug("Finished writing %s", filepath)
+        self._segment_done(filepath)
+
+    def _completed_segment_filepaths(self):
+        """
+        Returns the filepaths of the segments completed before resuming.
+        """
+        return list(self.checkpoint.segment_filepaths) if self.checkpoint else []
+
+    def _segment_end(self):
+        """
+        Called when all of the items of a segment have been iterated.
+        """
+        if self.checkpoint:
+            self.checkpoint.segment_end()
+
+    def _segment_done(self, filepath):
+        """
+        Called when a segment has been written.
+        """
+        if self.checkpoint:
+            self.checkpoint.segment_done(filepath)
+        if self.progress:
+            self.progress.segment_done()
 
     def _full_json_export(self, warc_paths, base_filepath, dedupe, item_date_start, item_date_end, seed_uids,
                           export_segment_size):
 
-        warcs = self.warc_iter_cls(warc_paths, seed_uids).iter(dedupe=dedupe,
-                                                               item_date_start=item_date_start,
-                                                               item_date_end=item_date_end,
-                                                               limit_item_types=self.limit_item_types)
+        warc_iter = self.warc_iter_cls(warc_paths, seed_uids)
+        iter_kwargs = self._iter_kwargs()
+        if self.checkpoint:
+            iter_kwargs.update(self.checkpoint.iter_kwargs())
+        warcs = warc_iter.iter(dedupe=dedupe, item_date_start=item_date_start, item_date_end=item_date_end,
+                               limit_item_types=self.limit_item_types, **iter_kwargs)
+        if self.checkpoint:
+            warcs = self.checkpoint.track(warc_iter, warcs)
+        if self.progress:
+            warcs = self.progress.track(warc_iter, warcs)
 
-        for idx, statuses in enumerate(self._chunk_json(warcs, export_segment_size)):
-            export_filepath = "{}_{}.json".format(base_filepath, str(idx + 1).zfill(3))
+        filepaths = self._completed_segment_filepaths()
+        for statuses in self._chunk_json(warcs, export_segment_size):
+            export_filepath = "{}_{}.{}".format(base_filepath, str(len(filepaths) + 1).zfill(3),
+                                                self._extension("json"))
             log.info("Exporting to %s", export_filepath)
-            with codecs.open(export_filepath, "w") as f:
-                for status in statuses:
-                    json.dump(status.item, f)
-                    f.write("\n")
+            with self._export_source(export_filepath).open("wb") as buf:
+                with io.TextIOWrapper(buf, encoding="utf-8") as f:
+                    for status in statuses:
+                        json.dump(status.item, f)
+                        f.write("\n")
+            filepaths.append(export_filepath)
+            self._segment_end()
+            self._segment_done(export_filepath)
+
+    def _compression_options(self):
+        """
+        Returns the compression, level, and threads requested by the message.
+        """
+        if not self.compression:
+            return None, None, None
+        return self.compression, self.message.get("compression_level"), self.message.get("compression_threads")
+
+    def _extension(self, extension):
+        """
+        Returns the file extension, with the compression's extension added.
+        """
+        compression, _, _ = self._compression_options()
+        return "{}.{}".format(extension, COMPRESSIONS[compression]) if compression else extension
+
+    def _export_source(self, filepath):
+        """
+        Returns a PETL source for writing a segment, compressed if requested.
+        """
+        compression, level, threads = self._compression_options()
+        if compression:
+            return CompressedSource(filepath, compression, level=level, threads=threads)
+        return write_source_from_arg(filepath)
+
+    def _compressed_export_fn(self, export_fn):
+        """
+        Returns an export function that compresses, if requested.
+        """
+        compression, level, threads = self._compression_options()
+        if compression:
+            return partial(_compressed_export, export_fn, compression, level, threads)
+        return export_fn
+
+    def _iter_kwargs(self):
+        """
+        Returns additional keyword arguments for the warc iter's iter().
+        """
+        iter_kwargs = {}
+        if self.warc_iter_workers:
+            iter_kwargs["workers"] = self.warc_iter_workers
+            if self._worker_start_method():
+                iter_kwargs["start_method"] = self._worker_start_method()
+        if self.use_warc_index:
+            iter_kwargs["use_index"] = True
+        if self.message and self.message.get("dedupe_mode", DEDUPE_MEMORY) != DEDUPE_MEMORY:
+            iter_kwargs["dedupe_mode"] = self.message["dedupe_mode"]
+            # Seen ids database goes in the working path.
+            iter_kwargs["dedupe_path"] = self.working_path
+            if "dedupe_max_ids_in_memory" in self.message:
+                iter_kwargs["dedupe_max_ids_in_memory"] = self.message["dedupe_max_ids_in_memory"]
+        return iter_kwargs
 
     @staticmethod
     def _chunk_json(warcs, chunk_size):
@@ -195,21 +703,48 @@ class BaseExporter(BaseConsumer):
     def _get_warc_paths(self, collection_id, seed_ids, harvest_date_start, harvest_date_end):
         """
         Get list of WARC files and make sure they exists.
+
+        Seed ids are requested in batches of SEED_BATCH_SIZE, which are queried concurrently.
+
+        The WARC files are checked concurrently. The list is ordered by path, i.e., by directory
+        and then harvest timestamp, for locality when reading. The sizes are recorded in self.warc_sizes.
         """
-        warc_paths = []
         log.debug("Getting warcs for collection %s", collection_id)
-        for warc in self.api_client.warcs(collection_id=collection_id, seed_ids=seed_ids,
-                                          harvest_date_start=harvest_date_start, harvest_date_end=harvest_date_end):
+        if seed_ids and len(seed_ids) > SEED_BATCH_SIZE:
+            warcs = self.api_client.concurrent_warcs(
+                [dict(collection_id=collection_id, seed_ids=seed_ids[i:i + SEED_BATCH_SIZE],
+                      harvest_date_start=harvest_date_start, harvest_date_end=harvest_date_end)
+                 for i in range(0, len(seed_ids), SEED_BATCH_SIZE)])
+        else:
+            warcs = self.api_client.warcs(collection_id=collection_id, seed_ids=seed_ids,
+                                          harvest_date_start=harvest_date_start, harvest_date_end=harvest_date_end)
+        warc_paths = []
+        seen_warc_paths = set()
+        for warc in warcs:
             warc_path = os.path.join(self.warc_base_path, warc["path"]) if self.warc_base_path else warc["path"]
-            if os.path.exists(warc_path):
+            if warc_path not in seen_warc_paths:
+                seen_warc_paths.add(warc_path)
                 warc_paths.append(warc_path)
-            else:
-                self.result.errors.append(Msg(CODE_WARC_MISSING, "{} is missing".format(warc_path)))
-                self.result.success = False
-        log.debug("Warcs are %s", warc_paths)
-        return warc_paths
 
-    def _send_response_message(self, status, export_request_routing_key, export_id, export_result):
+        self.warc_sizes = OrderedDict()
+        with ThreadPoolExecutor(max_workers=STAT_WORKERS, thread_name_prefix="warc_stat") as executor:
+            for warc_path, warc_size in zip(warc_paths, executor.map(_warc_size, warc_paths)):
+                if warc_size is not None:
+                    self.warc_sizes[warc_path] = warc_size
+                else:
+                    self.result.errors.append(Msg(CODE_WARC_MISSING, "{} is missing".format(warc_path)))
+                    self.result.success = False
+        self.warc_sizes = OrderedDict(sorted(self.warc_sizes.items()))
+        log.debug("Warcs are %s (%s bytes)", list(self.warc_sizes), sum(self.warc_sizes.values()))
+        return list(self.warc_sizes)
+
+    def _send_progress_message(self, progress):
+        log.debug("Export %s progress: %s", self.message["id"], progress.to_map())
+        self._send_response_message(STATUS_RUNNING, self.routing_key, self.message["id"], self.result,
+                                    progress=progress)
+
+    def _send_response_message(self, status, export_request_routing_key, export_id, export_result,
+                               progress=None):
         # Just add additional info to job message
         message = {
             "id": export_id,
@@ -227,6 +762,9 @@ class BaseExporter(BaseConsumer):
         if export_result.ended:
             message["date_ended"] = export_result.ended.isoformat()
 
+        if progress:
+            message["progress"] = progress.to_map()
+
         # Routing key may be none
         response_routing_key = export_request_routing_key.replace("start", "status")
         self._publish_message(response_routing_key, message)
@@ -263,6 +801,15 @@ class BaseExporter(BaseConsumer):
         service_parser.add_argument("api")
         service_parser.add_argument("working_path")
         service_parser.add_argument("--skip-resume", action="store_true")
+        service_parser.add_argument("--workers", type=int, help="Number of processes for iterating over WARCs.")
+        service_parser.add_argument("--use-index", action="store_true", help="Build and use sidecar indexes of WARCs.")
+        service_parser.add_argument("--writers", type=int, help="Number of processes for writing segments.")
+        service_parser.add_argument("--serializer", choices=list(SERIALIZERS), default="json",
+                                    help="Serializer for sent messages.")
+        service_parser.add_argument("--concurrency", type=int, help="Number of exports to perform at a time.")
+        service_parser.add_argument("--prefetch", type=int, help="Number of messages to prefetch.")
+        service_parser.add_argument("--progress-interval", type=int, default=PROGRESS_INTERVAL_SECS,
+                                    help="Minimum number of seconds between progress status messages.")
 
         file_parser = subparsers.add_parser("file", help="Export based on a file.")
         file_parser.add_argument("filepath", help="Filepath of the export file.")
@@ -271,6 +818,9 @@ class BaseExporter(BaseConsumer):
         file_parser.add_argument("--host")
         file_parser.add_argument("--username")
         file_parser.add_argument("--password")
+        file_parser.add_argument("--workers", type=int, help="Number of processes for iterating over WARCs.")
+        file_parser.add_argument("--use-index", action="store_true", help="Build and use sidecar indexes of WARCs.")
+        file_parser.add_argument("--writers", type=int, help="Number of processes for writing segments.")
 
         args = parser.parse_args()
 
@@ -281,6 +831,13 @@ class BaseExporter(BaseConsumer):
             exporter = cls(args.api, args.working_path,
                            mq_config=MqConfig(args.host, args.username, args.password, EXCHANGE,
                                               {queue: routing_keys}))
+            exporter.warc_iter_workers = args.workers
+            exporter.use_warc_index = args.use_index
+            exporter.segment_writers = args.writers
+            exporter.serializer = args.serializer
+            exporter.concurrency = args.concurrency
+            exporter.prefetch_count = args.prefetch
+            exporter.progress_interval_secs = args.progress_interval
             if not args.skip_resume:
                 exporter.resume_from_file()
             exporter.run()
@@ -288,6 +845,9 @@ class BaseExporter(BaseConsumer):
             mq_config = MqConfig(args.host, args.username, args.password, EXCHANGE, None) \
                 if args.host and args.username and args.password else None
             exporter = cls(args.api, args.working_path, mq_config=mq_config)
+            exporter.warc_iter_workers = args.workers
+            exporter.use_warc_index = args.use_index
+            exporter.segment_writers = args.writers
             exporter.message_from_file(args.filepath)
             if exporter.result:
                 log.info("Result is: %s", exporter.result)
@@ -312,6 +872,12 @@ class BaseTable(petl.Table):
         self.warc_iter_cls = warc_iter_cls
         self.limit_item_types = limit_item_types
         self.segment_row_size = segment_row_size
+        # Additional keyword arguments for the warc iter's iter(), e.g., workers.
+        self.iter_kwargs = {}
+        # ExportProgress that counts the items, if any.
+        self.progress = None
+        # ExportCheckpoint to continue from and keep up to date, if any.
+        self.checkpoint = None
 
     def _header_row(self):
         """
@@ -327,19 +893,47 @@ class BaseTable(petl.Table):
         """
         return ()
 
+    def _column_types(self):
+        """
+        Returns a tuple of column types, matching the header row, for columnar formats.
+
+        Types are "string", "int", "float", "bool", or "datetime". None, or None for a column,
+        is a string. A value that doesn't fit its column type fails the export.
+        """
+        return None
+
     def id_field(self):
         """
         Name of the field containing the identifier. This should watch one of the header labels.
         """
         pass
 
+    def iter_items(self):
+        """
+        Returns an iterator over the IterItems from the WARCs.
+        """
+        warc_iter = self.warc_iter_cls(self.warc_paths, self.seed_uids)
+        iter_kwargs = dict(self.iter_kwargs)
+        if self.checkpoint is not None:
+            iter_kwargs.update(self.checkpoint.iter_kwargs())
+        iter_items = iter(warc_iter.iter(dedupe=self.dedupe, item_date_start=self.item_date_start,
+                                         item_date_end=self.item_date_end, limit_item_types=self.limit_item_types,
+                                         **iter_kwargs))
+        if self.checkpoint is not None:
+            iter_items = self.checkpoint.track(warc_iter, iter_items)
+        if self.progress is not None:
+            iter_items = self.progress.track(warc_iter, iter_items)
+        return iter_items
+
+    def __getstate__(self):
+        # The progress and checkpoint are kept by the exporter, so they aren't sent to writer processes.
+        state = self.__dict__.copy()
+        state["progress"] = None
+        state["checkpoint"] = None
+        return state
+
     def __iter__(self):
-        warcs = self.warc_iter_cls(self.warc_paths,
-                                   self.seed_uids).iter(dedupe=self.dedupe,
-                                                        item_date_start=self.item_date_start,
-                                                        item_date_end=self.item_date_end,
-                                                        limit_item_types=self.limit_item_types)
-        iterator_warc = iter(warcs)
+        iterator_warc = self.iter_items()
         split_size = self.segment_row_size - 1 if self.segment_row_size else None
         # make the iterator warc to chunks based on the row size
         for post in iterator_warc:
@@ -359,6 +953,95 @@ class BaseTable(petl.Table):
                 log.warning("Invalid key in %s", json.dumps(post.item, indent=4))
 
 
+def _warc_size(warc_path):
+    """
+    Returns the size of the WARC file or None if it does not exist.
+    """
+    try:
+        return os.stat(warc_path).st_size
+    except OSError:
+        return None
+
+
+def _write_segment(table, export_fn, filepath, queue):
+    """
+    Writes a segment from batches of items received on the queue until None is received.
+
+    This is module-level so that it can be run by a writer process.
+    """
+    def rows():
+        yield table._header_row()
+        for batch in iter(queue.get, None):
+            for item in batch:
+                yield table._row(item)
+
+    export_fn(rows(), filepath)
+
+
+class CompressedSource:
+    """
+    A PETL source that compresses with gzip or zstd while writing.
+    """
+    def __init__(self, filename, compression, level=None, threads=None):
+        """
+        :param filename: the filepath
+        :param compression: gzip or zstd
+        :param level: compression level. Default is 6 for gzip and 3 for zstd.
+        :param threads: number of threads for compressing. Only supported for zstd.
+        """
+        assert compression in COMPRESSIONS
+        self.filename = filename
+        self.compression = compression
+        self.level = level
+        self.threads = threads
+
+    @contextmanager
+    def open(self, mode="wb"):
+        assert "w" in mode
+        with io.open(self.filename, "wb") as f:
+            if self.compression == "gzip":
+                level = self.level if self.level is not None else 6
+                with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=level) as compressed_f:
+                    yield compressed_f
+            else:
+                level = self.level if self.level is not None else 3
+                compressor = zstandard.ZstdCompressor(level=level, threads=self.threads or 0)
+                with compressor.stream_writer(f) as compressed_f:
+                    yield compressed_f
+
+
+def _compressed_export(export_fn, compression, level, threads, table, filepath):
+    export_fn(table, CompressedSource(filepath, compression, level=level, threads=threads))
+
+
+class WrappedSource:
+    """
+    A PETL source that writes a prefix before and a suffix after what is written to another source.
+    """
+    def __init__(self, source, prefix=None, suffix=None):
+        """
+        :param source: the PETL source
+        :param prefix: bytes to write first
+        :param suffix: bytes to write last
+        """
+        self.source = source
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @contextmanager
+    def open(self, mode="wb"):
+        with self.source.open(mode) as f:
+            if self.prefix:
+                f.write(self.prefix)
+            yield f
+            if self.suffix:
+                f.write(self.suffix)
+
+
+def _wrapped_export(export_fn, prefix, suffix, table, source):
+    export_fn(table, WrappedSource(write_source_from_arg(source), prefix=prefix, suffix=suffix))
+
+
 class DateEncoder(JSONEncoder):
     def default(self, obj):
         if hasattr(obj, 'isoformat'):
@@ -373,12 +1056,13 @@ def to_lineoriented_json(table, source):
     """
     source = write_source_from_arg(source)
     encoder = DateEncoder()
-    with source.open("w") as f:
-        for d in _dicts(table):
-            #for chunk in encoder.iterencode(d):
-            #    f.write(chunk)
-            f.write(encoder.encode(d))
-            f.write("\n")
+    with source.open("wb") as buf:
+        with io.TextIOWrapper(buf, encoding="utf-8") as f:
+            for d in _dicts(table):
+                #for chunk in encoder.iterencode(d):
+                #    f.write(chunk)
+                f.write(encoder.encode(d))
+                f.write("\n")
 
 
 def to_xlsx(table, source):
@@ -402,3 +1086,94 @@ def to_xlsx(table, source):
                 worksheet.write(idx, idy, col)
 
     workbook.close()
+
+
+def _arrow_type(column_type):
+    """
+    Returns the Arrow type for a column type. Columns without a type are strings, since
+    the schema is fixed before all of the rows have been seen.
+    """
+    return {
+        "int": pyarrow.int64(),
+        "float": pyarrow.float64(),
+        "bool": pyarrow.bool_(),
+        "datetime": pyarrow.timestamp("us", tz="UTC")
+    }.get(column_type, pyarrow.string())
+
+
+def _fits_column_type(value, column_type):
+    """
+    Returns True if a value can be stored exactly as a column type.
+    """
+    if column_type == "int":
+        return isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63
+    if column_type == "float":
+        # Larger ints can't be represented exactly by a double.
+        return isinstance(value, float) or (isinstance(value, int) and not isinstance(value, bool)
+                                             and abs(value) <= 2 ** 53)
+    if column_type == "bool":
+        return isinstance(value, bool)
+    if column_type == "datetime":
+        return isinstance(value, datetime)
+    return True
+
+
+def _arrow_array(name, values, column_type):
+    """
+    Returns an Arrow array of the values of a column.
+
+    Raises a ValueError for a value that doesn't fit the column type, rather than letting
+    pyarrow truncate or otherwise convert it.
+    """
+    arrow_type = _arrow_type(column_type)
+    if arrow_type == pyarrow.string():
+        return pyarrow.array([value if value is None or isinstance(value, str)
+                              else value.isoformat() if isinstance(value, datetime) else str(value)
+                              for value in values], type=arrow_type)
+    for value in values:
+        if value is not None and not _fits_column_type(value, column_type):
+            raise ValueError("{!r} in column {} is not a {}".format(value, name, column_type))
+    return pyarrow.array(values, type=arrow_type)
+
+
+def _record_batches(table, batch_size, column_types=None):
+    """
+    Returns the schema and an iterator over record batches of at most batch_size rows of a table.
+
+    Only one batch of rows is held in memory at a time.
+    """
+    rows = iter(table)
+    header = [str(name) for name in next(rows, ())]
+    column_types = column_types or [None] * len(header)
+    schema = pyarrow.schema([(name, _arrow_type(column_type)) for name, column_type in zip(header, column_types)])
+
+    def batches():
+        batch_rows = list(islice(rows, batch_size))
+        while batch_rows:
+            yield pyarrow.RecordBatch.from_arrays(
+                [_arrow_array(name, values, column_type)
+                 for name, column_type, values in zip(header, column_types, zip(*batch_rows))], schema=schema)
+            batch_rows = list(islice(rows, batch_size))
+
+    return schema, batches()
+
+
+def to_parquet(table, source, column_types=None, batch_size=MAX_ROW_GROUP_SIZE, compression="snappy"):
+    """
+    Write table to Parquet, with a row group for each batch of rows.
+    """
+    schema, batches = _record_batches(table, batch_size, column_types=column_types)
+    with pyarrow.parquet.ParquetWriter(source, schema, compression=compression) as writer:
+        for batch in batches:
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+
+
+def to_arrow(table, source, column_types=None, batch_size=MAX_ROW_GROUP_SIZE, compression=None):
+    """
+    Write table to an Arrow IPC (Feather V2) file, with a record batch for each batch of rows.
+    """
+    schema, batches = _record_batches(table, batch_size, column_types=column_types)
+    with pyarrow.ipc.new_file(source, schema,
+                              options=pyarrow.ipc.IpcWriteOptions(compression=compression)) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
@@ -53,13 +53,13 @@ def main(sys_argv):
             else:
                 collection_ids.append(collections[0]["collection_id"])
     warc_filepaths = set()
-    for collection_id in collection_ids:
-        log.debug("Looking up warcs for %s", collection_id)
-        warcs = api_client.warcs(collection_id=collection_id, harvest_date_start=args.harvest_start,
-                                 harvest_date_end=args.harvest_end,
-                                 created_date_start=args.warc_start, created_date_end=args.warc_end)
-        for warc in warcs:
-            warc_filepaths.add(warc["path"])
+    log.debug("Looking up warcs for %s", collection_ids)
+    warcs = api_client.concurrent_warcs([dict(collection_id=collection_id, harvest_date_start=args.harvest_start,
+                                              harvest_date_end=args.harvest_end, created_date_start=args.warc_start,
+                                              created_date_end=args.warc_end)
+                                         for collection_id in collection_ids])
+    for warc in warcs:
+        warc_filepaths.add(warc["path"])
     sep = "\n" if args.newline else " "
     return sep.join(sorted(warc_filepaths))
 
@@ -6,7 +6,7 @@ import argparse
 import sys
 import threading
 import signal
-from collections import Counter, OrderedDict
+from collections import Counter, OrderedDict, namedtuple, deque
 import os
 import re
 import codecs
@@ -14,16 +14,31 @@ import uuid
 import iso8601
 from datetime import date
 from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
 
-from sfmutils.consumer import BaseConsumer, MqConfig, EXCHANGE
-from sfmutils.state_store import JsonHarvestStateStore, DelayedSetStateStoreAdapter
+from sfmutils.consumer import BaseConsumer, MqConfig, EXCHANGE, SERIALIZERS
+from sfmutils.state_store import JsonHarvestStateStore, DelayedSetStateStoreAdapter, STATE_STORES
 from sfmutils.warcprox import warced
+from sfmutils.inotify import DirectoryWatcher, inotify_available
 from sfmutils.utils import safe_string, datetime_from_stamp, datetime_now
 from sfmutils.result import BaseResult, Msg, STATUS_SUCCESS, STATUS_FAILURE, STATUS_RUNNING, STATUS_PAUSED, \
     STATUS_STOPPING
 
 log = logging.getLogger(__name__)
 
+# Size of the chunks read when computing a WARC's digest.
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# The result journal is appended to <result filepath>.journal.
+RESULT_JOURNAL_SUFFIX = ".journal"
+# Number of entries after which the result journal is compacted into the result file.
+RESULT_JOURNAL_COMPACT_ENTRIES = 100
+
+# Queued to stop the WARC processing thread.
+_STOP_WARC_PROCESSING = object()
+
+WarcInfo = namedtuple('WarcInfo', ['path', 'bytes', 'sha1', 'date_created'])
+
 
 class HarvestResult(BaseResult):
     """
@@ -82,9 +97,25 @@ class HarvestResult(BaseResult):
             summary.update(stats)
         return summary
 
-    def add_warc(self, filepath):
+    def add_warc(self, filepath, warc_bytes=None):
         self.warcs.append(filepath)
-        self.warc_bytes += os.path.getsize(filepath)
+        self.warc_bytes += warc_bytes if warc_bytes is not None else os.path.getsize(filepath)
+
+    def merge(self, result):
+        """
+        Adds the stats, token updates, uids, messages and success of another result to this result.
+        """
+        for day, stats in result.stats().items():
+            for item, count in stats.items():
+                self.increment_stats(item, count=count, day=day)
+        self.token_updates.update(result.token_updates)
+        self.uids.update(result.uids)
+        self.harvest_counter.update(result.harvest_counter)
+        self.infos.extend(result.infos)
+        self.warnings.extend(result.warnings)
+        self.errors.extend(result.errors)
+        if not result.success:
+            self.success = False
 
 
 # Any exception thrown by the harvester.
@@ -119,12 +150,18 @@ class BaseHarvester(BaseConsumer):
 
     def __init__(self, working_path, mq_config=None, stream_restart_interval_secs=30 * 60, debug=False,
                  use_warcprox=True, queue_warc_files_interval_secs=5 * 60, warc_rollover_secs=30 * 60,
-                 debug_warcprox=False, tries=3, host=None):
+                 debug_warcprox=False, tries=3, host=None, state_store_cls=JsonHarvestStateStore,
+                 warc_processing_workers=1, watch_warc_files=True, async_status=False, status_min_interval_secs=0,
+                 status_stats_deltas=False, persistent_warcprox=False, warc_rollover_idle_secs=5):
+        # Per-WARC state store and result for WARCs being processed by a worker.
+        self._warc_local = threading.local()
         BaseConsumer.__init__(self, working_path=working_path, mq_config=mq_config, persist_messages=True)
         self.stream_restart_interval_secs = stream_restart_interval_secs
         self.is_streaming = False
         self.routing_key = ""
         self.warc_temp_dir = None
+        # Where the temp directories for WARC files are created. Otherwise, the working path.
+        self._warc_temp_parent_path = None
         self.stop_harvest_seeds_event = threading.Event()
         self.stop_harvest_loop_event = threading.Event()
         self.restart_stream_timer = None
@@ -133,11 +170,40 @@ class BaseHarvester(BaseConsumer):
         self.debug_warcprox = debug_warcprox
         self.use_warcprox = use_warcprox
         self.warc_processing_queue = Queue()
+        # Once processing a WARC fails, neither it nor any later WARC of the harvest is committed.
+        self._warc_processing_failed = False
         self.result_filepath = None
+        # Number of entries in the result journal and what had been persisted as of the last entry.
+        self._result_journal_entries = 0
+        self._saved_result_counts = None
+        self._saved_result_stats = None
         self.queue_warc_files_interval_secs = queue_warc_files_interval_secs
         self.queue_warc_files_timer = None
+        # Queue WARC files when they are completed, using inotify. Otherwise, the temp dir is listed periodically.
+        self.watch_warc_files = watch_warc_files
+        self.warc_watcher = None
+        # Filenames of WARC files that have been queued for the current harvest.
+        self._queued_warc_filenames = set()
+        self._queued_warc_filenames_lock = threading.Lock()
         self.warc_rollover_secs = warc_rollover_secs
+        # For streams, keep a single warcprox running for the harvest rather than one per stream restart.
+        # The WARC for each restart is closed once warcprox has not written for warc_rollover_idle_secs.
+        self.persistent_warcprox = persistent_warcprox
+        self.warc_rollover_idle_secs = warc_rollover_idle_secs
+        self._warcprox = None
+        # Publish messages from a background thread, coalescing queued status messages.
+        self.async_status = async_status
+        self.status_min_interval_secs = status_min_interval_secs
+        # Send the changes to stats since the last status message, rather than all stats.
+        self.status_stats_deltas = status_stats_deltas
+        # Stats as of the last status message
+        self._status_stats = {}
         self.tries = tries
+        # Class of the persistent state store, which is passed the harvest path.
+        self.state_store_cls = state_store_cls
+        # Number of WARCs for which process_warc() is called concurrently.
+        self.warc_processing_workers = warc_processing_workers
+        self._warc_processing_executor = None
 
         # Create and start warc processing thread.
         self.warc_processing_thread = threading.Thread(target=self._process_warc_thread, name="warc_processing_thread")
@@ -147,6 +213,24 @@ class BaseHarvester(BaseConsumer):
         # Indicates that the next shutdown should be treated as a pause of the harvest, rather than a completion.
         self.is_pause = False
 
+    @property
+    def state_store(self):
+        warc_state_store = getattr(self._warc_local, "state_store", None)
+        return warc_state_store if warc_state_store is not None else self._state_store
+
+    @state_store.setter
+    def state_store(self, state_store):
+        self._state_store = state_store
+
+    @property
+    def result(self):
+        warc_result = getattr(self._warc_local, "result", None)
+        return warc_result if warc_result is not None else self._result
+
+    @result.setter
+    def result(self, result):
+        self._result = result
+
     def on_message(self):
         assert self.message
 
@@ -156,14 +240,25 @@ class BaseHarvester(BaseConsumer):
 
         # Create a temp directory for WARCs
         self.warc_temp_dir = self._create_warc_temp_dir()
+        self._warc_processing_failed = False
         self._create_state_store()
+        with self._queued_warc_filenames_lock:
+            self._queued_warc_filenames = set()
+
+        if self.async_status:
+            self.start_async_publishing(min_interval_secs=self._async_publishing_min_interval_secs())
 
         # Possibly resume a harvest
+        self._status_stats = {}
         self.result = HarvestResult()
         self.result.started = datetime_now()
 
-        if os.path.exists(self.result_filepath) or len(self._list_warcs(self.warc_temp_dir)) > 0:
+        self._result_journal_entries = 0
+        self._saved_result_counts = None
+        if os.path.exists(self.result_filepath) or os.path.exists(self._result_journal_filepath()) or \
+                len(self._list_warcs(self.warc_temp_dir)) > 0:
             self._load_result()
+            self._status_stats = dict((day, dict(stats)) for day, stats in self.result.stats().items())
             self.result.warnings.append(
                 Msg(CODE_HARVEST_RESUMED, "Harvest resumed on {}".format(datetime_now())))
             # Send a status message. This will give immediate indication that harvesting is occurring.
@@ -196,13 +291,14 @@ class BaseHarvester(BaseConsumer):
             if self.queue_warc_files_timer:
                 self.queue_warc_files_timer.cancel()
 
-        signal.signal(signal.SIGTERM, shutdown)
-        signal.signal(signal.SIGINT, shutdown)
-
         def pause(signal_number, stack_frame):
             self.is_pause = True
 
-        signal.signal(signal.SIGUSR1, pause)
+        # Signal handlers can only be set from the main thread, so not when handling messages concurrently.
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, shutdown)
+            signal.signal(signal.SIGINT, shutdown)
+            signal.signal(signal.SIGUSR1, pause)
 
         log.debug("Message is %s" % json.dumps(self.message, indent=4))
 
@@ -213,9 +309,11 @@ class BaseHarvester(BaseConsumer):
             self.restart_stream_timer = threading.Timer(self.stream_restart_interval_secs, self._restart_stream)
             self.restart_stream_timer.start()
 
-        # Start a queue warc files timer
-        self.queue_warc_files_timer = threading.Timer(self.queue_warc_files_interval_secs, self._queue_warc_files)
-        self.queue_warc_files_timer.start()
+        # Watch for WARC files, falling back to a queue warc files timer
+        self.warc_watcher = self._start_warc_watcher()
+        if not self.warc_watcher:
+            self.queue_warc_files_timer = threading.Timer(self.queue_warc_files_interval_secs, self._queue_warc_files)
+            self.queue_warc_files_timer.start()
 
         while not self.stop_harvest_loop_event.is_set():
             # Reset the stop_harvest_seeds_event
@@ -232,7 +330,10 @@ class BaseHarvester(BaseConsumer):
                 try_count += 1
                 log.debug("Try {} of {}".format(try_count, self.tries))
                 try:
-                    if self.use_warcprox:
+                    if self.use_warcprox and self.persistent_warcprox and self.is_streaming:
+                        self._start_warcprox()
+                        self.harvest_seeds()
+                    elif self.use_warcprox:
                         with warced(safe_string(self.message["id"]), self.warc_temp_dir, debug=self.debug_warcprox,
                                     interrupt=self.is_streaming,
                                     rollover_time=self.warc_rollover_secs if not self.is_streaming else None):
@@ -266,19 +367,50 @@ class BaseHarvester(BaseConsumer):
         if self.restart_stream_timer:
             self.restart_stream_timer.cancel()
 
+        # Stopping warcprox closes the last WARC.
+        if self._warcprox:
+            self._stop_warcprox()
+            self._queue_warc_files()
+
         # Turn off the queue WARC files timer
         if self.queue_warc_files_timer:
             self.queue_warc_files_timer.cancel()
 
+        # Stop watching for WARC files
+        if self.warc_watcher:
+            self.warc_watcher.stop()
+            self.warc_watcher = None
+
         # Finish processing
         self._finish_processing()
+        self._close_state_store()
 
-        # Delete temp dir
-        if os.path.exists(self.warc_temp_dir):
+        # Delete temp dir, unless it has WARCs that were not committed, so that they are processed on resume.
+        if self._warc_processing_failed and self._list_warcs(self.warc_temp_dir):
+            log.warning("Keeping %s, since it has WARCs that were not processed", self.warc_temp_dir)
+        elif os.path.exists(self.warc_temp_dir):
             shutil.rmtree(self.warc_temp_dir)
 
         log.info("Done harvesting by message with id %s", self.message["id"])
 
+    def _start_warcprox(self):
+        """
+        Starts a warcprox that is kept running across stream restarts, unless already running.
+        """
+        if self._warcprox and self._warcprox.is_running():
+            return
+        self._stop_warcprox()
+        log.debug("Starting warcprox for harvest")
+        self._warcprox = warced(safe_string(self.message["id"]), self.warc_temp_dir, debug=self.debug_warcprox,
+                                interrupt=True, rollover_idle_time=self.warc_rollover_idle_secs)
+        self._warcprox.__enter__()
+
+    def _stop_warcprox(self):
+        if self._warcprox:
+            log.debug("Stopping warcprox for harvest")
+            self._warcprox.__exit__(None, None, None)
+            self._warcprox = None
+
     def _finish_processing(self):
         # Otherwise, will not get the last WARC on a stop.
         # No time is OK on a container kill because will resume and process last file.
@@ -294,31 +426,62 @@ class BaseHarvester(BaseConsumer):
             # Send final message
             self._send_status_message(STATUS_SUCCESS if self.result.success else STATUS_FAILURE)
 
-            # Delete result file
-            if os.path.exists(self.result_filepath):
-                os.remove(self.result_filepath)
+            # Delete result file and journal
+            for filepath in (self.result_filepath, self._result_journal_filepath()):
+                if os.path.exists(filepath):
+                    os.remove(filepath)
         else:
             log.info("Pausing this harvest.")
 
             # Send final message
             self._send_status_message(STATUS_PAUSED)
 
+        # Wait for messages to be sent
+        self.stop_async_publishing()
+
     def _queue_warc_files(self):
         log.debug("Queueing WARC files")
         # Stop the timer
         if self.queue_warc_files_timer:
             self.queue_warc_files_timer.cancel()
 
-        # Queue warc files
-        for warc_filename in self._list_warcs(self.warc_temp_dir):
-            log.debug("Queueing %s", warc_filename)
-            self.warc_processing_queue.put(warc_filename)
+        # Queue warc files in name order, which is the order in which they were written.
+        for warc_filename in sorted(self._list_warcs(self.warc_temp_dir)):
+            self._queue_warc_file(warc_filename)
 
         # Restart the timer
         if self.queue_warc_files_timer:
             self.queue_warc_files_timer = threading.Timer(self.queue_warc_files_interval_secs, self._queue_warc_files)
             self.queue_warc_files_timer.start()
 
+    def _queue_warc_file(self, warc_filename):
+        """
+        Queues a WARC file, unless it has already been queued.
+        """
+        with self._queued_warc_filenames_lock:
+            if warc_filename in self._queued_warc_filenames:
+                return
+            self._queued_warc_filenames.add(warc_filename)
+        log.debug("Queueing %s", warc_filename)
+        self.warc_processing_queue.put(warc_filename)
+
+    def _start_warc_watcher(self):
+        """
+        Starts watching the temp dir for WARC files that warcprox has finished writing.
+
+        :return: the watcher or None if not watching
+        """
+        if not self.watch_warc_files or not inotify_available():
+            return None
+        warc_watcher = DirectoryWatcher(self.warc_temp_dir, self._queue_warc_file, suffixes=(".warc", ".warc.gz"),
+                                        overflow_callback=self._queue_warc_files)
+        try:
+            warc_watcher.start()
+        except OSError as e:
+            log.warning("Unable to watch %s, so falling back to a timer: %s", self.warc_temp_dir, e)
+            return None
+        return warc_watcher
+
     def harvest_from_file(self, filepath, is_streaming=False, delete=False):
         """
         Performs a harvest based on the a harvest start message contained in the
@@ -344,8 +507,18 @@ class BaseHarvester(BaseConsumer):
         """
         Creates a state store for the harvest.
         """
+        # A store left open by a harvest that raised.
+        self._close_state_store()
         # We'll be delaying writing to the state store until done processing the warc file.
-        self.state_store = DelayedSetStateStoreAdapter(JsonHarvestStateStore(self.message["path"]))
+        self.state_store = DelayedSetStateStoreAdapter(self.state_store_cls(self.message["path"]))
+
+    def _close_state_store(self):
+        """
+        Closes the state store for the harvest, for state stores that hold a connection.
+        """
+        if self._state_store is not None and hasattr(self._state_store.state_store, "close"):
+            self._state_store.state_store.close()
+        self._state_store = None
 
     @staticmethod
     def _list_warcs(path):
@@ -373,8 +546,9 @@ class BaseHarvester(BaseConsumer):
             "errors": [msg.to_map() for msg in self.result.errors],
             "date_started": self.result.started.isoformat(),
             "stats": dict(),
-            "token_updates": self.result.token_updates,
-            "uids": self.result.uids,
+            # Copied, since the message may be published after the result changes.
+            "token_updates": dict(self.result.token_updates),
+            "uids": dict(self.result.uids),
             "warcs": {
                 "count": len(self.result.warcs),
                 "bytes": self.result.warc_bytes
@@ -385,8 +559,12 @@ class BaseHarvester(BaseConsumer):
             "instance": str(os.getpid())
         }
 
-        for day, stats in self.result.stats().items():
-            message["stats"][day.isoformat()] = dict(stats)
+        if self.status_stats_deltas:
+            message["stats"] = self._status_stats_delta()
+            message["stats_delta"] = True
+        else:
+            for day, stats in self.result.stats().items():
+                message["stats"][day.isoformat()] = dict(stats)
 
         if self.result.ended:
             message["date_ended"] = self.result.ended.isoformat()
@@ -394,13 +572,68 @@ class BaseHarvester(BaseConsumer):
         # Routing key may be none
         log.info("Sending status message for harvest %s: %s", self.message["id"], status)
         status_routing_key = self.routing_key.replace("start", "status")
-        self._publish_message(status_routing_key, message)
+        # Scoped to the harvest, since concurrent harvests share the publisher.
+        self._publish_message(status_routing_key, message, coalesce_key=("status", status_routing_key, message["id"]),
+                              merge_fn=self._merge_status_messages)
+
+    def _status_stats_delta(self):
+        """
+        Returns the changes to the stats since the last status message as a map of days to stats.
+        """
+        stats_delta = dict()
+        for day, stats in self.result.stats().items():
+            last_stats = self._status_stats.setdefault(day, {})
+            day_delta = dict()
+            for item, count in stats.items():
+                if count != last_stats.get(item, 0):
+                    day_delta[item] = count - last_stats.get(item, 0)
+                    last_stats[item] = count
+            if day_delta:
+                stats_delta[day.isoformat()] = day_delta
+        return stats_delta
+
+    @staticmethod
+    def _merge_status_messages(message, new_message):
+        """
+        Merges a status message that was not sent into a newer status message.
+
+        Token updates and uids are only sent once, so are combined. Stats deltas are summed.
+        """
+        new_message["token_updates"] = dict(message["token_updates"], **new_message["token_updates"])
+        new_message["uids"] = dict(message["uids"], **new_message["uids"])
+        if new_message.get("stats_delta"):
+            stats = message["stats"]
+            for day, day_delta in new_message["stats"].items():
+                day_stats = stats.setdefault(day, {})
+                for item, count in day_delta.items():
+                    day_stats[item] = day_stats.get(item, 0) + count
+            new_message["stats"] = stats
+        return new_message
 
     @staticmethod
     def _clean_name(name):
         re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', name)
 
-    def _send_warc_created_message(self, warc_path):
+    @staticmethod
+    def _warc_info(warc_path):
+        """
+        Returns a WarcInfo for the WARC, computing the digest and size in a single pass over the WARC
+        in fixed-size chunks.
+        """
+        sha1 = hashlib.sha1()
+        warc_bytes = 0
+        with open(warc_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+                sha1.update(chunk)
+                warc_bytes += len(chunk)
+        return WarcInfo(warc_path, warc_bytes, sha1.hexdigest(), datetime_from_stamp(os.path.getctime(warc_path)))
+
+    def _send_warc_created_message(self, warc_path, warc_info=None):
+        """
+        :param warc_info: WarcInfo for the WARC. If not provided, it is computed.
+        """
+        if warc_info is None:
+            warc_info = self._warc_info(warc_path)
         message = {
             "harvest": {
                 "id": self.message["id"],
@@ -415,9 +648,9 @@ class BaseHarvester(BaseConsumer):
             "warc": {
                 "id": uuid.uuid4().hex,
                 "path": warc_path,
-                "date_created": datetime_from_stamp(os.path.getctime(warc_path)).isoformat(),
-                "bytes": os.path.getsize(warc_path),
-                "sha1": hashlib.sha1(open(warc_path, 'rb').read()).hexdigest()
+                "date_created": warc_info.date_created.isoformat(),
+                "bytes": warc_info.bytes,
+                "sha1": warc_info.sha1
             }
         }
         self._publish_message("warc_created", message)
@@ -428,7 +661,7 @@ class BaseHarvester(BaseConsumer):
 
         :return: the directory path
         """
-        path = os.path.join(self.working_path, "tmp", safe_string(self.message["id"]))
+        path = os.path.join(self._warc_temp_parent_path or self.working_path, "tmp", safe_string(self.message["id"]))
         if not os.path.exists(path):
             os.makedirs(path)
         return path
@@ -439,7 +672,48 @@ class BaseHarvester(BaseConsumer):
         self.restart_stream_timer = threading.Timer(self.stream_restart_interval_secs, self._restart_stream)
         self.restart_stream_timer.start()
 
+    def _result_journal_filepath(self):
+        return self.result_filepath + RESULT_JOURNAL_SUFFIX
+
     def _save_result(self):
+        """
+        Persists the result for resuming.
+
+        The changes since the last save are appended to the result journal. Periodically, the journal
+        is compacted by writing the entire result to the result file.
+        """
+        if self._saved_result_counts is None or self._result_journal_entries >= RESULT_JOURNAL_COMPACT_ENTRIES \
+                or not os.path.exists(self.result_filepath):
+            self._compact_result()
+            return
+
+        saved_warcs, saved_infos, saved_warnings, saved_errors, saved_warc_bytes = self._saved_result_counts
+        result_delta = {
+            "warcs": self.result.warcs[saved_warcs:],
+            "warc_bytes": self.result.warc_bytes - saved_warc_bytes,
+            "stats": [],
+            "infos": [msg.to_map() for msg in self.result.infos[saved_infos:]],
+            "warnings": [msg.to_map() for msg in self.result.warnings[saved_warnings:]],
+            "errors": [msg.to_map() for msg in self.result.errors[saved_errors:]]
+        }
+        for day, stats in self.result.stats().items():
+            saved_stats = self._saved_result_stats.get(day, {})
+            stats_delta = dict((item, count - saved_stats.get(item, 0)) for item, count in stats.items()
+                               if count != saved_stats.get(item, 0))
+            if stats_delta:
+                result_delta["stats"].append((day.isoformat(), stats_delta))
+
+        with codecs.open(self._result_journal_filepath(), 'a') as f:
+            f.write(json.dumps(result_delta) + "\n")
+        self._result_journal_entries += 1
+        self._mark_result_saved()
+
+        log.debug("Persisted result changes to %s", self._result_journal_filepath())
+
+    def _compact_result(self):
+        """
+        Writes the entire result to the result file and removes the result journal.
+        """
         result_message = {
             "warcs": self.result.warcs,
             "warc_bytes": self.result.warc_bytes,
@@ -454,11 +728,22 @@ class BaseHarvester(BaseConsumer):
         for day, stats in self.result.stats().items():
             result_message["stats"].append((day.isoformat(), dict(stats)))
 
-        with codecs.open(self.result_filepath, 'w') as f:
+        result_tmp_filepath = self.result_filepath + ".tmp"
+        with codecs.open(result_tmp_filepath, 'w') as f:
             json.dump(result_message, f)
+        os.replace(result_tmp_filepath, self.result_filepath)
+        if os.path.exists(self._result_journal_filepath()):
+            os.remove(self._result_journal_filepath())
+        self._result_journal_entries = 0
+        self._mark_result_saved()
 
         log.debug("Persisted result to %s", self.result_filepath)
 
+    def _mark_result_saved(self):
+        self._saved_result_counts = (len(self.result.warcs), len(self.result.infos), len(self.result.warnings),
+                                     len(self.result.errors), self.result.warc_bytes)
+        self._saved_result_stats = dict((day, dict(stats)) for day, stats in self.result.stats().items())
+
     def _load_result(self):
         if os.path.exists(self.result_filepath):
             log.info("Resuming from previous results")
@@ -476,52 +761,197 @@ class BaseHarvester(BaseConsumer):
                 for item, count in stats.items():
                     self.result.increment_stats(item, count=count, day=iso8601.parse_date(day).date())
 
+            self._replay_result_journal()
+
+    def _replay_result_journal(self):
+        """
+        Applies the changes in the result journal to the result.
+        """
+        if not os.path.exists(self._result_journal_filepath()):
+            return
+        with codecs.open(self._result_journal_filepath(), 'r') as f:
+            for line in f:
+                try:
+                    result_delta = json.loads(line)
+                except ValueError:
+                    # The last entry may be incomplete if the harvester was killed while writing it.
+                    log.warning("Skipping incomplete entry in %s", self._result_journal_filepath())
+                    break
+                self.result.warcs.extend(result_delta["warcs"])
+                self.result.warc_bytes += result_delta["warc_bytes"]
+                self.result.infos.extend([Msg(msg["code"], msg["message"]) for msg in result_delta["infos"]])
+                self.result.warnings.extend([Msg(msg["code"], msg["message"]) for msg in result_delta["warnings"]])
+                self.result.errors.extend([Msg(msg["code"], msg["message"]) for msg in result_delta["errors"]])
+                for day, stats in result_delta["stats"]:
+                    for item, count in stats.items():
+                        self.result.increment_stats(item, count=count, day=iso8601.parse_date(day).date())
+                self._result_journal_entries += 1
+
     def _process_warc_thread(self):
         log.info("Starting WARC processing thread")
+        # WARCs being processed by workers, in the order in which they will be committed.
+        pending = deque()
         # This will continue until harvester is killed.
         while True:
             # This will block
             try:
-                warc_filename = self.warc_processing_queue.get(timeout=1)
+                warc_filename = self.warc_processing_queue.get(timeout=0.1 if pending else 1)
             except Empty:
-                continue
-            # Make sure file exists. Possible that same file will be put in queue multiple times.
-            warc_filepath = os.path.join(self.warc_temp_dir, warc_filename)
-            if os.path.exists(warc_filepath):
-                # Process the warc
-                self.process_warc(warc_filepath)
+                warc_filename = None
+            if warc_filename is _STOP_WARC_PROCESSING:
+                log.info("Stopping WARC processing thread")
+                # Left open if the harvest raised.
+                self._close_state_store()
+                return
+            if warc_filename is not None:
+                # Make sure file exists. Possible that it was moved by a previous harvest.
+                warc_filepath = os.path.join(self.warc_temp_dir, warc_filename)
+                if not os.path.exists(warc_filepath):
+                    log.debug("Skipping processing %s", warc_filename)
+                    # Mark this as done.
+                    self.warc_processing_queue.task_done()
+                elif self._warc_processing_failed:
+                    log.warning("Not processing %s, since processing a previous WARC failed", warc_filename)
+                    self.warc_processing_queue.task_done()
+                elif self.warc_processing_workers > 1:
+                    if self._warc_processing_executor is None:
+                        self._warc_processing_executor = ThreadPoolExecutor(
+                            max_workers=self.warc_processing_workers, thread_name_prefix="warc_processing_worker")
+                    log.debug("Submitting %s for processing", warc_filename)
+                    pending.append((warc_filename, self._warc_processing_executor.submit(self._process_warc_worker,
+                                                                                         warc_filepath)))
+                else:
+                    # Process the warc
+                    try:
+                        self.process_warc(warc_filepath)
+                    except Exception as e:
+                        self._fail_warc_processing(warc_filename, e)
+                    else:
+                        self._commit_warc(warc_filename)
+                    # Mark this as done.
+                    self.warc_processing_queue.task_done()
+
+            # Commit processed WARCs in the order they were queued, so that state is never passed for a WARC
+            # before the WARCs preceding it.
+            while pending and (self._warc_processing_failed or pending[0][1].done()):
+                warc_filename, future = pending.popleft()
+                if self._warc_processing_failed:
+                    # Its state is only held by its delayed state store, so it is discarded.
+                    log.warning("Not committing %s, since processing a previous WARC failed", warc_filename)
+                    future.cancel()
+                    self.warc_processing_queue.task_done()
+                    continue
+                try:
+                    warc_state_store, warc_result = future.result()
+                except Exception as e:
+                    self._fail_warc_processing(warc_filename, e)
+                else:
+                    warc_state_store.pass_state()
+                    self.result.merge(warc_result)
+                    self._commit_warc(warc_filename)
+                # Mark this as done.
+                self.warc_processing_queue.task_done()
+
+    def _fail_warc_processing(self, warc_filename, e):
+        """
+        Fails the harvest when processing a WARC raises.
+
+        The WARC and the WARCs after it are left uncommitted and their state is not passed,
+        so that they are processed when the harvest is resumed.
+        """
+        log.exception("Error processing %s: %s", warc_filename, e)
+        self._warc_processing_failed = True
+        self.result.success = False
+        self.result.errors.append(Msg(CODE_UNKNOWN_ERROR, "Error processing {}: {}".format(warc_filename, e)))
+        self.stop_harvest_seeds_event.set()
+        self.stop_harvest_loop_event.set()
+
+    def _copy_for_delivery(self, working_path):
+        harvester = BaseConsumer._copy_for_delivery(self, working_path)
+        harvester._warc_local = threading.local()
+        harvester.state_store = None
+        harvester.warc_temp_dir = None
+        # Outside of the delivery's working path, which is removed when the delivery is done.
+        harvester._warc_temp_parent_path = self._warc_temp_parent_path or self.working_path
+        harvester._warc_processing_failed = False
+        harvester.result_filepath = None
+        harvester.stop_harvest_seeds_event = threading.Event()
+        harvester.stop_harvest_loop_event = threading.Event()
+        harvester.restart_stream_timer = None
+        harvester.queue_warc_files_timer = None
+        harvester.warc_watcher = None
+        harvester._warcprox = None
+        harvester._queued_warc_filenames = set()
+        harvester._queued_warc_filenames_lock = threading.Lock()
+        harvester._warc_processing_executor = None
+        harvester.is_pause = False
+        harvester.warc_processing_queue = Queue()
+        harvester.warc_processing_thread = threading.Thread(target=harvester._process_warc_thread,
+                                                            name="warc_processing_thread")
+        harvester.warc_processing_thread.daemon = True
+        harvester.warc_processing_thread.start()
+        return harvester
+
+    def _release_delivery(self):
+        self.warc_processing_queue.put(_STOP_WARC_PROCESSING)
+
+    def _async_publishing_min_interval_secs(self):
+        return self.status_min_interval_secs
+        if self._warc_processing_executor is not None:
+            self._warc_processing_executor.shutdown(wait=False)
+
+    def _process_warc_worker(self, warc_filepath):
+        """
+        Calls process_warc() for a WARC, collecting state and results separately from other WARCs.
 
-                # Move the warc
-                dest_path = self._path_for_warc(self.message["path"], warc_filename)
-                dest_warc_filepath = os.path.join(dest_path, warc_filename)
-                log.debug("Moving %s to %s", warc_filepath, dest_warc_filepath)
-                if not os.path.exists(dest_path):
-                    os.makedirs(dest_path)
-                shutil.move(warc_filepath, dest_warc_filepath)
+        :return: the delayed state store and result for the WARC
+        """
+        warc_state_store = DelayedSetStateStoreAdapter(self._state_store)
+        warc_result = HarvestResult()
+        self._warc_local.state_store = warc_state_store
+        self._warc_local.result = warc_result
+        try:
+            self.process_warc(warc_filepath)
+        finally:
+            self._warc_local.state_store = None
+            self._warc_local.result = None
+        return warc_state_store, warc_result
+
+    def _commit_warc(self, warc_filename):
+        """
+        Moves a processed WARC, passes its state and persists the result.
+        """
+        warc_filepath = os.path.join(self.warc_temp_dir, warc_filename)
 
-                # Persist the state
-                self.state_store.pass_state()
+        # Move the warc
+        dest_path = self._path_for_warc(self.message["path"], warc_filename)
+        dest_warc_filepath = os.path.join(dest_path, warc_filename)
+        log.debug("Moving %s to %s", warc_filepath, dest_warc_filepath)
+        if not os.path.exists(dest_path):
+            os.makedirs(dest_path)
+        shutil.move(warc_filepath, dest_warc_filepath)
 
-                # Add it to result
-                self.result.add_warc(dest_warc_filepath)
+        # Persist the state
+        self.state_store.pass_state()
 
-                # Send warc created message
-                self._send_warc_created_message(dest_warc_filepath)
+        # Digest, size, and date are computed once for the result and warc created message.
+        warc_info = self._warc_info(dest_warc_filepath)
 
-                # Send status message
-                self._send_status_message(STATUS_STOPPING if self.stop_harvest_seeds_event.is_set() else STATUS_RUNNING)
+        # Add it to result
+        self.result.add_warc(dest_warc_filepath, warc_bytes=warc_info.bytes)
 
-                # Since these were sent, clear them.
-                self.result.token_updates = {}
-                self.result.uids = {}
+        # Send warc created message
+        self._send_warc_created_message(dest_warc_filepath, warc_info=warc_info)
 
-                # Persist the result for resuming
-                self._save_result()
+        # Send status message
+        self._send_status_message(STATUS_STOPPING if self.stop_harvest_seeds_event.is_set() else STATUS_RUNNING)
 
-            else:
-                log.debug("Skipping processing %s", warc_filename)
-            # Mark this as done.
-            self.warc_processing_queue.task_done()
+        # Since these were sent, clear them.
+        self.result.token_updates = {}
+        self.result.uids = {}
+
+        # Persist the result for resuming
+        self._save_result()
 
     def on_persist_exception(self, exception):
         log.error("Handling on persist exception for %s", self.message["id"])
@@ -548,6 +978,10 @@ class BaseHarvester(BaseConsumer):
         Processing involves:
         * Save state to self.state_store.
         * Increment counts in self.result.
+
+        When there is more than one WARC processing worker, this may be called concurrently for
+        different WARCs. In that case, self.state_store and self.result are specific to the WARC
+        and are committed in order once processing is complete.
         """
         pass
 
@@ -586,6 +1020,18 @@ class BaseHarvester(BaseConsumer):
         service_parser.add_argument("working_path")
         service_parser.add_argument("--skip-resume", action="store_true")
         service_parser.add_argument("--tries", type=int, default="3", help="Number of times to try harvests if errors.")
+        service_parser.add_argument("--state-store", choices=sorted(STATE_STORES), default="json",
+                                    help="Persistent store for harvest state.")
+        service_parser.add_argument("--processing-workers", type=int, default="1",
+                                    help="Number of WARC files to process concurrently.")
+        service_parser.add_argument("--async-status", action="store_true",
+                                    help="Send messages from a background thread, skipping superseded status messages.")
+        service_parser.add_argument("--status-interval", type=float, default="0",
+                                    help="Minimum seconds between status messages when sending in the background.")
+        service_parser.add_argument("--serializer", choices=list(SERIALIZERS), default="json",
+                                    help="Serializer for sent messages.")
+        service_parser.add_argument("--concurrency", type=int, help="Number of harvests to perform at a time.")
+        service_parser.add_argument("--prefetch", type=int, help="Number of messages to prefetch.")
         service_parser.add_argument("--priority-queues", type=lambda v: v.lower() in ("yes", "true", "t", "1"),
                                     nargs="?", default="False", const="True")
 
@@ -593,10 +1039,20 @@ class BaseHarvester(BaseConsumer):
         seed_parser.add_argument("filepath", help="Filepath of the seed file.")
         seed_parser.add_argument("working_path")
         seed_parser.add_argument("--streaming", action="store_true", help="Run in streaming mode.")
+        seed_parser.add_argument("--persistent-warcprox", action="store_true",
+                                 help="When streaming, keep warcprox running across stream restarts.")
         seed_parser.add_argument("--host")
         seed_parser.add_argument("--username")
         seed_parser.add_argument("--password")
         seed_parser.add_argument("--tries", type=int, default="3", help="Number of times to try harvests if errors.")
+        seed_parser.add_argument("--state-store", choices=sorted(STATE_STORES), default="json",
+                                 help="Persistent store for harvest state.")
+        seed_parser.add_argument("--processing-workers", type=int, default="1",
+                                 help="Number of WARC files to process concurrently.")
+        seed_parser.add_argument("--async-status", action="store_true",
+                                 help="Send messages from a background thread, skipping superseded status messages.")
+        seed_parser.add_argument("--status-interval", type=float, default="0",
+                                 help="Minimum seconds between status messages when sending in the background.")
 
         args = parser.parse_args()
 
@@ -616,6 +1072,13 @@ class BaseHarvester(BaseConsumer):
             harvester = cls(args.working_path, mq_config=MqConfig(args.host, args.username, args.password, EXCHANGE,
                                                                   {queue: routing_keys}),
                             debug=args.debug, debug_warcprox=args.debug_warcprox, tries=args.tries)
+            harvester.state_store_cls = STATE_STORES[args.state_store]
+            harvester.warc_processing_workers = args.processing_workers
+            harvester.async_status = args.async_status
+            harvester.status_min_interval_secs = args.status_interval
+            harvester.serializer = args.serializer
+            harvester.concurrency = args.concurrency
+            harvester.prefetch_count = args.prefetch
             if not args.skip_resume:
                 harvester.resume_from_file()
             harvester.run()
@@ -624,6 +1087,11 @@ class BaseHarvester(BaseConsumer):
                 if args.host and args.username and args.password else None
             harvester = cls(args.working_path, mq_config=mq_config, debug=args.debug,
                             debug_warcprox=args.debug_warcprox, tries=args.tries)
+            harvester.state_store_cls = STATE_STORES[args.state_store]
+            harvester.warc_processing_workers = args.processing_workers
+            harvester.async_status = args.async_status
+            harvester.status_min_interval_secs = args.status_interval
+            harvester.persistent_warcprox = args.persistent_warcprox
             harvester.harvest_from_file(args.filepath, is_streaming=args.streaming)
             if __name__ == '__main__':
                 if harvester.result:
@@ -0,0 +1,135 @@
+import logging
+import os
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+
+log = logging.getLogger(__name__)
+
+"""
+Watches a directory for files being completed, using Linux inotify.
+
+This calls libc directly, so it requires no additional dependencies. Where inotify
+is not available, inotify_available() returns False.
+"""
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event: int wd, uint32_t mask, uint32_t cookie, uint32_t len, followed by name.
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        # Raises AttributeError if not supported.
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    return _libc is not None
+
+
+class DirectoryWatcher:
+    """
+    Calls a callback with the filename of each file in a directory that is closed after
+    writing or moved into the directory.
+
+    Events are read by a daemon thread. If the kernel's event queue overflows, the overflow
+    callback is called so that the directory can be listed instead.
+    """
+    def __init__(self, path, callback, suffixes=None, overflow_callback=None, poll_secs=.5):
+        """
+        :param path: the directory to watch
+        :param callback: function called with the filename
+        :param suffixes: tuple of suffixes of filenames to call the callback for. If not provided,
+        called for all files.
+        :param overflow_callback: function called when events have been lost
+        :param poll_secs: how often to check whether the watcher has been stopped
+        """
+        self.path = path
+        self.callback = callback
+        self.suffixes = suffixes
+        self.overflow_callback = overflow_callback
+        self.poll_secs = poll_secs
+        self._fd = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        assert inotify_available()
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if _libc.inotify_add_watch(fd, os.fsencode(self.path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, os.strerror(errno), self.path)
+        self._fd = fd
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, name="directory_watcher_thread")
+        self._thread.daemon = True
+        self._thread.start()
+        log.debug("Watching %s", self.path)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        log.debug("Stopped watching %s", self.path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _watch(self):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._fd], [], [], self.poll_secs)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                continue
+            for mask, filename in self._events(data):
+                try:
+                    if mask & IN_Q_OVERFLOW:
+                        log.warning("Events lost while watching %s", self.path)
+                        if self.overflow_callback:
+                            self.overflow_callback()
+                    elif filename and (not self.suffixes or filename.endswith(self.suffixes)):
+                        self.callback(filename)
+                except Exception as e:
+                    log.exception("Error handling event for %s: %s", filename, e)
+
+    @staticmethod
+    def _events(data):
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, mask, _, name_len = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            filename = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            yield mask, filename
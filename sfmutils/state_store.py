@@ -2,7 +2,10 @@ import logging
 import codecs
 import os
 import json
-import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import partial
 
 log = logging.getLogger(__name__)
 
@@ -61,13 +64,24 @@ class DictHarvestStateStore:
                 if not self.state[resource_type]:
                     del self.state[resource_type]
 
+    def set_many(self, states):
+        """
+        Adds a batch of state values to the harvest state store.
+
+        :param states: iterable of (resource type, key, value)
+        """
+        for resource_type, key, value in states:
+            self.set_state(resource_type, key, value)
+
 
 class JsonHarvestStateStore(DictHarvestStateStore):
     """
     A harvest state store implementation backed by a dictionary and stored as JSON.
 
-    The JSON is written to <path>/state.json. It is loaded and saved on
-    every get and set.
+    The JSON is written to <path>/state.json. The state is kept in memory and only
+    reloaded when the file has been changed by someone else (based on its mtime, inode,
+    and size). Every set is written through to the file, unless in a transaction, in which
+    case all of the sets are written in a single atomic, fsynced write.
     """
     def __init__(self, path):
         DictHarvestStateStore.__init__(self)
@@ -75,25 +89,146 @@ class JsonHarvestStateStore(DictHarvestStateStore):
         self.path = path
         self.state_filepath = os.path.join(path, "state.json")
         self.state_tmp_filepath = os.path.join(path, "state.json.tmp")
+        # Identifies the version of the file that is in memory.
+        self._file_signature = None
+        self._in_transaction = False
+        self._dirty = False
+
+    @staticmethod
+    def _signature(filepath):
+        stat = os.stat(filepath)
+        return stat.st_mtime_ns, stat.st_ino, stat.st_size
 
     def _load_state(self):
         if os.path.exists(self.state_filepath):
-            with codecs.open(self.state_filepath, "r") as state_file:
-                self.state = json.load(state_file)
-
-    def get_state(self, resource_type, key):
-        self._load_state()
-        return DictHarvestStateStore.get_state(self, resource_type, key)
+            file_signature = self._signature(self.state_filepath)
+            if file_signature != self._file_signature:
+                with codecs.open(self.state_filepath, "r") as state_file:
+                    self.state = json.load(state_file)
+                self._file_signature = file_signature
 
-    def set_state(self, resource_type, key, value):
-        self._load_state()
-        DictHarvestStateStore.set_state(self, resource_type, key, value)
+    def _save_state(self):
         if not os.path.exists(self.path):
             os.makedirs(self.path)
         # This way if the write fails, the original file will still be in place.
         with codecs.open(self.state_tmp_filepath, 'w', encoding="utf-8") as state_file:
             json.dump(self.state, state_file)
-        shutil.move(self.state_tmp_filepath, self.state_filepath)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(self.state_tmp_filepath, self.state_filepath)
+        self._file_signature = self._signature(self.state_filepath)
+        self._dirty = False
+
+    def get_state(self, resource_type, key):
+        if not self._in_transaction:
+            self._load_state()
+        return DictHarvestStateStore.get_state(self, resource_type, key)
+
+    def set_state(self, resource_type, key, value):
+        if self._in_transaction:
+            DictHarvestStateStore.set_state(self, resource_type, key, value)
+            self._dirty = True
+        else:
+            self._load_state()
+            DictHarvestStateStore.set_state(self, resource_type, key, value)
+            self._save_state()
+
+    def set_many(self, states):
+        with self.transaction():
+            DictHarvestStateStore.set_many(self, states)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager that batches the sets within it into a single write.
+
+        The write happens when the context exits without an exception.
+        """
+        if self._in_transaction:
+            # Already in a transaction, so the outer transaction writes.
+            yield self
+            return
+        self._load_state()
+        self._in_transaction = True
+        try:
+            yield self
+            if self._dirty:
+                self._save_state()
+        finally:
+            self._in_transaction = False
+
+
+class SqliteHarvestStateStore:
+    """
+    A harvest state store implementation backed by a SQLite database, keyed by
+    resource type and key, so that reads and writes don't depend on the size of the state.
+
+    The database is <path>/state.sqlite. Values are stored as JSON. If <path>/state.json
+    exists, it is migrated into the database and renamed to state.json.migrated.
+
+    The default rollback journal is used, since the harvest path is often on a network or shared
+    mount. Write-ahead logging needs shared memory that such mounts don't support, so it is only
+    used when wal is True and the path is on a local disk.
+    """
+    def __init__(self, path, wal=False):
+        self.path = path
+        self.db_filepath = os.path.join(path, "state.sqlite")
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # Used by the harvesting and the WARC processing threads.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_filepath, check_same_thread=False)
+        with self._lock, self._conn:
+            if wal:
+                self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS state (resource_type TEXT, key TEXT, value TEXT, "
+                               "PRIMARY KEY (resource_type, key)) WITHOUT ROWID")
+        migrate_json_state(path, self)
+
+    def get_state(self, resource_type, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE resource_type = ? AND key = ?",
+                                     (resource_type, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_state(self, resource_type, key, value):
+        self.set_many([(resource_type, key, value)])
+
+    def set_many(self, states):
+        """
+        Adds a batch of state values in a single transaction.
+        """
+        with self._lock, self._conn:
+            for resource_type, key, value in states:
+                log.debug("Setting state for %s with key %s to %s", resource_type, key, value)
+                if value is not None:
+                    self._conn.execute("INSERT OR REPLACE INTO state (resource_type, key, value) VALUES (?, ?, ?)",
+                                       (resource_type, key, json.dumps(value)))
+                else:
+                    self._conn.execute("DELETE FROM state WHERE resource_type = ? AND key = ?", (resource_type, key))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_json_state(path, state_store):
+    """
+    Migrates the state in <path>/state.json to a state store, then renames state.json to
+    state.json.migrated so that the migration only happens once.
+
+    :return: True if state was migrated.
+    """
+    state_filepath = os.path.join(path, "state.json")
+    if not os.path.exists(state_filepath):
+        return False
+    log.info("Migrating %s", state_filepath)
+    with codecs.open(state_filepath, "r") as state_file:
+        state = json.load(state_file)
+    state_store.set_many([(resource_type, key, value) for resource_type, key_values in state.items()
+                          for key, value in key_values.items()])
+    os.replace(state_filepath, state_filepath + ".migrated")
+    return True
 
 
 class NullHarvestStateStore:
@@ -110,6 +245,9 @@ class NullHarvestStateStore:
     def set_state(self, resource_type, key, value):
         pass
 
+    def set_many(self, states):
+        pass
+
 
 class DelayedSetStateStoreAdapter:
     """
@@ -130,7 +268,21 @@ class DelayedSetStateStoreAdapter:
         """
         Set the state on the underlying state store.
         """
-        for resource_type, key_values in self.delayed_state.state.items():
-            for key, value in key_values.items():
+        states = [(resource_type, key, value) for resource_type, key_values in self.delayed_state.state.items()
+                  for key, value in key_values.items()]
+        if hasattr(self.state_store, "set_many"):
+            # Allows the state store to persist the batch at once.
+            self.state_store.set_many(states)
+        else:
+            for resource_type, key, value in states:
                 self.state_store.set_state(resource_type, key, value)
         self.delayed_state = DictHarvestStateStore()
+
+
+# Map of names to persistent state store classes.
+STATE_STORES = {
+    "json": JsonHarvestStateStore,
+    "sqlite": SqliteHarvestStateStore,
+    # Only for harvest paths on a local disk.
+    "sqlite-wal": partial(SqliteHarvestStateStore, wal=True)
+}
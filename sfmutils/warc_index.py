@@ -0,0 +1,130 @@
+import logging
+import os
+import json
+import codecs
+import hashlib
+import shutil
+import iso8601
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx.json"
+
+
+class WarcIndex:
+    """
+    A sidecar index of the items in a WARC file, as produced by a warc iter.
+
+    For each selected response record, the index records the record's offset, target URI,
+    and the ids, types and minimum and maximum dates of its items. Records that produce
+    no items are not indexed.
+
+    The index is written to <WARC filepath>.idx.json. It is reused as long as the size and
+    the mtime (or, failing that, the SHA-1) of the WARC file match and the index was
+    built by the same warc iter class.
+    """
+    def __init__(self, warc_filepath, iter_name, records=None, size=None, mtime=None, sha1=None):
+        self.warc_filepath = warc_filepath
+        self.index_filepath = warc_filepath + INDEX_SUFFIX
+        self.iter_name = iter_name
+        self.records = records if records is not None else []
+        self.size = size
+        self.mtime = mtime
+        self.sha1 = sha1
+
+    def add_record(self, offset, url, items):
+        """
+        Adds a record to the index.
+
+        :param offset: offset of the record in the WARC file
+        :param url: target URI of the record
+        :param items: list of (item_type, item_id, item_date)
+        """
+        if not items:
+            return
+        dates = [item_date for _, _, item_date in items]
+        # If any item is undated, the record can't be skipped based on date.
+        dated = all(dates)
+        self.records.append({
+            "offset": offset,
+            "url": url,
+            "ids": [item_id for _, item_id, _ in items],
+            "types": sorted(set(item_type for item_type, _, _ in items)),
+            "date_min": min(dates).isoformat() if dated else None,
+            "date_max": max(dates).isoformat() if dated else None
+        })
+
+    def offsets(self, limit_item_types=None, item_date_start=None, item_date_end=None):
+        """
+        Returns the offsets of the records that may contain items matching the limits.
+        """
+        offsets = []
+        for record in self.records:
+            if limit_item_types and not set(record["types"]).intersection(limit_item_types):
+                continue
+            if item_date_start and record["date_max"] and iso8601.parse_date(record["date_max"]) < item_date_start:
+                continue
+            if item_date_end and record["date_min"] and iso8601.parse_date(record["date_min"]) > item_date_end:
+                continue
+            offsets.append(record["offset"])
+        return offsets
+
+    def save(self):
+        """
+        Writes the index. Failures are logged, since the index is only an optimization.
+        """
+        stat = os.stat(self.warc_filepath)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.sha1 = _sha1(self.warc_filepath)
+        index_tmp_filepath = self.index_filepath + ".tmp"
+        try:
+            with codecs.open(index_tmp_filepath, 'w', encoding="utf-8") as f:
+                json.dump({
+                    "version": INDEX_VERSION,
+                    "iter": self.iter_name,
+                    "size": self.size,
+                    "mtime": self.mtime,
+                    "sha1": self.sha1,
+                    "records": self.records
+                }, f, separators=(',', ':'))
+            shutil.move(index_tmp_filepath, self.index_filepath)
+            log.debug("Wrote index %s", self.index_filepath)
+        except (IOError, OSError) as e:
+            log.warning("Unable to write index %s: %s", self.index_filepath, e)
+
+    @staticmethod
+    def load(warc_filepath, iter_name):
+        """
+        Returns the index for the WARC file or None if there is no index or it is stale.
+        """
+        index_filepath = warc_filepath + INDEX_SUFFIX
+        if not os.path.exists(index_filepath):
+            return None
+        try:
+            with codecs.open(index_filepath, 'r', encoding="utf-8") as f:
+                index_json = json.load(f)
+        except ValueError:
+            log.warning("Bad index %s", index_filepath)
+            return None
+        if index_json.get("version") != INDEX_VERSION or index_json.get("iter") != iter_name:
+            log.debug("Index %s is for a different version or iter", index_filepath)
+            return None
+        stat = os.stat(warc_filepath)
+        if stat.st_size != index_json["size"]:
+            log.debug("Index %s is stale", index_filepath)
+            return None
+        if stat.st_mtime != index_json["mtime"] and _sha1(warc_filepath) != index_json["sha1"]:
+            log.debug("Index %s is stale", index_filepath)
+            return None
+        return WarcIndex(warc_filepath, iter_name, records=index_json["records"], size=index_json["size"],
+                         mtime=index_json["mtime"], sha1=index_json["sha1"])
+
+
+def _sha1(filepath, chunk_size=1024 * 1024):
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
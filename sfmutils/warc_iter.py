@@ -1,15 +1,79 @@
 from warcio.archiveiterator import WARCIterator
+from sfmutils.warc_index import WarcIndex
+from sfmutils.dedupe import create_seen_ids, DEDUPE_MEMORY, DEDUPE_MODES
 import json
 import argparse
 import logging
 import sys
 import os
-from collections import namedtuple
+import multiprocessing
+from collections import namedtuple, deque, OrderedDict
+from itertools import islice
+from queue import Empty
 
 log = logging.getLogger(__name__)
 
 IterItem = namedtuple('IterItem', ['type', 'id', 'date', 'url', 'item'])
 
+# When iterating in parallel, the number of items a worker sends at a time.
+ITEM_CHUNK_SIZE = 1000
+# When iterating in parallel, the number of chunks a worker can send before they are consumed.
+ITEM_QUEUE_CHUNKS = 10
+
+# Returned when a worker has not sent a chunk within the timeout.
+_NO_CHUNK = object()
+
+
+def _with_fallback(fast_loads):
+    """
+    Wraps a fast decoder so that anything it rejects (e.g., NaN or very large ints) is decoded
+    by the stdlib, making the results identical to the stdlib.
+    """
+    def loads(data):
+        try:
+            return fast_loads(data)
+        except ValueError:
+            return json.loads(data)
+    return loads
+
+
+# Map of names to functions that decode JSON from bytes, fastest first.
+JSON_DECODERS = OrderedDict()
+try:
+    import orjson
+    JSON_DECODERS["orjson"] = _with_fallback(orjson.loads)
+except ImportError:
+    pass
+try:
+    import simdjson
+    JSON_DECODERS["simdjson"] = _with_fallback(simdjson.loads)
+except ImportError:
+    pass
+JSON_DECODERS["json"] = json.loads
+
+json_decoder_name = "json"
+loads = json.loads
+
+
+def set_json_decoder(name):
+    """
+    Overrides the decoder used for WARC payloads.
+
+    An unknown or uninstalled decoder is logged and json is used instead.
+
+    :param name: a key of JSON_DECODERS
+    """
+    global json_decoder_name, loads
+    if name not in JSON_DECODERS:
+        log.warning("%s is not an available JSON decoder, so using json", name)
+        name = "json"
+    json_decoder_name = name
+    loads = JSON_DECODERS[name]
+
+
+# The fastest available decoder, unless overridden with SFM_JSON_DECODER.
+set_json_decoder(os.environ.get("SFM_JSON_DECODER") or next(iter(JSON_DECODERS)))
+
 
 class BaseWarcIter:
     """
@@ -27,6 +91,8 @@ class BaseWarcIter:
             self.filepaths = (filepaths,)
         else:
             self.filepaths = filepaths
+        # Index of the WARC file being iterated and number of its items consumed.
+        self.position = (0, 0)
 
     def __iter__(self):
         return self.iter()
@@ -45,59 +111,266 @@ class BaseWarcIter:
         if should_debug:
             log.debug("File %s. Processed %s records. Yielded %s items.", filename, record_count, yield_count)
 
-    def iter(self, limit_item_types=None, dedupe=False, item_date_start=None, item_date_end=None):
-        """
-        :return: Iterator returning IterItems.
-        """
-        seen_ids = {}
-        for filepath in self.filepaths:
-            log.info("Iterating over %s", filepath)
-            filename = os.path.basename(filepath)
-            with open(filepath, 'rb') as f:
-                yield_count = 0
-                for record_count, record in enumerate((r for r in WARCIterator(f) if r.rec_type == 'response')):
-                    self._debug_counts(filename, record_count, yield_count, by_record_count=True)
-
-                    record_url = record.rec_headers.get_header('WARC-Target-URI')
-                    record_id = record.rec_headers.get_header('WARC-Record-ID')
-                    if self._select_record(record_url):
-                        stream = record.content_stream()
-                        line = stream.readline().decode('utf-8')
-                        while line:
-                            json_obj = None
-                            try:
-                                if line != "\r\n":
-                                    # A non-line-oriented payload only has one payload part.
-                                    json_obj = json.loads(line)
-                            except ValueError:
-                                log.warning("Bad json in record %s: %s", record_id, line)
-                            if json_obj:
-                                for item_type, item_id, item_date, item in self._item_iter(record_url, json_obj):
-                                    # None for item_type indicates that the type is not handled. OK to ignore.
-                                    if item_type is not None:
-                                        yield_item = True
-                                        if limit_item_types and item_type not in limit_item_types:
-                                            yield_item = False
-                                        if item_date_start and item_date and item_date < item_date_start:
-                                            yield_item = False
-                                        if item_date_end and item_date and item_date > item_date_end:
-                                            yield_item = False
-                                        if not self._select_item(item):
-                                            yield_item = False
-                                        if dedupe and yield_item:
-                                            if item_id in seen_ids:
-                                                yield_item = False
-                                            else:
-                                                seen_ids[item_id] = True
-                                        if yield_item:
-                                            if item is not None:
-                                                yield_count += 1
-                                                self._debug_counts(filename, record_count, yield_count,
-                                                                   by_record_count=False)
-                                                yield IterItem(item_type, item_id, item_date, record_url, item)
-                                            else:
-                                                log.warn("Bad response in record %s", record_id)
-                            line = stream.readline().decode('utf-8')
+    def iter(self, limit_item_types=None, dedupe=False, item_date_start=None, item_date_end=None, workers=None,
+             preserve_order=True, use_index=False, dedupe_mode=DEDUPE_MEMORY, dedupe_path=None,
+             dedupe_max_ids_in_memory=None, start_position=None, dedupe_ids=None, start_method=None):
+        """
+        :param workers: If more than 1, the WARC files are iterated in parallel by a pool of this many processes.
+        :param preserve_order: When iterating in parallel, yield the items of each WARC file in the order of
+        the filepaths. Otherwise, the items of the first WARC file to have items ready are yielded next.
+        :param use_index: If True, use a sidecar index of each WARC file to read only the records with
+        matching items, building the index if it does not exist or is stale.
+        :param dedupe_mode: How seen ids are kept when deduping. DEDUPE_MEMORY, DEDUPE_COMPACT (for integer ids),
+        or DEDUPE_DISK (for fixed memory).
+        :param dedupe_path: Directory for the seen ids database of DEDUPE_DISK.
+        :param dedupe_max_ids_in_memory: Maximum number of seen ids kept in memory by DEDUPE_DISK.
+        :param start_position: Position to start from, e.g., to continue a previous iteration. The WARC file at
+        the position is read from the start, skipping its consumed items. Requires preserve_order.
+        :param dedupe_ids: Ids of items that have already been yielded, e.g., by a previous iteration.
+        :param start_method: multiprocessing start method of the workers, e.g., "forkserver" when other
+        threads are running. None for the default.
+        :return: Iterator returning IterItems. While iterating, position is the index of the WARC file
+        and the number of its items (including duplicates) consumed.
+        """
+        file_kwargs = {
+            "limit_item_types": limit_item_types,
+            "item_date_start": item_date_start,
+            "item_date_end": item_date_end,
+            "use_index": use_index
+        }
+        start_file_index, skip_items = start_position or (0, 0)
+        filepaths = self.filepaths[start_file_index:]
+        if workers and workers > 1 and len(filepaths) > 1:
+            files_items = self._parallel_iter(filepaths, workers, preserve_order, file_kwargs,
+                                              start_method=start_method)
+        else:
+            files_items = (self._iter_file(filepath, **file_kwargs) for filepath in filepaths)
+
+        seen_ids = create_seen_ids(dedupe_mode, path=dedupe_path,
+                                   max_ids_in_memory=dedupe_max_ids_in_memory) if dedupe else None
+        self.position = (start_file_index, skip_items)
+        try:
+            if seen_ids is not None and dedupe_ids is not None:
+                for item_id in dedupe_ids:
+                    seen_ids.add(item_id)
+            for file_index, file_items in enumerate(files_items, start_file_index):
+                first_item_count = 1
+                if file_index == start_file_index and skip_items:
+                    file_items = islice(file_items, skip_items, None)
+                    first_item_count += skip_items
+                for item_count, iter_item in enumerate(file_items, first_item_count):
+                    self.position = (file_index, item_count)
+                    if seen_ids is not None and not seen_ids.add(iter_item.id):
+                        continue
+                    yield iter_item
+                self.position = (file_index + 1, 0)
+        finally:
+            if seen_ids is not None:
+                seen_ids.close()
+
+    def _parallel_iter(self, filepaths, workers, preserve_order, file_kwargs, start_method=None):
+        """
+        Returns an iterator over iterators of the IterItems of each WARC file, with the WARC files
+        iterated by a pool of processes. The items of each WARC file must be consumed before the next.
+
+        Each worker sends the items of its WARC file in chunks of ITEM_CHUNK_SIZE and blocks once
+        ITEM_QUEUE_CHUNKS chunks are waiting, so at most workers * ITEM_QUEUE_CHUNKS * ITEM_CHUNK_SIZE
+        items are buffered, however large the WARC files are.
+        """
+        filepaths = iter(filepaths)
+        running = deque()
+        context = multiprocessing.get_context(start_method)
+
+        def start_next():
+            for filepath in islice(filepaths, 1):
+                queue = context.Queue(ITEM_QUEUE_CHUNKS)
+                worker = context.Process(target=_iter_file_items, args=(self, filepath, file_kwargs, queue),
+                                         name="warc_iter_worker")
+                worker.start()
+                running.append((worker, queue))
+
+        for _ in range(workers):
+            start_next()
+        try:
+            while running:
+                if preserve_order:
+                    worker, queue = running[0]
+                    chunk = _NO_CHUNK
+                else:
+                    worker, queue, chunk = self._first_chunk(running)
+                yield _iter_worker_items(worker, queue, chunk)
+                running.remove((worker, queue))
+                if worker.is_alive():
+                    # The items were not all consumed.
+                    worker.kill()
+                worker.join()
+                # Keep the workers busy while the caller consumes the next WARC file.
+                start_next()
+        finally:
+            # Otherwise, the workers wait for their chunks to be consumed forever. They may inherit
+            # a SIGTERM handler, so are killed.
+            for worker, _ in running:
+                worker.kill()
+                worker.join()
+
+    @staticmethod
+    def _first_chunk(running):
+        """
+        Waits for the first of the running workers to send a chunk.
+
+        :return: the worker, its queue, and the chunk
+        """
+        while True:
+            for worker, queue in running:
+                chunk = _get_chunk(worker, queue, .01)
+                if chunk is not _NO_CHUNK:
+                    return worker, queue, chunk
+
+    def _iter_file(self, filepath, limit_item_types=None, item_date_start=None, item_date_end=None,
+                   use_index=False):
+        """
+        Returns an iterator over the IterItems of a single WARC file. Dedupe is not performed.
+        """
+        log.info("Iterating over %s", filepath)
+        filename = os.path.basename(filepath)
+        index = None
+        new_index = None
+        if use_index:
+            index = WarcIndex.load(filepath, self._iter_name())
+            if index is not None:
+                offsets = index.offsets(limit_item_types, item_date_start, item_date_end)
+                log.debug("Reading %s of %s indexed records from %s", len(offsets), len(index.records), filename)
+                if not offsets:
+                    return
+            else:
+                new_index = WarcIndex(filepath, self._iter_name())
+        with open(filepath, 'rb') as f:
+            if index is not None:
+                records = self._indexed_records(f, offsets)
+            elif self._is_gzip(f):
+                records = self._selected_records(f)
+            else:
+                records = self._scanned_selected_records(f)
+            yield_count = 0
+            for record_count, (offset, record) in enumerate(records):
+                self._debug_counts(filename, record_count, yield_count, by_record_count=True)
+
+                record_url = record.rec_headers.get_header('WARC-Target-URI')
+                record_id = record.rec_headers.get_header('WARC-Record-ID')
+                index_items = []
+                stream = record.content_stream()
+                line = stream.readline()
+                while line:
+                    json_obj = None
+                    try:
+                        if line != b"\r\n":
+                            # A non-line-oriented payload only has one payload part.
+                            # Decoded directly from the UTF-8 bytes.
+                            json_obj = loads(line)
+                    except ValueError:
+                        log.warning("Bad json in record %s: %s", record_id, line.decode('utf-8', 'replace'))
+                    if json_obj:
+                        for item_type, item_id, item_date, item in self._item_iter(record_url, json_obj):
+                            # None for item_type indicates that the type is not handled. OK to ignore.
+                            if item_type is not None:
+                                if new_index is not None:
+                                    index_items.append((item_type, item_id, item_date))
+                                yield_item = True
+                                if limit_item_types and item_type not in limit_item_types:
+                                    yield_item = False
+                                if item_date_start and item_date and item_date < item_date_start:
+                                    yield_item = False
+                                if item_date_end and item_date and item_date > item_date_end:
+                                    yield_item = False
+                                if not self._select_item(item):
+                                    yield_item = False
+                                if yield_item:
+                                    if item is not None:
+                                        yield_count += 1
+                                        self._debug_counts(filename, record_count, yield_count,
+                                                           by_record_count=False)
+                                        yield IterItem(item_type, item_id, item_date, record_url, item)
+                                    else:
+                                        log.warn("Bad response in record %s", record_id)
+                    line = stream.readline()
+                if new_index is not None:
+                    new_index.add_record(offset, record_url, index_items)
+        # Only reached if the whole WARC file was iterated.
+        if new_index is not None:
+            new_index.save()
+
+    def _selected_records(self, f):
+        """
+        Returns an iterator over the offsets and selected response records of a WARC file.
+
+        The HTTP headers are only parsed and the payloads are only decoded for selected records.
+        Other records are skipped by reading over them.
+        """
+        archive_iter = WARCIterator(f, no_record_parse=True)
+        for record in archive_iter:
+            if record.rec_type == 'response':
+                record_url = record.rec_headers.get_header('WARC-Target-URI')
+                if self._select_record(record_url):
+                    record.http_headers = archive_iter.loader.load_http_headers(record.rec_type, record_url,
+                                                                                record.raw_stream, record.length)
+                    # Until the record is read, offset is the start of the record.
+                    yield archive_iter.offset, record
+
+    def _scanned_selected_records(self, f):
+        """
+        Returns an iterator over the offsets and selected response records of an uncompressed WARC file.
+
+        Only the WARC headers are read. Other records are skipped by seeking over their content.
+        """
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                return
+            if not line.strip():
+                # Blank lines between records
+                continue
+            headers = {}
+            line = f.readline()
+            while line.strip():
+                name, _, value = line.decode('utf-8').partition(":")
+                headers[name.strip().lower()] = value.strip()
+                line = f.readline()
+            content_offset = f.tell()
+            if "content-length" not in headers:
+                log.warning("Record at %s of %s is missing Content-Length", offset, f.name)
+                return
+            record_url = headers.get("warc-target-uri")
+            if record_url and record_url.startswith("<") and record_url.endswith(">"):
+                record_url = record_url[1:-1]
+            if headers.get("warc-type") == "response" and self._select_record(record_url):
+                f.seek(offset)
+                yield offset, next(iter(WARCIterator(f)))
+            f.seek(content_offset + int(headers["content-length"]))
+
+    @staticmethod
+    def _is_gzip(f):
+        """
+        Returns True if the WARC file is gzip compressed.
+        """
+        is_gzip = f.read(2) == b'\x1f\x8b'
+        f.seek(0)
+        return is_gzip
+
+    @staticmethod
+    def _indexed_records(f, offsets):
+        """
+        Returns an iterator over the offsets and records at the provided offsets of a WARC file.
+        """
+        for offset in offsets:
+            f.seek(offset)
+            yield offset, next(iter(WARCIterator(f)))
+
+    def _iter_name(self):
+        """
+        Name of this warc iter, which identifies the indexes that it builds.
+        """
+        return "{}.{}".format(self.__class__.__module__, self.__class__.__name__)
 
     def _select_record(self, url):
         """
@@ -112,8 +385,10 @@ class BaseWarcIter:
         """
         return True
 
-    def print_iter(self, pretty=False, fp=sys.stdout, limit_item_types=None, print_item_type=False, dedupe=False):
-        for item_type, _, _, _, item in self.iter(limit_item_types=limit_item_types, dedupe=dedupe):
+    def print_iter(self, pretty=False, fp=sys.stdout, limit_item_types=None, print_item_type=False, dedupe=False,
+                   workers=None, use_index=False, dedupe_mode=DEDUPE_MEMORY):
+        for item_type, _, _, _, item in self.iter(limit_item_types=limit_item_types, dedupe=dedupe, workers=workers,
+                                                  use_index=use_index, dedupe_mode=dedupe_mode):
             if print_item_type:
                 fp.write("{}:".format(item_type))
             json.dump(item, fp, indent=4 if pretty else None)
@@ -155,7 +430,13 @@ class BaseWarcIter:
                                      "Item types are {}".format(", ".join(item_types)))
         parser.add_argument("--pretty", action="store_true", help="Format the json for viewing.")
         parser.add_argument("--dedupe", action="store_true", help="Remove duplicate items.")
+        parser.add_argument("--dedupe-mode", choices=DEDUPE_MODES, default=DEDUPE_MEMORY,
+                            help="How seen items are kept when removing duplicate items.")
         parser.add_argument("--print-item-type", action="store_true", help="Print the item type.")
+        parser.add_argument("--workers", type=int, help="Number of processes for iterating over the warcs.")
+        parser.add_argument("--use-index", action="store_true", help="Build and use sidecar indexes of the warcs.")
+        parser.add_argument("--json-decoder", choices=list(JSON_DECODERS),
+                            help="JSON decoder for payloads. Default is {}.".format(json_decoder_name))
         parser.add_argument("--debug", type=lambda v: v.lower() in ("yes", "true", "t", "1"), nargs="?",
                             default="False", const="True")
         parser.add_argument("filepaths", nargs="+", help="Filepath of the warc.")
@@ -166,6 +447,66 @@ class BaseWarcIter:
         logging.getLogger().setLevel(logging.DEBUG if args.debug else logging.INFO)
 
         main_limit_item_types = args.item_types.split(",") if vars(args).get('item_types') else None
+        if args.json_decoder:
+            set_json_decoder(args.json_decoder)
 
         cls(args.filepaths).print_iter(limit_item_types=main_limit_item_types, pretty=args.pretty,
-                                       print_item_type=args.print_item_type, dedupe=args.dedupe)
+                                       print_item_type=args.print_item_type, dedupe=args.dedupe,
+                                       workers=args.workers, use_index=args.use_index,
+                                       dedupe_mode=args.dedupe_mode)
+
+
+def _iter_file_items(warc_iter, filepath, file_kwargs, queue):
+    """
+    Puts the IterItems of a single WARC file on a queue in chunks of ITEM_CHUNK_SIZE, followed by None.
+    If iterating raises, an exception is put instead of the remaining chunks.
+
+    This is module-level so that it can be run by a worker process.
+    """
+    try:
+        chunk = []
+        for iter_item in warc_iter._iter_file(filepath, **file_kwargs):
+            chunk.append(iter_item)
+            if len(chunk) == ITEM_CHUNK_SIZE:
+                queue.put(chunk)
+                chunk = []
+        if chunk:
+            queue.put(chunk)
+        queue.put(None)
+    except Exception as e:
+        log.exception("Error iterating over %s: %s", filepath, e)
+        queue.put(Exception("Error iterating over {}: {}".format(filepath, e)))
+
+
+def _get_chunk(worker, queue, timeout):
+    """
+    Gets the next chunk from a worker's queue, raising if the worker died.
+
+    :return: the chunk, or _NO_CHUNK if none was sent within the timeout
+    """
+    try:
+        return queue.get(timeout=timeout)
+    except Empty:
+        if worker.is_alive():
+            return _NO_CHUNK
+    # Anything the worker put before exiting can be read.
+    try:
+        return queue.get_nowait()
+    except Empty:
+        raise Exception("{} exited with {}".format(worker.name, worker.exitcode))
+
+
+def _iter_worker_items(worker, queue, chunk=_NO_CHUNK):
+    """
+    Returns an iterator over the IterItems sent by a worker, starting with a chunk already received.
+    """
+    while True:
+        while chunk is _NO_CHUNK:
+            chunk = _get_chunk(worker, queue, 1)
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        for iter_item in chunk:
+            yield iter_item
+        chunk = _NO_CHUNK
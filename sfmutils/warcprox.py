@@ -1,8 +1,8 @@
-from subprocess import Popen
+from subprocess import Popen, TimeoutExpired
 import atexit
 import logging
 import sys
-from time import sleep
+from time import sleep, monotonic
 import os
 import socket
 import tempfile
@@ -42,16 +42,14 @@ class SubProcess(object):
                 log.debug("Terminating %s", self.name)
                 self.proc.terminate()
                 log.debug("Waiting for %s to terminate", self.name)
-                wait_secs = 0
-                while self.proc.poll() is None and wait_secs < self.terminate_wait_secs:
-                    wait_secs += 1
-                    sleep(1)
-                if wait_secs == self.terminate_wait_secs:
+                try:
+                    self.proc.wait(timeout=self.terminate_wait_secs)
+                    log.debug("%s terminated", self.name)
+                except TimeoutExpired:
                     log.debug("Killing %s", self.name)
                     self.proc.kill()
+                    self.proc.wait()
                     log.debug("Killed %s", self.name)
-                else:
-                    log.debug("%s terminated", self.name)
                 self.proc = None
         except Exception:
             try:
@@ -74,7 +72,8 @@ class warced:
     other configuration may be necessary for other HTTP libraries.
     """
 
-    def __init__(self, prefix, directory, compress=True, port=None, debug=False, interrupt=False, rollover_time=None):
+    def __init__(self, prefix, directory, compress=True, port=None, debug=False, interrupt=False, rollover_time=None,
+                 startup_timeout_secs=30, probe_interval_secs=.05, rollover_idle_time=None):
         """
         :param prefix: prefix for the WARC filename.
         :param directory: directory into which to place the WARCS.
@@ -84,6 +83,9 @@ class warced:
         :param debug: If True, runs warcprox with verbose option.
         :param interrupt: If True, interrupts request when warcprox receives SIGTERM.
         :param rollover_time: Number of seconds before rolling over to a new Warc.
+        :param startup_timeout_secs: Number of seconds to wait for warcprox to accept connections.
+        :param probe_interval_secs: Number of seconds between checks that warcprox is accepting connections.
+        :param rollover_idle_time: Number of seconds without writes before rolling over to a new Warc.
         """
         self.directory = directory
         self.prefix = prefix
@@ -95,6 +97,9 @@ class warced:
         self.ca_bundle = os.path.join(self.ca_dir, "warcprox-ca.pem")
         self.debug = debug
         self.rollover_time = rollover_time
+        self.startup_timeout_secs = startup_timeout_secs
+        self.probe_interval_secs = probe_interval_secs
+        self.rollover_idle_time = rollover_idle_time
 
     def __enter__(self):
         # Set environment variables that requests uses to configure proxy
@@ -102,10 +107,44 @@ class warced:
 
         self.warcprox = SubProcess(self._generate_commandline())
         # Wait for it to start up
-        sleep(5)
+        try:
+            self._wait_for_ready()
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
 
         return self
 
+    def is_running(self):
+        """
+        Returns True if warcprox has been started and has not exited.
+        """
+        return self.warcprox is not None and self.warcprox.proc is not None and self.warcprox.proc.poll() is None
+
+    def _wait_for_ready(self):
+        """
+        Waits until warcprox accepts connections on its port.
+        """
+        timeout = monotonic() + self.startup_timeout_secs
+        while True:
+            if self.warcprox.proc.poll() is not None:
+                raise Exception("warcprox exited with {}".format(self.warcprox.proc.returncode))
+            if os.path.exists(self.ca_bundle) and self._is_port_open(self.port):
+                log.debug("warcprox is ready on port %s", self.port)
+                return
+            if monotonic() > timeout:
+                raise Exception("warcprox not ready after {} seconds".format(self.startup_timeout_secs))
+            sleep(self.probe_interval_secs)
+
+    @staticmethod
+    def _is_port_open(port):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.settimeout(1)
+            return s.connect_ex(('localhost', port)) == 0
+        finally:
+            s.close()
+
     def _set_envs(self):
         os.environ["HTTP_PROXY"] = "localhost:{}".format(self.port)
         os.environ["HTTPS_PROXY"] = "localhost:{}".format(self.port)
@@ -146,6 +185,8 @@ class warced:
             cl += " -i"
         if self.rollover_time:
             cl += " --rollover-time {}".format(self.rollover_time)
+        if self.rollover_idle_time:
+            cl += " --rollover-idle-time {}".format(self.rollover_idle_time)
         return cl
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -43,6 +43,21 @@ class TestApiClient(TestCase):
         self.assertEqual(1, len(list(self.client.warcs(harvest_date_start="2018-05-25T13:56:47.980000Z"))))
         self.assertEqual(0, len(list(self.client.warcs(harvest_date_start="2019-05-25T13:57:47.980000Z"))))
 
+    @vcr.use_cassette(path="test_warcs_by_seed")
+    def test_concurrent_warcs(self):
+        warcs = list(self.client.concurrent_warcs([dict(seed_ids="4117a0b5c42646589f5dc81b0fa5eb0c"),
+                                                   dict(seed_ids=["4117a0b5c42646589f5dc81b0fa5eb0c",
+                                                                  "c07e9e180dd24abcac700d1934bda3d1"])]))
+        # Deduped
+        self.assertEqual(3, len(warcs))
+        self.assertEqual(3, len(set(warc["warc_id"] for warc in warcs)))
+
+    def test_no_prefetch(self):
+        client = ApiClient("http://localhost:8080/", prefetch=False)
+        with vcr.use_cassette("test_all_warcs"):
+            self.assertEqual(3, len(list(client.warcs())))
+        self.assertIsNone(client._prefetch_executor)
+
     @vcr.use_cassette()
     def test_all_collections(self):
         self.assertEqual(2, len(list(self.client.collections())))
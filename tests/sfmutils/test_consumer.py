@@ -5,10 +5,14 @@ import shutil
 import os
 import codecs
 import json
-from mock import MagicMock
+import threading
+from time import sleep
+import unittest
+from mock import MagicMock, patch, PropertyMock
+from kombu import Producer, Exchange
 from kombu.message import Message
 
-from sfmutils.consumer import BaseConsumer
+from sfmutils.consumer import BaseConsumer, AsyncPublisher, msgpack
 
 
 class TestableConsumer(BaseConsumer):
@@ -36,6 +40,20 @@ class TestableConsumer(BaseConsumer):
         self.on_persist_exception_called = True
 
 
+class ConcurrentConsumer(BaseConsumer):
+    def __init__(self, working_path, barrier=None):
+        BaseConsumer.__init__(self, persist_messages=True, working_path=working_path, concurrency=2)
+        self.barrier = barrier
+        self.handled = []
+
+    def on_message(self):
+        self.handled.append((self.working_path, self.routing_key, self.message,
+                             os.path.exists(os.path.join(self.working_path, "last_message.json"))))
+        if self.barrier:
+            # Both messages are handled at the same time.
+            self.barrier.wait(5)
+
+
 class TestBaseConsumer(tests.TestCase):
 
     def setUp(self):
@@ -110,6 +128,123 @@ class TestBaseConsumer(tests.TestCase):
         self.assertFalse(os.path.exists(self.message_filepath))
         self.assertEqual(self.message_file, consumer.on_message_file_message)
 
+    def test_callback_concurrent(self):
+        consumer = ConcurrentConsumer(self.working_path, barrier=threading.Barrier(2))
+        mock_mq_message = MagicMock(spec=Message)
+        mock_mq_message.delivery_info = {"routing_key": self.routing_key}
+        consumer._callback({"key1": "value1"}, mock_mq_message)
+        consumer._callback({"key1": "value2"}, mock_mq_message)
+        consumer._delivery_executor.shutdown(wait=True)
+
+        self.assertEqual(2, len(consumer.handled))
+        self.assertSetEqual({"value1", "value2"}, set(message["key1"] for _, _, message, _ in consumer.handled))
+        working_paths = set()
+        for working_path, routing_key, _, message_persisted in consumer.handled:
+            self.assertEqual(os.path.join(self.working_path, "deliveries"), os.path.dirname(working_path))
+            self.assertEqual(self.routing_key, routing_key)
+            self.assertTrue(message_persisted)
+            # Working path removed
+            self.assertFalse(os.path.exists(working_path))
+            working_paths.add(working_path)
+        self.assertEqual(2, len(working_paths))
+        self.assertIsNone(consumer.message)
+        self.assertEqual(2, mock_mq_message.ack.call_count)
+
+    def test_resume_from_file_concurrent(self):
+        delivery_path = os.path.join(self.working_path, "deliveries", "abc")
+        os.makedirs(delivery_path)
+        with codecs.open(os.path.join(delivery_path, "last_message.json"), 'w') as f:
+            json.dump(self.message_file, f)
+        consumer = ConcurrentConsumer(self.working_path)
+        consumer.resume_from_file()
+        consumer._delivery_executor.shutdown(wait=True)
+
+        self.assertEqual([(delivery_path, self.routing_key, self.message, True)], consumer.handled)
+        self.assertFalse(os.path.exists(delivery_path))
+
     def _write_message_file(self):
         with codecs.open(self.message_filepath, 'w') as f:
             json.dump(self.message_file, f)
+
+    @patch("sfmutils.consumer.ConsumerProducerMixin.producer", new_callable=PropertyMock, spec=Producer)
+    def test_publish_message(self, mock_producer):
+        consumer = BaseConsumer()
+        consumer.mq_config = True
+        consumer.exchange = MagicMock(spec=Exchange)
+        consumer._publish_message("key1", {"message": [1, 2]})
+        name, _, kwargs = mock_producer.mock_calls[1]
+        self.assertEqual("().publish", name)
+        self.assertEqual(b'{"message":[1,2]}', kwargs["body"])
+        self.assertEqual("application/json", kwargs["content_type"])
+        self.assertEqual("utf-8", kwargs["content_encoding"])
+        self.assertEqual("key1", kwargs["routing_key"])
+
+    @unittest.skipIf(msgpack is None, "Skipping test since msgpack not installed.")
+    @patch("sfmutils.consumer.ConsumerProducerMixin.producer", new_callable=PropertyMock, spec=Producer)
+    def test_publish_message_msgpack(self, mock_producer):
+        consumer = BaseConsumer(serializer="msgpack")
+        consumer.mq_config = True
+        consumer.exchange = MagicMock(spec=Exchange)
+        consumer._publish_message("key1", {"message": [1, 2]})
+        name, _, kwargs = mock_producer.mock_calls[1]
+        self.assertEqual({"message": [1, 2]}, msgpack.unpackb(kwargs["body"], raw=False))
+        self.assertEqual("application/x-msgpack", kwargs["content_type"])
+
+    def test_bad_serializer(self):
+        self.assertRaises(ValueError, BaseConsumer, serializer="xml")
+
+
+class TestAsyncPublisher(tests.TestCase):
+    def setUp(self):
+        self.published = []
+        self.blocked = threading.Event()
+        self.unblock = threading.Event()
+
+    def publish(self, routing_key, message, **kwargs):
+        if message == "block":
+            self.blocked.set()
+            self.unblock.wait(5)
+        self.published.append((routing_key, message, kwargs))
+
+    def test_publish(self):
+        publisher = AsyncPublisher(self.publish)
+        publisher.publish("key1", "block")
+        self.assertTrue(self.blocked.wait(5))
+        # Queued while blocked
+        publisher.publish("status", {"count": 1}, coalesce_key="status")
+        publisher.publish("warc_created", "warc1", trunate_debug_length=10)
+        publisher.publish("status", {"count": 2}, coalesce_key="status",
+                          merge_fn=lambda message, new_message: {"count": message["count"] + new_message["count"]})
+        self.unblock.set()
+        publisher.stop()
+
+        self.assertEqual([("key1", "block", {}),
+                          ("status", {"count": 3}, {}),
+                          ("warc_created", "warc1", {"trunate_debug_length": 10})], self.published)
+
+        # Once stopped, published synchronously
+        publisher.publish("key2", "message2")
+        self.assertEqual(("key2", "message2", {}), self.published[-1])
+
+    def test_min_interval(self):
+        publisher = AsyncPublisher(self.publish, min_interval_secs=.5)
+        publisher.publish("status", 1, coalesce_key="status")
+        sleep(.1)
+        publisher.publish("status", 2, coalesce_key="status")
+        publisher.publish("status", 3, coalesce_key="status")
+        sleep(.1)
+        # Waiting for the interval
+        self.assertEqual([1], [message for _, message, _ in self.published])
+        # Flush doesn't wait for the interval
+        publisher.flush()
+        self.assertEqual([1, 3], [message for _, message, _ in self.published])
+        publisher.stop()
+
+    def test_consumer(self):
+        consumer = BaseConsumer()
+        consumer._send_message = MagicMock()
+        consumer.start_async_publishing()
+        consumer._publish_message("key1", {"message": 1})
+        consumer.stop_async_publishing()
+        self.assertIsNone(consumer.async_publisher)
+        consumer._send_message.assert_called_once_with("key1", {"message": 1}, trunate_debug_length=None)
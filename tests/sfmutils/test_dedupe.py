@@ -0,0 +1,57 @@
+import tests
+import os
+import shutil
+import tempfile
+from sfmutils.dedupe import SeenIds, CompactSeenIds, DiskSeenIds, create_seen_ids, DEDUPE_COMPACT, DEDUPE_DISK
+
+
+class TestSeenIds(tests.TestCase):
+    def _test_seen_ids(self, seen_ids):
+        ids = [str(i * 7919) for i in range(5000)]
+        for item_id in ids:
+            self.assertTrue(seen_ids.add(item_id))
+        for item_id in ids:
+            self.assertFalse(seen_ids.add(item_id))
+        self.assertTrue(seen_ids.add("not_an_int"))
+        self.assertFalse(seen_ids.add("not_an_int"))
+        seen_ids.close()
+
+    def test_seen_ids(self):
+        self._test_seen_ids(SeenIds())
+
+    def test_compact_seen_ids(self):
+        seen_ids = CompactSeenIds(capacity_bits=4)
+        self._test_seen_ids(seen_ids)
+        # Grew from 16
+        self.assertTrue(len(seen_ids._table) >= 10000)
+
+    def test_compact_seen_ids_keys(self):
+        seen_ids = CompactSeenIds()
+        self.assertTrue(seen_ids.add(0))
+        self.assertFalse(seen_ids.add("0"))
+        self.assertTrue(seen_ids.add(2 ** 64 - 1))
+        self.assertFalse(seen_ids.add(2 ** 64 - 1))
+        # Not treated as an int
+        self.assertTrue(seen_ids.add("01"))
+        self.assertTrue(seen_ids.add(1))
+        self.assertTrue(seen_ids.add(2 ** 64))
+        self.assertTrue(seen_ids.add(None))
+        self.assertFalse(seen_ids.add(None))
+
+    def test_disk_seen_ids(self):
+        path = tempfile.mkdtemp()
+        try:
+            seen_ids = DiskSeenIds(path=path, max_ids_in_memory=100)
+            self.assertTrue(os.path.exists(seen_ids.db_filepath))
+            self._test_seen_ids(seen_ids)
+            self.assertFalse(os.path.exists(seen_ids.db_filepath))
+        finally:
+            shutil.rmtree(path)
+
+    def test_create_seen_ids(self):
+        self.assertIsInstance(create_seen_ids(), SeenIds)
+        self.assertIsInstance(create_seen_ids(DEDUPE_COMPACT), CompactSeenIds)
+        seen_ids = create_seen_ids(DEDUPE_DISK, max_ids_in_memory=10)
+        self.assertEqual(10, seen_ids.max_ids_in_memory)
+        seen_ids.close()
+        self.assertRaises(ValueError, create_seen_ids, "bogus")
@@ -1,14 +1,22 @@
 import tests
+import unittest
 import os
 import tempfile
 import shutil
 import json
 from mock import MagicMock, patch, Mock, PropertyMock
 import iso8601
-from sfmutils.exporter import BaseTable, BaseExporter, CODE_WARC_MISSING, CODE_NO_WARCS, CODE_BAD_REQUEST
+import petl
+import gzip
+import multiprocessing
+from collections import OrderedDict
+from itertools import islice
+from sfmutils.exporter import BaseTable, BaseExporter, CODE_WARC_MISSING, CODE_NO_WARCS, CODE_BAD_REQUEST, \
+    CODE_UNSUPPORTED_COMPRESSION, to_parquet, to_arrow, pyarrow, ExportResult, ExportProgress, ExportCheckpoint
 from sfmutils.api_client import ApiClient
 from sfmutils.warc_iter import IterItem
 from sfmutils.utils import datetime_now
+from tests.sfmutils.test_warc_iter import TestableNotLineOrientedWarcIter
 
 from kombu import Producer, Connection, Exchange
 
@@ -25,9 +33,10 @@ class TestExporter(tests.TestCase):
                        "sha1": "28076c245bc23d5e18e8531c19700dec869e2f9a",
                        "bytes": 58048,
                        "date_created": "2016-02-22T14:37:26Z"}]
+        # In the order that they are read.
         self.warc_filepaths = [
-            os.path.join(self.warc_base_path, "test_1-20151202200525007-00000-30033-GLSS-F0G5RP-8000.warc.gz"),
-            os.path.join(self.warc_base_path, "test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")]
+            os.path.join(self.warc_base_path, "test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz"),
+            os.path.join(self.warc_base_path, "test_1-20151202200525007-00000-30033-GLSS-F0G5RP-8000.warc.gz")]
         self.export_path = tempfile.mkdtemp()
         self.working_path = tempfile.mkdtemp()
 
@@ -105,7 +114,7 @@ class TestExporter(tests.TestCase):
 
         name, _, kwargs = mock_producer.mock_calls[1]
         self.assertEqual("export.status.test.test_user", kwargs["routing_key"])
-        export_status_message = kwargs["body"]
+        export_status_message = json.loads(kwargs["body"])
         self.assertEqual("running", export_status_message["status"])
         self.assertTrue(iso8601.parse_date(export_status_message["date_started"]))
         self.assertEqual("test1", export_status_message["id"])
@@ -115,7 +124,7 @@ class TestExporter(tests.TestCase):
 
         name, _, kwargs = mock_producer.mock_calls[3]
         self.assertEqual("export.status.test.test_user", kwargs["routing_key"])
-        export_status_message = kwargs["body"]
+        export_status_message = json.loads(kwargs["body"])
         self.assertEqual("completed success", export_status_message["status"])
         self.assertTrue(iso8601.parse_date(export_status_message["date_started"]))
         self.assertTrue(iso8601.parse_date(export_status_message["date_ended"]))
@@ -161,6 +170,9 @@ class TestExporter(tests.TestCase):
         exporter._producer_connection = mock_connection
         exporter.exchange = mock_exchange
 
+        # From a previous export
+        open(os.path.join(self.export_path, "test1_002.txt"), "w").close()
+
         exporter.routing_key = "export.start.test.test_user"
         exporter.message = export_message
         exporter.on_message()
@@ -171,6 +183,8 @@ class TestExporter(tests.TestCase):
         mock_table_cls.assert_called_once_with(self.warc_filepaths, False, None, None, [], None)
 
         self.assertTrue(exporter.result.success)
+        self.assertEqual(["test1_001.txt"], os.listdir(self.export_path))
+        self.assertFalse(os.path.exists(self.export_path + ".staging"))
         txt_filepath = os.path.join(self.export_path, "test1_001.txt")
         self.assertTrue(os.path.exists(txt_filepath))
         with open(txt_filepath, "r") as f:
@@ -180,10 +194,86 @@ class TestExporter(tests.TestCase):
 
         name, _, kwargs = mock_producer.mock_calls[3]
         self.assertEqual("export.status.test.test_user", kwargs["routing_key"])
-        export_status_message = kwargs["body"]
+        export_status_message = json.loads(kwargs["body"])
         self.assertEqual("completed success", export_status_message["status"])
         self.assertEqual("test1", export_status_message["id"])
 
+    @patch("sfmutils.exporter.ApiClient", autospec=True)
+    # Mock out Producer
+    @patch("sfmutils.consumer.ConsumerProducerMixin.producer", new_callable=PropertyMock, spec=Producer)
+    def test_export_html(self, mock_producer, mock_api_client_cls):
+        mock_table_cls = MagicMock()
+        mock_table = MagicMock(spec=BaseTable)
+        mock_table_cls.side_effect = [mock_table]
+        mock_table.__iter__ = Mock(return_value=iter([[("key1", "key2"), ("k1v1", "k2v1")], ]))
+
+        mock_api_client = MagicMock(spec=ApiClient)
+        mock_api_client_cls.side_effect = [mock_api_client]
+        mock_api_client.warcs.side_effect = [self.warcs]
+
+        export_message = {
+            "id": "test1",
+            "type": "test_user",
+            "collection": {
+                "id": "005b131f5f854402afa2b08a4b7ba960"
+            },
+            "format": "html",
+            "segment_size": None,
+            "path": self.export_path
+        }
+
+        exporter = BaseExporter("http://test", MagicMock(), mock_table_cls, self.working_path,
+                                warc_base_path=self.warc_base_path, host="testhost")
+        exporter.mq_config = True
+        exporter._producer_connection = MagicMock(spec=Connection)
+        exporter.exchange = MagicMock(spec=Exchange)
+        exporter.routing_key = "export.start.test.test_user"
+        exporter.message = export_message
+        exporter.on_message()
+
+        self.assertTrue(exporter.result.success)
+        with open(os.path.join(self.export_path, "test1_001.html"), "r") as f:
+            html = f.read()
+        self.assertTrue(html.startswith("<html><head><meta charset='utf-8'></head>\n<table class='petl'>"))
+        self.assertTrue(html.endswith("</table>\n</html>"))
+        self.assertTrue("<td>k1v1</td>" in html)
+
+    @patch("sfmutils.exporter.ApiClient", autospec=True)
+    def test_get_warc_paths_seed_batches(self, mock_api_client_cls):
+        mock_api_client = MagicMock(spec=ApiClient)
+        mock_api_client_cls.side_effect = [mock_api_client]
+        # Same WARC with different ids, e.g., returned for different batches
+        mock_api_client.concurrent_warcs.side_effect = [self.warcs + [dict(self.warcs[0], warc_id="x")]]
+
+        exporter = BaseExporter("http://test", MagicMock(), MagicMock(), self.working_path,
+                                warc_base_path=self.warc_base_path, host="testhost")
+        exporter.result = ExportResult()
+        seed_ids = ["{:032d}".format(i) for i in range(45)]
+        self.assertEqual(self.warc_filepaths, exporter._get_warc_paths(None, seed_ids, None, None))
+
+        mock_api_client.concurrent_warcs.assert_called_once_with(
+            [dict(collection_id=None, seed_ids=seed_ids[0:20], harvest_date_start=None, harvest_date_end=None),
+             dict(collection_id=None, seed_ids=seed_ids[20:40], harvest_date_start=None, harvest_date_end=None),
+             dict(collection_id=None, seed_ids=seed_ids[40:], harvest_date_start=None, harvest_date_end=None)])
+        mock_api_client.warcs.assert_not_called()
+
+    @patch("sfmutils.exporter.ApiClient", autospec=True)
+    def test_get_warc_paths_missing(self, mock_api_client_cls):
+        mock_api_client = MagicMock(spec=ApiClient)
+        mock_api_client_cls.side_effect = [mock_api_client]
+        mock_api_client.warcs.side_effect = [[dict(self.warcs[0], path="missing1.warc.gz")] + self.warcs +
+                                             [dict(self.warcs[1], path="missing2.warc.gz")]]
+
+        exporter = BaseExporter("http://test", MagicMock(), MagicMock(), self.working_path,
+                                warc_base_path=self.warc_base_path, host="testhost")
+        exporter.result = ExportResult()
+        self.assertEqual(self.warc_filepaths, exporter._get_warc_paths(None, None, None, None))
+
+        self.assertEqual([os.path.getsize(warc_filepath) for warc_filepath in self.warc_filepaths],
+                         list(exporter.warc_sizes.values()))
+        self.assertFalse(exporter.result.success)
+        self.assertEqual([CODE_WARC_MISSING, CODE_WARC_MISSING], [error.code for error in exporter.result.errors])
+
     @patch("sfmutils.exporter.ApiClient", autospec=True)
     def test_export_seeds(self, mock_api_client_cls):
         mock_warc_iter_cls = MagicMock()
@@ -235,6 +325,155 @@ class TestExporter(tests.TestCase):
             lines = f.readlines()
         self.assertEqual(3, len(lines))
 
+    @patch("sfmutils.exporter.ApiClient", autospec=True)
+    def test_export_compressed(self, mock_api_client_cls):
+        mock_table_cls = MagicMock()
+        mock_table = MagicMock(spec=BaseTable)
+        mock_table_cls.side_effect = [mock_table]
+        mock_table.__iter__ = Mock(return_value=iter([[("key1", "key2"), ("k1v1", "k2v1"), ("k1v2", "k2v2")], ]))
+
+        mock_api_client = MagicMock(spec=ApiClient)
+        mock_api_client_cls.side_effect = [mock_api_client]
+        mock_api_client.warcs.side_effect = [self.warcs]
+
+        export_message = {
+            "id": "test2",
+            "type": "test_user",
+            "collection": {
+                "id": "005b131f5f854402afa2b08a4b7ba960"
+            },
+            "format": "csv",
+            "segment_size": None,
+            "path": self.export_path,
+            "compression": "gzip",
+            "compression_level": 1
+        }
+
+        exporter = BaseExporter("http://test", MagicMock(), mock_table_cls, self.working_path,
+                                warc_base_path=self.warc_base_path, host="testhost")
+
+        exporter.routing_key = "export.start.test.test_user"
+        exporter.message = export_message
+        exporter.on_message()
+
+        self.assertTrue(exporter.result.success)
+        csv_filepath = os.path.join(self.export_path, "test2_001.csv.gz")
+        self.assertTrue(os.path.exists(csv_filepath))
+        with gzip.open(csv_filepath, "rt") as f:
+            lines = f.readlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual("k1v1,k2v1\n", lines[1])
+
+    @patch("sfmutils.exporter.ApiClient", autospec=True)
+    def test_export_not_compressible(self, mock_api_client_cls):
+        for export_format in ("xlsx", "html"):
+            with self.subTest(export_format=export_format):
+                mock_table_cls = MagicMock()
+                mock_table = MagicMock(spec=BaseTable)
+                mock_table_cls.side_effect = [mock_table]
+                mock_table.__iter__ = Mock(return_value=iter([[("key1", "key2"), ("k1v1", "k2v1")], ]))
+
+                mock_api_client = MagicMock(spec=ApiClient)
+                mock_api_client_cls.side_effect = [mock_api_client]
+                mock_api_client.warcs.side_effect = [self.warcs]
+
+                export_message = {
+                    "id": "test2",
+                    "type": "test_user",
+                    "collection": {
+                        "id": "005b131f5f854402afa2b08a4b7ba960"
+                    },
+                    "format": export_format,
+                    "segment_size": None,
+                    "path": self.export_path,
+                    "compression": "gzip"
+                }
+
+                exporter = BaseExporter("http://test", MagicMock(), mock_table_cls, self.working_path,
+                                        warc_base_path=self.warc_base_path, host="testhost")
+
+                exporter.routing_key = "export.start.test.test_user"
+                exporter.message = export_message
+                exporter.on_message()
+
+                self.assertTrue(exporter.result.success)
+                self.assertEqual(["test2_001.{}".format(export_format)], os.listdir(self.export_path))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    @patch("sfmutils.exporter.ApiClient", autospec=True)
+    def test_export_columnar_compressed(self, mock_api_client_cls):
+        for export_format, compression in (("parquet", "gzip"), ("parquet", "zstd"), ("arrow", "zstd")):
+            with self.subTest(export_format=export_format, compression=compression):
+                mock_table_cls = MagicMock()
+                mock_table = MagicMock(spec=BaseTable)
+                mock_table_cls.side_effect = [mock_table]
+                mock_table.__iter__ = Mock(
+                    return_value=iter([[("key1", "key2"), ("k1v1", "k2v1"), ("k1v2", "k2v2")], ]))
+                mock_table._column_types.return_value = None
+
+                mock_api_client = MagicMock(spec=ApiClient)
+                mock_api_client_cls.side_effect = [mock_api_client]
+                mock_api_client.warcs.side_effect = [self.warcs]
+
+                export_message = {
+                    "id": "test2",
+                    "type": "test_user",
+                    "collection": {
+                        "id": "005b131f5f854402afa2b08a4b7ba960"
+                    },
+                    "format": export_format,
+                    "segment_size": None,
+                    "path": self.export_path,
+                    "compression": compression
+                }
+
+                exporter = BaseExporter("http://test", MagicMock(), mock_table_cls, self.working_path,
+                                        warc_base_path=self.warc_base_path, host="testhost")
+
+                exporter.routing_key = "export.start.test.test_user"
+                exporter.message = export_message
+                exporter.on_message()
+
+                self.assertTrue(exporter.result.success)
+                filepath = os.path.join(self.export_path, "test2_001.{}".format(export_format))
+                self.assertEqual([os.path.basename(filepath)], os.listdir(self.export_path))
+                if export_format == "parquet":
+                    parquet_file = pyarrow.parquet.ParquetFile(filepath)
+                    self.assertEqual(compression.upper(),
+                                     parquet_file.metadata.row_group(0).column(0).compression)
+                    rows = parquet_file.read().to_pylist()
+                else:
+                    rows = pyarrow.ipc.open_file(filepath).read_all().to_pylist()
+                self.assertEqual([{"key1": "k1v1", "key2": "k2v1"}, {"key1": "k1v2", "key2": "k2v2"}], rows)
+
+    @patch("sfmutils.exporter.ApiClient", autospec=True)
+    def test_export_unsupported_compression(self, mock_api_client_cls):
+        mock_api_client = MagicMock(spec=ApiClient)
+        mock_api_client_cls.side_effect = [mock_api_client]
+        mock_api_client.warcs.side_effect = [self.warcs]
+
+        export_message = {
+            "id": "test2",
+            "type": "test_user",
+            "collection": {
+                "id": "005b131f5f854402afa2b08a4b7ba960"
+            },
+            "format": "csv",
+            "segment_size": None,
+            "path": self.export_path,
+            "compression": "rar"
+        }
+
+        exporter = BaseExporter("http://test", MagicMock(), MagicMock(), self.working_path,
+                                warc_base_path=self.warc_base_path, host="testhost")
+
+        exporter.routing_key = "export.start.test.test_user"
+        exporter.message = export_message
+        exporter.on_message()
+
+        self.assertFalse(exporter.result.success)
+        self.assertEqual(CODE_UNSUPPORTED_COMPRESSION, exporter.result.errors[0].code)
+
     @patch("sfmutils.exporter.ApiClient", autospec=True)
     def test_export_collection_missing_warc(self, mock_api_client_cls):
         mock_api_client = MagicMock(spec=ApiClient)
@@ -314,7 +553,7 @@ class TestExporter(tests.TestCase):
 
         name, _, kwargs = mock_producer.mock_calls[3]
         self.assertEqual("export.status.test.test_user", kwargs["routing_key"])
-        export_status_message = kwargs["body"]
+        export_status_message = json.loads(kwargs["body"])
         self.assertEqual("completed failure", export_status_message["status"])
         self.assertTrue(iso8601.parse_date(export_status_message["date_started"]))
         self.assertTrue(iso8601.parse_date(export_status_message["date_ended"]))
@@ -391,6 +630,242 @@ class TestExporter(tests.TestCase):
                 {"key1": "k1v" + str(1 + idx * 3), "key2": "k2v" + str(1 + idx * 3), "key3": "k3v" + str(1 + idx * 3)},
                 json.loads(lines[0]))
 
+    def test_export_full_json_compressed(self):
+        mock_warc_iter_cls = MagicMock()
+        mock_warc_iter = MagicMock()
+        mock_warc_iter_cls.side_effect = [mock_warc_iter]
+        mock_warc_iter.iter.return_value = [
+            IterItem(None, None, None, None, {"key1": "k1v1", "key2": "k2v1", "key3": "k3v1"}),
+            IterItem(None, None, None, None, {"key1": "k1v2", "key2": "k2v2", "key3": "k3v2"})]
+
+        export_filepath = os.path.join(self.export_path, "test")
+
+        exporter = BaseExporter(None, mock_warc_iter_cls, None, self.working_path, warc_base_path=self.warc_base_path,
+                                host="testhost")
+        exporter.message = {"compression": "gzip"}
+        exporter.compression = "gzip"
+
+        exporter._full_json_export(self.warcs, export_filepath, False, None, None, [], None)
+
+        file_path = export_filepath + '_001.json.gz'
+        self.assertTrue(os.path.exists(file_path))
+        with gzip.open(file_path, "rt") as f:
+            lines = f.readlines()
+        self.assertEqual(2, len(lines))
+        self.assertDictEqual({"key1": "k1v1", "key2": "k2v1", "key3": "k3v1"}, json.loads(lines[0]))
+
+    def test_iter_kwargs(self):
+        exporter = BaseExporter(None, None, None, self.working_path, warc_base_path=self.warc_base_path,
+                                host="testhost")
+        self.assertEqual({}, exporter._iter_kwargs())
+
+        exporter.warc_iter_workers = 4
+        exporter.message = {"dedupe": True, "dedupe_mode": "disk", "dedupe_max_ids_in_memory": 1000}
+        self.assertEqual({"workers": 4, "dedupe_mode": "disk", "dedupe_path": self.working_path,
+                          "dedupe_max_ids_in_memory": 1000}, exporter._iter_kwargs())
+
+    def test_parallel_table_export(self):
+        mock_warc_iter_cls = MagicMock()
+        mock_warc_iter = MagicMock()
+        mock_warc_iter_cls.return_value = mock_warc_iter
+        mock_warc_iter.iter.side_effect = lambda **kwargs: [
+            IterItem(None, None, None, None, {"key1": "k1v" + str(i), "key2": "k2v" + str(i), "key3": "k3v" + str(i)})
+            for i in range(1, 8)]
+
+        exporter = BaseExporter(None, mock_warc_iter_cls, None, self.working_path, warc_base_path=self.warc_base_path,
+                                host="testhost", segment_writers=2)
+        tables = TestableTable(self.warcs, False, None, None, [], mock_warc_iter_cls, segment_row_size=3)
+        parallel_filepaths = exporter._table_export(tables, os.path.join(self.export_path, "parallel"), "csv",
+                                                    petl.tocsv)
+        exporter.segment_writers = None
+        filepaths = exporter._table_export(tables, os.path.join(self.export_path, "test"), "csv", petl.tocsv)
+
+        self.assertEqual(3, len(parallel_filepaths))
+        self.assertEqual(os.path.join(self.export_path, "parallel_003.csv"), parallel_filepaths[2])
+        for parallel_filepath, filepath in zip(parallel_filepaths, filepaths):
+            with open(parallel_filepath) as parallel_f, open(filepath) as f:
+                self.assertEqual(f.read(), parallel_f.read())
+        with open(parallel_filepaths[2]) as f:
+            self.assertEqual(["key1,key2,key3\n", "k1v7,k2v7,k3v7\n"], f.readlines())
+
+    def test_parallel_table_export_failure(self):
+        mock_warc_iter_cls = MagicMock()
+        mock_warc_iter_cls.return_value.iter.return_value = [IterItem(None, None, None, None, {"key1": "k1v1"})]
+
+        exporter = BaseExporter(None, mock_warc_iter_cls, None, self.working_path, warc_base_path=self.warc_base_path,
+                                host="testhost", segment_writers=2)
+        tables = TestableTable(self.warcs, False, None, None, [], mock_warc_iter_cls, segment_row_size=3)
+        # Missing keys
+        self.assertRaises(Exception, exporter._table_export, tables, os.path.join(self.export_path, "test"), "csv",
+                          petl.tocsv)
+
+    def test_parallel_table_export_iter_failure(self):
+        def iter_items():
+            for i in range(4):
+                yield IterItem(None, None, None, None, {"key1": "k1v{}".format(i), "key2": "k2v{}".format(i),
+                                                        "key3": "k3v{}".format(i)})
+            raise Exception("Bad WARC")
+
+        mock_warc_iter_cls = MagicMock()
+        mock_warc_iter_cls.return_value.iter.return_value = iter_items()
+
+        exporter = BaseExporter(None, mock_warc_iter_cls, None, self.working_path, warc_base_path=self.warc_base_path,
+                                host="testhost", segment_writers=2)
+        tables = TestableTable(self.warcs, False, None, None, [], mock_warc_iter_cls, segment_row_size=3)
+        self.assertRaises(Exception, exporter._table_export, tables, os.path.join(self.export_path, "test"), "csv",
+                          petl.tocsv)
+        # The writers waiting for more items are killed.
+        self.assertEqual([], multiprocessing.active_children())
+
+    def test_delivery_workers(self):
+        exporter = BaseExporter(None, StatusWarcIter, None, self.working_path, host="testhost", warc_iter_workers=2,
+                                segment_writers=2)
+        self.assertIsNone(exporter._worker_start_method())
+        # Other threads are running while a copy handles a message, so its workers aren't forked.
+        exporter = exporter._copy_for_delivery(os.path.join(self.working_path, "delivery"))
+        self.assertEqual("forkserver", exporter._worker_start_method())
+        self.assertEqual({"workers": 2, "start_method": "forkserver"}, exporter._iter_kwargs())
+
+        tables = StatusTable(self.warc_filepaths, False, None, None, [], StatusWarcIter, 500)
+        tables.iter_kwargs = exporter._iter_kwargs()
+        exporter._table_export(tables, os.path.join(self.export_path, "test"), "csv", petl.tocsv)
+        self.assertEqual(3, len(os.listdir(self.export_path)))
+        self.assertEqual(1229, len(self._export_lines()))
+
+    @patch("sfmutils.exporter.PROGRESS_CHECK_ITEMS", 2)
+    def test_table_export_progress(self):
+        mock_warc_iter_cls = MagicMock()
+        mock_warc_iter = mock_warc_iter_cls.return_value
+        mock_warc_iter.iter.return_value = [
+            IterItem(None, None, None, None, {"key1": "k1v1", "key2": "k2v1", "key3": "k3v1"}),
+            IterItem(None, None, None, None, {"key1": "k1v2", "key2": "k2v2", "key3": "k3v2"}),
+            IterItem(None, None, None, None, {"key1": "k1v3", "key2": "k2v3", "key3": "k3v3"})]
+        # First WARC is done.
+        mock_warc_iter.position = (1, 1)
+
+        exporter = BaseExporter(None, mock_warc_iter_cls, None, self.working_path, warc_base_path=self.warc_base_path,
+                                host="testhost")
+        reports = []
+        exporter.progress = ExportProgress(OrderedDict([("warc1", 100), ("warc2", 300)]),
+                                           report_fn=lambda progress: reports.append(progress.to_map()),
+                                           interval_secs=0)
+        tables = TestableTable(self.warcs, False, None, None, [], mock_warc_iter_cls, segment_row_size=2)
+        tables.progress = exporter.progress
+        exporter._table_export(tables, os.path.join(self.export_path, "test"), "csv", petl.tocsv)
+
+        # After 2 items, then after each segment
+        self.assertEqual([2, 2, 3], [report["items"] for report in reports])
+        self.assertEqual([0, 1, 2], [report["segments"] for report in reports])
+        report = reports[-1]
+        self.assertEqual(1, report["warcs"])
+        self.assertEqual(2, report["warcs_total"])
+        self.assertEqual(100, report["bytes"])
+        self.assertEqual(400, report["bytes_total"])
+        self.assertTrue(report["items_per_sec"])
+        self.assertIsNotNone(report["eta_secs"])
+
+    def test_progress_rate_limited(self):
+        reports = []
+        progress = ExportProgress(OrderedDict([("warc1", 100)]), report_fn=reports.append)
+        progress.segment_done()
+        self.assertEqual([], reports)
+        progress.report(force=True)
+        self.assertEqual([progress], reports)
+        self.assertEqual({"warcs": 0, "warcs_total": 1, "bytes": 0, "bytes_total": 100, "segments": 1,
+                          "items": 0, "eta_secs": None}, {k: v for k, v in progress.to_map().items()
+                                                          if k != "items_per_sec"})
+
+    def test_export_full_json_resume(self):
+        self._test_resume(lambda exporter, warc_paths, base_filepath: exporter._full_json_export(
+            warc_paths, base_filepath, True, None, None, [], 500))
+
+    def test_table_export_resume(self):
+        def export(exporter, warc_paths, base_filepath):
+            tables = StatusTable(warc_paths, True, None, None, [], exporter.warc_iter_cls, 500)
+            tables.checkpoint = exporter.checkpoint
+            exporter._table_export(tables, base_filepath, "csv", petl.tocsv)
+        self._test_resume(export)
+
+    def test_checkpoint_seen_ids(self):
+        mock_warc_iter = MagicMock()
+        checkpoint = ExportCheckpoint(self.working_path, {"id": "test"}, ["warc1"], dedupe=True)
+        iter_items = checkpoint.track(mock_warc_iter,
+                                      iter([IterItem(None, item_id, None, None, {}) for item_id in ("1", "2", "3")]))
+        mock_warc_iter.position = (0, 2)
+        self.assertEqual(["1", "2"], [iter_item.id for iter_item in islice(iter_items, 2)])
+        checkpoint.segment_end()
+        # The ids are written as they are yielded, rather than kept until the segment is done.
+        with open(checkpoint.seen_ids_filepath) as f:
+            self.assertEqual(['"1"\n', '"2"\n'], f.readlines())
+        mock_warc_iter.position = (1, 0)
+        self.assertEqual(["3"], [iter_item.id for iter_item in iter_items])
+        checkpoint.segment_end()
+        checkpoint.segment_done("test_001.csv")
+        self.assertEqual((0, 2), checkpoint.position)
+        self.assertEqual(8, checkpoint.seen_ids_size)
+
+        # The ids of the segment that was not done are dropped.
+        checkpoint = ExportCheckpoint(self.working_path, {"id": "test"}, ["warc1"], dedupe=True)
+        self.assertTrue(checkpoint.load())
+        self.assertEqual(["1", "2"], list(checkpoint.iter_kwargs()["dedupe_ids"]))
+
+    def _test_resume(self, export):
+        base_filepath = os.path.join(self.export_path, "test")
+        message = {"id": "test"}
+        # The items of the first WARC are duplicated by the last WARC.
+        warc_paths = self.warc_filepaths + self.warc_filepaths[:1]
+
+        # Crashes during the third segment
+        exporter = BaseExporter(None, CrashingWarcIter, None, self.working_path, host="testhost")
+        exporter.checkpoint = ExportCheckpoint(self.working_path, message, warc_paths, dedupe=True)
+        self.assertFalse(exporter.checkpoint.load())
+        self.assertRaises(Exception, export, exporter, warc_paths, base_filepath)
+
+        exporter = BaseExporter(None, StatusWarcIter, None, self.working_path, host="testhost")
+        exporter.checkpoint = ExportCheckpoint(self.working_path, message, warc_paths, dedupe=True)
+        self.assertTrue(exporter.checkpoint.load())
+        self.assertEqual(["{}_{}".format(base_filepath, count) for count in ("001", "002")],
+                         [os.path.splitext(filepath)[0] for filepath in exporter.checkpoint.segment_filepaths])
+        export(exporter, warc_paths, base_filepath)
+        resumed_lines = self._export_lines()
+        shutil.rmtree(self.export_path)
+        os.makedirs(self.export_path)
+
+        # Different message, so not resumed.
+        exporter.checkpoint = ExportCheckpoint(self.working_path, {"id": "test2"}, warc_paths, dedupe=True)
+        self.assertFalse(exporter.checkpoint.load())
+        export(exporter, warc_paths, base_filepath)
+        self.assertEqual(self._export_lines(), resumed_lines)
+        self.assertEqual(1229, len(resumed_lines))
+
+    def _export_lines(self):
+        lines = []
+        for filename in sorted(os.listdir(self.export_path)):
+            with open(os.path.join(self.export_path, filename)) as f:
+                lines.extend(line for line in f if line != "id\n")
+        return lines
+
+
+class StatusWarcIter(TestableNotLineOrientedWarcIter):
+    def __init__(self, filepaths, limit_user_ids=None):
+        TestableNotLineOrientedWarcIter.__init__(self, filepaths)
+
+
+class CrashingWarcIter(StatusWarcIter):
+    def iter(self, **kwargs):
+        for count, iter_item in enumerate(StatusWarcIter.iter(self, **kwargs), 1):
+            if count > 1100:
+                raise Exception("Crashed")
+            yield iter_item
+
+
+class StatusTable(BaseTable):
+    def _header_row(self):
+        return "id",
+
+    def _row(self, item):
+        return item["id_str"],
+
 
 class TestableTable(BaseTable):
     def _header_row(self):
@@ -454,3 +929,65 @@ class TestBaseTable(tests.TestCase):
         mock_warc_iter_cls.assert_called_with(self.warc_paths, limit_uids)
         mock_warc_iter.iter.assert_called_once_with(dedupe=True, item_date_end=None, item_date_start=now,
                                                     limit_item_types=None)
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+class TestColumnarFormats(tests.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.now = datetime_now()
+        self.table = [("key1", "key2", "key3"), (1, "k2v1", self.now), (2, None, self.now), (3, 3, None)]
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+    def test_to_parquet(self):
+        filepath = os.path.join(self.path, "test.parquet")
+        to_parquet(self.table, filepath, column_types=("int", None, "datetime"), batch_size=2)
+
+        parquet_file = pyarrow.parquet.ParquetFile(filepath)
+        self.assertEqual(2, parquet_file.num_row_groups)
+        self.assertEqual("int64", str(parquet_file.schema_arrow.field("key1").type))
+        self.assertEqual("string", str(parquet_file.schema_arrow.field("key2").type))
+        rows = parquet_file.read().to_pylist()
+        self.assertEqual(3, len(rows))
+        self.assertEqual({"key1": 3, "key2": "3", "key3": None}, rows[2])
+        self.assertEqual(self.now, rows[0]["key3"])
+
+    def test_untyped_columns(self):
+        filepath = os.path.join(self.path, "test.parquet")
+        to_parquet(self.table, filepath, batch_size=2)
+
+        rows = pyarrow.parquet.read_table(filepath).to_pylist()
+        self.assertEqual({"key1": "1", "key2": "k2v1", "key3": self.now.isoformat()}, rows[0])
+        self.assertEqual({"key1": "3", "key2": "3", "key3": None}, rows[2])
+
+    def test_later_batch_types(self):
+        # Later batches have values that don't fit a type inferred from the first batch.
+        filepath = os.path.join(self.path, "test.parquet")
+        to_parquet([("key1",), (1,), (1.5,), ("k1v3",), (2 ** 70,)], filepath, batch_size=1)
+        self.assertEqual(["1", "1.5", "k1v3", str(2 ** 70)],
+                         pyarrow.parquet.read_table(filepath).column("key1").to_pylist())
+
+        # Declared types are not converted.
+        for column_type, value in (("int", 1.5), ("int", "k1v3"), ("int", 2 ** 70), ("int", True),
+                                   ("float", 2 ** 60 + 1), ("bool", 1), ("datetime", "k1v3")):
+            with self.subTest(column_type=column_type, value=value):
+                self.assertRaises(ValueError, to_parquet, [("key1",), (None,), (value,)], filepath,
+                                  column_types=(column_type,), batch_size=1)
+        to_parquet([("key1",), (1.5,), (2,)], filepath, column_types=("float",), batch_size=1)
+        self.assertEqual([1.5, 2.0], pyarrow.parquet.read_table(filepath).column("key1").to_pylist())
+
+    def test_to_arrow(self):
+        filepath = os.path.join(self.path, "test.arrow")
+        to_arrow(self.table, filepath, column_types=("float", "string", None))
+
+        arrow_table = pyarrow.ipc.open_file(filepath).read_all()
+        self.assertEqual("double", str(arrow_table.schema.field("key1").type))
+        self.assertEqual([1.0, 2.0, 3.0], arrow_table.column("key1").to_pylist())
+
+    def test_empty(self):
+        filepath = os.path.join(self.path, "test.parquet")
+        to_parquet([("key1", "key2")], filepath)
+        self.assertEqual(["key1", "key2"], pyarrow.parquet.read_table(filepath).column_names)
@@ -10,11 +10,12 @@ from kombu.message import Message
 import iso8601
 import logging
 import codecs
+import sqlite3
 from tests import TestCase
 from datetime import date, timedelta
 from sfmutils.harvester import BaseHarvester, STATUS_RUNNING, STATUS_FAILURE, STATUS_SUCCESS, STATUS_STOPPING, \
-    CODE_HARVEST_RESUMED, CODE_UNKNOWN_ERROR
-from sfmutils.state_store import JsonHarvestStateStore
+    CODE_HARVEST_RESUMED, CODE_UNKNOWN_ERROR, HarvestResult
+from sfmutils.state_store import JsonHarvestStateStore, SqliteHarvestStateStore
 from sfmutils.harvester import Msg
 from sfmutils.warcprox import warced
 
@@ -99,6 +100,34 @@ class TestableHarvester(BaseHarvester):
         self.state_store.set_state("testable_harvester", "stuff.last", self.process_warc_call_count)
 
 
+class SlowProcessingHarvester(BaseHarvester):
+    def process_warc(self, warc_filepath):
+        # Earlier WARCs take longer, so that they finish processing after later WARCs.
+        warc_number = int(os.path.basename(warc_filepath).split("-")[2])
+        sleep(.1 * (4 - warc_number))
+        self.result.increment_stats("stuff", count=warc_number)
+        self.state_store.set_state("testable_harvester", "stuff.last", warc_number)
+        self.state_store.set_state("testable_harvester", "stuff.{}".format(warc_number), True)
+
+
+class FailingProcessingHarvester(SlowProcessingHarvester):
+    def __init__(self, working_path, warc_numbers=(), fail_warc_number=1, **kwargs):
+        SlowProcessingHarvester.__init__(self, working_path, **kwargs)
+        # The WARCs written by harvest_seeds()
+        self.warc_numbers = warc_numbers
+        self.fail_warc_number = fail_warc_number
+
+    def harvest_seeds(self):
+        for i in self.warc_numbers:
+            write_fake_warc(self.warc_temp_dir, WARC_FILENAME_TEMPLATE.format(i))
+
+    def process_warc(self, warc_filepath):
+        SlowProcessingHarvester.process_warc(self, warc_filepath)
+        if self.fail_warc_number is not None and \
+                os.path.basename(warc_filepath) == WARC_FILENAME_TEMPLATE.format(self.fail_warc_number):
+            raise Exception("Bad WARC")
+
+
 class TestBaseHarvester(TestCase):
     def setUp(self):
         self.working_path = tempfile.mkdtemp()
@@ -128,7 +157,7 @@ class TestBaseHarvester(TestCase):
 
     def assert_warc_created_message(self, warc_number, _, __, kwargs):
         self.assertEqual("warc_created", kwargs["routing_key"])
-        warc_created_message = kwargs["body"]
+        warc_created_message = json.loads(kwargs["body"])
         self.assertEqual(warc_created_message["harvest"]["id"], "test:1")
         self.assertEqual(warc_created_message["harvest"]["type"], "test_type")
         self.assertEqual(warc_created_message["collection_set"]["id"], "test_collection_set")
@@ -144,7 +173,7 @@ class TestBaseHarvester(TestCase):
     def assert_first_running_harvest_status(self, _, __, kwargs, is_resume=False):
         # Running harvest result message
         self.assertEqual("harvest.status.test.test_usertimeline", kwargs["routing_key"])
-        harvest_result_message = kwargs["body"]
+        harvest_result_message = json.loads(kwargs["body"])
         self.assertEqual(harvest_result_message["id"], "test:1")
         self.assertEqual(harvest_result_message["status"], STATUS_RUNNING)
         if not is_resume:
@@ -174,7 +203,7 @@ class TestBaseHarvester(TestCase):
     def assert_second_running_harvest_status(self, _, __, kwargs, is_resume=False):
         # Running harvest result message
         self.assertEqual("harvest.status.test.test_usertimeline", kwargs["routing_key"])
-        harvest_result_message = kwargs["body"]
+        harvest_result_message = json.loads(kwargs["body"])
         self.assertEqual(harvest_result_message["id"], "test:1")
         self.assertEqual(harvest_result_message["status"], STATUS_RUNNING)
         if not is_resume:
@@ -218,7 +247,7 @@ class TestBaseHarvester(TestCase):
 
     def assert_running_harvest_status(self, warc_count, _, __, kwargs, is_resume=False, status=STATUS_RUNNING):
         self.assertEqual("harvest.status.test.test_usertimeline", kwargs["routing_key"])
-        harvest_result_message = kwargs["body"]
+        harvest_result_message = json.loads(kwargs["body"])
         self.assertEqual(harvest_result_message["id"], "test:1")
         self.assertEqual(harvest_result_message["status"], status)
         if not is_resume:
@@ -249,7 +278,7 @@ class TestBaseHarvester(TestCase):
 
     def assert_completed_harvest_status(self, warc_count, _, __, kwargs, is_resume=False):
         self.assertEqual("harvest.status.test.test_usertimeline", kwargs["routing_key"])
-        harvest_result_message = kwargs["body"]
+        harvest_result_message = json.loads(kwargs["body"])
         self.assertEqual(harvest_result_message["id"], "test:1")
         self.assertEqual(harvest_result_message["status"], STATUS_SUCCESS)
         if not is_resume:
@@ -354,6 +383,33 @@ class TestBaseHarvester(TestCase):
         # Check state store
         self.assert_state_store(5)
 
+    @patch("sfmutils.harvester.warced", autospec=True)
+    @patch("sfmutils.consumer.ConsumerProducerMixin.producer", new_callable=PropertyMock, spec=Producer)
+    def test_stream_consume_persistent_warcprox(self, mock_producer, mock_warced_class):
+        mock_connection = MagicMock(spec=Connection)
+        mock_exchange = MagicMock(spec=Exchange)
+        mock_exchange.name = "test exchange"
+        mock_warced = MagicMock(spec=warced)
+        mock_warced_class.return_value = mock_warced
+        mock_message = MagicMock(spec=Message)
+        mock_message.delivery_info = {"routing_key": "harvest.start.test.test_usertimeline"}
+
+        harvester = TestableHarvester(self.working_path, mock_connection, mock_exchange, shutdown_on_count=3)
+        harvester.persistent_warcprox = True
+        harvester._callback(self.message, mock_message)
+
+        self.assertEqual(3, harvester.harvest_seed_call_count)
+        self.assertEqual(3, harvester.process_warc_call_count)
+
+        # Started once and stopped once
+        mock_warced_class.assert_called_once_with("test_1", harvester.warc_temp_dir, debug=False, interrupt=True,
+                                                  rollover_idle_time=5)
+        mock_warced.__enter__.assert_called_once_with()
+        mock_warced.__exit__.assert_called_once_with(None, None, None)
+        self.assertIsNone(harvester._warcprox)
+
+        self.assert_warcs_moved(1, 4)
+
     @patch("sfmutils.harvester.warced", autospec=True)
     @patch("sfmutils.consumer.ConsumerProducerMixin.producer", new_callable=PropertyMock, spec=Producer)
     def test_stream_harvest_from_file_and_resume(self, mock_producer, mock_warced_class):
@@ -435,7 +491,7 @@ class TestBaseHarvester(TestCase):
         self.assert_first_running_harvest_status(*mock_producer.mock_calls[1])
         name, _, kwargs = mock_producer.mock_calls[3]
         self.assertEqual("harvest.status.test.test_usertimeline", kwargs["routing_key"])
-        harvest_result_message = kwargs["body"]
+        harvest_result_message = json.loads(kwargs["body"])
         self.assertEqual(harvest_result_message["id"], "test:1")
         self.assertEqual(harvest_result_message["status"], STATUS_FAILURE)
         self.assertEqual(1, len(harvest_result_message["infos"]))
@@ -510,12 +566,260 @@ class TestBaseHarvester(TestCase):
         # Running harvest result message
         (name, _, kwargs) = mock_producer.mock_calls[1]
         self.assertEqual("harvest.status.test.test_usertimeline", kwargs["routing_key"])
-        harvest_result_message = kwargs["body"]
+        harvest_result_message = json.loads(kwargs["body"])
         self.assertEqual(harvest_result_message["id"], "test:1")
         self.assertEqual(harvest_result_message["status"], STATUS_FAILURE)
         self.assertEqual(1, len(harvest_result_message["errors"]))
         self.assertIsNotNone(iso8601.parse_date(harvest_result_message["date_started"]))
 
+    @patch("sfmutils.harvester.DIGEST_CHUNK_SIZE", 4)
+    def test_warc_info(self):
+        harvester = BaseHarvester(self.working_path, host="localhost")
+        write_fake_warc(self.working_path, WARC_FILENAME_TEMPLATE.format(1))
+        warc_filepath = os.path.join(self.working_path, WARC_FILENAME_TEMPLATE.format(1))
+        warc_info = harvester._warc_info(warc_filepath)
+        self.assertEqual(warc_filepath, warc_info.path)
+        self.assertEqual(9, warc_info.bytes)
+        self.assertEqual("3d63d3c46d5dfac8495621c9c697e2089e5359b2", warc_info.sha1)
+        self.assertIsNotNone(warc_info.date_created.tzinfo)
+
+    def test_process_warcs_with_workers(self):
+        harvester = SlowProcessingHarvester(self.working_path, host="localhost", warc_processing_workers=3)
+        harvester.message = self.message
+        harvester.result_filepath = os.path.join(self.working_path, "test_1_result.json")
+        harvester.warc_temp_dir = harvester._create_warc_temp_dir()
+        harvester._create_state_store()
+        harvester.result = HarvestResult()
+        harvester.result.started = date.today()
+        for i in range(4):
+            write_fake_warc(harvester.warc_temp_dir, WARC_FILENAME_TEMPLATE.format(i))
+
+        harvester._queue_warc_files()
+        harvester.warc_processing_queue.join()
+
+        # Committed in name order
+        self.assertEqual([os.path.join(self.harvest_path, "2015/11/09/19", WARC_FILENAME_TEMPLATE.format(i))
+                          for i in range(4)], harvester.result.warcs)
+        self.assertEqual(6, harvester.result.stats_summary()["stuff"])
+        state_store = JsonHarvestStateStore(self.message["path"])
+        self.assertEqual(3, state_store.get_state("testable_harvester", "stuff.last"))
+        for i in range(4):
+            self.assertTrue(state_store.get_state("testable_harvester", "stuff.{}".format(i)))
+
+    def test_process_warcs_with_workers_failure(self):
+        harvester = FailingProcessingHarvester(self.working_path, warc_numbers=range(4), host="localhost",
+                                               use_warcprox=False, warc_processing_workers=3)
+        harvester.message = self.message
+        harvester.on_message()
+
+        # Only the WARC before the failed WARC is committed, although later WARCs finished processing first.
+        self.assertEqual([os.path.join(self.harvest_path, "2015/11/09/19", WARC_FILENAME_TEMPLATE.format(0))],
+                         harvester.result.warcs)
+        # The uncommitted WARCs are kept for resuming.
+        for i in range(1, 4):
+            self.assertTrue(os.path.exists(os.path.join(harvester.warc_temp_dir, WARC_FILENAME_TEMPLATE.format(i))))
+        self.assertEqual(0, harvester.result.stats_summary().get("stuff", 0))
+        state_store = JsonHarvestStateStore(self.message["path"])
+        self.assertEqual(0, state_store.get_state("testable_harvester", "stuff.last"))
+        for i in range(1, 4):
+            self.assertIsNone(state_store.get_state("testable_harvester", "stuff.{}".format(i)))
+        self.assertFalse(harvester.result.success)
+        self.assertEqual(1, len(harvester.result.errors))
+        self.assertTrue(harvester.stop_harvest_seeds_event.is_set())
+
+        # The next harvest by the same harvester resumes with the uncommitted WARCs.
+        harvester.warc_numbers = (4,)
+        harvester.fail_warc_number = None
+        harvester.on_message()
+
+        self.assertEqual([os.path.join(self.harvest_path, "2015/11/09/19", WARC_FILENAME_TEMPLATE.format(i))
+                          for i in range(1, 5)], harvester.result.warcs)
+        self.assertTrue(harvester.result.success)
+        self.assertEqual(CODE_HARVEST_RESUMED, harvester.result.warnings[0].code)
+        self.assertFalse(os.path.exists(harvester.warc_temp_dir))
+        state_store = JsonHarvestStateStore(self.message["path"])
+        self.assertEqual(4, state_store.get_state("testable_harvester", "stuff.last"))
+
+    def test_close_state_store(self):
+        harvester = BaseHarvester(self.working_path, host="localhost", state_store_cls=SqliteHarvestStateStore)
+        harvester.message = self.message
+        harvester._create_state_store()
+        sqlite_state_store = harvester.state_store.state_store
+        harvester._create_state_store()
+        # The previous store is closed when replaced.
+        self.assertRaises(sqlite3.ProgrammingError, sqlite_state_store.get_state, "resource_type1", "key1")
+        sqlite_state_store = harvester.state_store.state_store
+        harvester._close_state_store()
+        self.assertIsNone(harvester.state_store)
+        self.assertRaises(sqlite3.ProgrammingError, sqlite_state_store.get_state, "resource_type1", "key1")
+
+    @patch("sfmutils.harvester.RESULT_JOURNAL_COMPACT_ENTRIES", 2)
+    def test_result_journal(self):
+        harvester = BaseHarvester(self.working_path, host="localhost")
+        harvester.result_filepath = os.path.join(self.working_path, "test_1_result.json")
+        journal_filepath = harvester.result_filepath + ".journal"
+        harvester.result = HarvestResult()
+        harvester.result.started = iso8601.parse_date("2015-11-09T19:52:29+00:00")
+        yesterday = date.today() - timedelta(days=1)
+
+        # First save writes the result file
+        harvester.result.add_warc("warc1.warc.gz", warc_bytes=10)
+        harvester.result.increment_stats("stuff", count=5, day=yesterday)
+        harvester._save_result()
+        self.assertTrue(os.path.exists(harvester.result_filepath))
+        self.assertFalse(os.path.exists(journal_filepath))
+
+        # Then changes are appended to the journal
+        harvester.result.add_warc("warc2.warc.gz", warc_bytes=20)
+        harvester.result.increment_stats("stuff", count=10)
+        harvester.result.warnings.append(Msg("FAKE_CODE2", "This is my warning."))
+        harvester._save_result()
+        harvester.result.add_warc("warc3.warc.gz", warc_bytes=30)
+        harvester.result.increment_stats("stuff", count=10)
+        harvester._save_result()
+        with open(journal_filepath) as f:
+            journal_lines = f.readlines()
+        self.assertEqual(2, len(journal_lines))
+        self.assertDictEqual({"warcs": ["warc3.warc.gz"], "warc_bytes": 30,
+                              "stats": [[date.today().isoformat(), {"stuff": 10}]],
+                              "infos": [], "warnings": [], "errors": []}, json.loads(journal_lines[1]))
+
+        # An incomplete entry is skipped
+        with open(journal_filepath, "a") as f:
+            f.write('{"warcs": ["warc4')
+
+        # Replay
+        harvester2 = BaseHarvester(self.working_path, host="localhost")
+        harvester2.result_filepath = harvester.result_filepath
+        harvester2.result = HarvestResult()
+        harvester2._load_result()
+        self.assertEqual(["warc1.warc.gz", "warc2.warc.gz", "warc3.warc.gz"], harvester2.result.warcs)
+        self.assertEqual(60, harvester2.result.warc_bytes)
+        self.assertEqual(harvester.result.started, harvester2.result.started)
+        self.assertEqual(1, len(harvester2.result.warnings))
+        self.assertEqual({yesterday: {"stuff": 5}, date.today(): {"stuff": 20}}, harvester2.result.stats())
+
+        # Compacted after 2 entries
+        harvester2._save_result()
+        self.assertFalse(os.path.exists(journal_filepath))
+        harvester2._save_result()
+        harvester2._save_result()
+        harvester2._save_result()
+        self.assertFalse(os.path.exists(journal_filepath))
+        harvester3 = BaseHarvester(self.working_path, host="localhost")
+        harvester3.result_filepath = harvester.result_filepath
+        harvester3.result = HarvestResult()
+        harvester3._load_result()
+        self.assertEqual(harvester2.result.warcs, harvester3.result.warcs)
+        self.assertEqual(harvester2.result.stats(), harvester3.result.stats())
+
+    def test_status_stats_delta(self):
+        harvester = BaseHarvester(self.working_path, host="localhost", status_stats_deltas=True)
+        harvester.result = HarvestResult()
+        yesterday = date.today() - timedelta(days=1)
+        harvester.result.increment_stats("stuff", count=5, day=yesterday)
+        harvester.result.increment_stats("stuff", count=10)
+        self.assertEqual({yesterday.isoformat(): {"stuff": 5}, date.today().isoformat(): {"stuff": 10}},
+                         harvester._status_stats_delta())
+        harvester.result.increment_stats("stuff", count=10)
+        harvester.result.increment_stats("things", count=1)
+        stats_delta = harvester._status_stats_delta()
+        self.assertEqual({date.today().isoformat(): {"stuff": 10, "things": 1}}, stats_delta)
+        self.assertEqual({}, harvester._status_stats_delta())
+
+        # Merging
+        message = harvester._merge_status_messages(
+            {"stats": {"2015-11-09": {"stuff": 5}}, "stats_delta": True, "token_updates": {"1": "a"}, "uids": {}},
+            {"stats": {"2015-11-09": {"stuff": 1}, "2015-11-10": {"stuff": 2}}, "stats_delta": True,
+             "token_updates": {}, "uids": {"b": "2"}})
+        self.assertEqual({"2015-11-09": {"stuff": 6}, "2015-11-10": {"stuff": 2}}, message["stats"])
+        self.assertEqual({"1": "a"}, message["token_updates"])
+        self.assertEqual({"b": "2"}, message["uids"])
+
+    def test_status_message_copies_result(self):
+        harvester = BaseHarvester(self.working_path, host="localhost")
+        harvester.message = {"id": "test:1"}
+        harvester.routing_key = "harvest.start.test.test_usertimeline"
+        harvester.result = HarvestResult()
+        harvester.result.started = iso8601.parse_date("2015-11-09T12:00:00Z")
+        harvester.result.token_updates["1"] = "a"
+        with patch.object(harvester, "_publish_message") as mock_publish_message:
+            harvester._send_status_message(STATUS_RUNNING)
+        harvester.result.merge(HarvestResult())
+        harvester.result.token_updates["2"] = "b"
+        harvester.result.uids["c"] = "3"
+
+        message = mock_publish_message.call_args[0][1]
+        self.assertEqual({"1": "a"}, message["token_updates"])
+        self.assertEqual({}, message["uids"])
+
+    def test_concurrent_status_interval(self):
+        harvester = BaseHarvester(self.working_path, host="localhost", status_min_interval_secs=30)
+        harvester.mq_config = True
+        harvester.concurrency = 2
+        try:
+            with patch.object(harvester, "_copy_for_delivery"):
+                harvester._submit_delivery("harvest.start.test.test_usertimeline", self.message).result()
+            # The publisher shared by the deliveries uses the status interval.
+            self.assertEqual(30, harvester.async_publisher.min_interval_secs)
+        finally:
+            harvester.stop_async_publishing()
+            harvester._delivery_executor.shutdown()
+
+    def test_concurrent_status_messages(self):
+        harvester = BaseHarvester(self.working_path, host="localhost")
+        harvester.start_async_publishing(min_interval_secs=60)
+        published = []
+        harvester.async_publisher.publish_fn = lambda routing_key, message, **kwargs: published.append(
+            (routing_key, message))
+
+        harvesters = []
+        for harvest_id in ("a", "b"):
+            delivery_harvester = harvester._copy_for_delivery(os.path.join(self.working_path, harvest_id))
+            delivery_harvester.message = {"id": harvest_id}
+            delivery_harvester.routing_key = "harvest.start.test.{}".format(harvest_id)
+            delivery_harvester.result = HarvestResult()
+            delivery_harvester.result.started = iso8601.parse_date("2015-11-09T12:00:00Z")
+            harvesters.append(delivery_harvester)
+        harvester_a, harvester_b = harvesters
+
+        harvester_a.result.token_updates["1"] = "a1"
+        harvester_a._send_status_message(STATUS_RUNNING)
+        self._wait_for_published(published, 1)
+        # Waits for the interval
+        harvester_a.result.token_updates["2"] = "a2"
+        harvester_a._send_status_message(STATUS_RUNNING)
+        # Not merged into harvest a's status
+        harvester_b.result.token_updates["1"] = "b1"
+        harvester_b._send_status_message(STATUS_RUNNING)
+        # Harvest b's status is published while harvest a's waits.
+        self._wait_for_published(published, 2)
+        harvester.stop_async_publishing()
+        for delivery_harvester in harvesters:
+            delivery_harvester._release_delivery()
+
+        self.assertEqual([("harvest.status.test.a", "a", {"1": "a1"}),
+                          ("harvest.status.test.b", "b", {"1": "b1"}),
+                          ("harvest.status.test.a", "a", {"1": "a1", "2": "a2"})],
+                         [(routing_key, message["id"], message["token_updates"])
+                          for routing_key, message in published])
+
+    @staticmethod
+    def _wait_for_published(published, count):
+        for _ in range(100):
+            if len(published) >= count:
+                return
+            sleep(.05)
+
+    def test_queue_warc_file_once(self):
+        harvester = BaseHarvester(self.working_path, host="localhost")
+        harvester.warc_temp_dir = self.working_path
+        write_fake_warc(self.working_path, WARC_FILENAME_TEMPLATE.format(1))
+        with patch.object(harvester.warc_processing_queue, "put") as mock_put:
+            harvester._queue_warc_file(WARC_FILENAME_TEMPLATE.format(1))
+            harvester._queue_warc_files()
+            mock_put.assert_called_once_with(WARC_FILENAME_TEMPLATE.format(1))
+
     def test_list_warcs(self):
         harvester = BaseHarvester(self.working_path, host="localhost")
         write_fake_warc(self.working_path, "test_1-20151109195229879-00000-97528-GLSS-F0G5RP-8000.warc.gz")
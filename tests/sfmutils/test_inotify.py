@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from tests import TestCase
+from sfmutils.inotify import DirectoryWatcher, inotify_available
+
+
+@unittest.skipIf(not inotify_available(), "Skipping test since inotify not available.")
+class TestDirectoryWatcher(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filenames = []
+        self.event = threading.Event()
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+    def callback(self, filename):
+        self.filenames.append(filename)
+        if len(self.filenames) == 2:
+            self.event.set()
+
+    def test_watch(self):
+        with DirectoryWatcher(self.path, self.callback, suffixes=(".warc", ".warc.gz"), poll_secs=.1):
+            with open(os.path.join(self.path, "test1.warc.gz"), "w") as f:
+                f.write("Fake warc")
+            # Not completed
+            open_filepath = os.path.join(self.path, "test2.warc.gz.open")
+            with open(open_filepath, "w") as f:
+                f.write("Fake warc")
+            # Completed by renaming
+            os.rename(open_filepath, os.path.join(self.path, "test2.warc.gz"))
+            self.assertTrue(self.event.wait(5))
+
+        self.assertEqual(["test1.warc.gz", "test2.warc.gz"], self.filenames)
+
+    def test_missing_path(self):
+        watcher = DirectoryWatcher(os.path.join(self.path, "missing"), self.callback)
+        self.assertRaises(OSError, watcher.start)
@@ -1,5 +1,7 @@
 from __future__ import absolute_import
-from sfmutils.state_store import JsonHarvestStateStore
+from sfmutils.state_store import JsonHarvestStateStore, DelayedSetStateStoreAdapter, SqliteHarvestStateStore
+from mock import patch
+import json
 import tempfile
 import os
 import shutil
@@ -38,3 +40,96 @@ class TestJsonHarvestStateStore(TestCase):
         # Create a new store and test for value
         self.store = JsonHarvestStateStore(self.path)
         self.assertEqual("value1", self.store.get_state("resource_type1", "key1"), "Retrieved state not value1")
+
+    def test_external_modification(self):
+        self.store.set_state("resource_type1", "key1", "value1")
+        # Another store changes the file
+        JsonHarvestStateStore(self.path).set_state("resource_type1", "key1", "value2")
+        self.assertEqual("value2", self.store.get_state("resource_type1", "key1"))
+
+    def test_cached(self):
+        self.store.set_state("resource_type1", "key1", "value1")
+        with patch("sfmutils.state_store.json.load") as mock_load:
+            self.assertEqual("value1", self.store.get_state("resource_type1", "key1"))
+            self.assertFalse(mock_load.called)
+
+    def test_set_many(self):
+        self.store.set_state("resource_type1", "key1", "value1")
+        with patch.object(self.store, "_save_state", wraps=self.store._save_state) as mock_save_state:
+            self.store.set_many([("resource_type1", "key1", None), ("resource_type1", "key2", "value2"),
+                                 ("resource_type2", "key1", "value3")])
+            self.assertEqual(1, mock_save_state.call_count)
+        with open(os.path.join(self.path, "state.json")) as f:
+            self.assertEqual({"resource_type1": {"key2": "value2"}, "resource_type2": {"key1": "value3"}}, json.load(f))
+
+    def test_transaction(self):
+        with self.store.transaction():
+            self.store.set_state("resource_type1", "key1", "value1")
+            self.assertEqual("value1", self.store.get_state("resource_type1", "key1"))
+            self.assertFalse(os.path.exists(os.path.join(self.path, "state.json")))
+        self.assertEqual("value1", JsonHarvestStateStore(self.path).get_state("resource_type1", "key1"))
+
+        # Not written on exception
+        try:
+            with self.store.transaction():
+                self.store.set_state("resource_type1", "key1", "value2")
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual("value1", JsonHarvestStateStore(self.path).get_state("resource_type1", "key1"))
+
+    def test_delayed_set_adapter(self):
+        adapter = DelayedSetStateStoreAdapter(self.store)
+        adapter.set_state("resource_type1", "key1", "value1")
+        adapter.set_state("resource_type1", "key2", "value2")
+        self.assertEqual("value1", adapter.get_state("resource_type1", "key1"))
+        self.assertIsNone(self.store.get_state("resource_type1", "key1"))
+        with patch.object(self.store, "_save_state", wraps=self.store._save_state) as mock_save_state:
+            adapter.pass_state()
+            self.assertEqual(1, mock_save_state.call_count)
+        self.assertEqual("value2", JsonHarvestStateStore(self.path).get_state("resource_type1", "key2"))
+
+
+class TestSqliteHarvestStateStore(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "test")
+        self.store = SqliteHarvestStateStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+    def test_set_state(self):
+        self.assertIsNone(self.store.get_state("resource_type1", "key1"), "Has state before state is set")
+        self.store.set_state("resource_type1", "key1", "value1")
+        self.assertEqual("value1", self.store.get_state("resource_type1", "key1"))
+        self.store.set_state("resource_type1", "key1", {"since_id": 2})
+        self.assertEqual({"since_id": 2}, self.store.get_state("resource_type1", "key1"))
+        self.assertIsNone(self.store.get_state("resource_type2", "key1"))
+        self.store.set_state("resource_type1", "key1", None)
+        self.assertIsNone(self.store.get_state("resource_type1", "key1"), "Has state after state is cleared")
+
+    def test_persist(self):
+        self.store.set_many([("resource_type1", "key1", "value1"), ("resource_type1", "key2", 2)])
+        store = SqliteHarvestStateStore(self.path)
+        self.assertEqual("value1", store.get_state("resource_type1", "key1"))
+        self.assertEqual(2, store.get_state("resource_type1", "key2"))
+        store.close()
+
+    def test_journal_mode(self):
+        self.assertEqual("delete", self.store._conn.execute("PRAGMA journal_mode").fetchone()[0])
+        store = SqliteHarvestStateStore(os.path.join(self.path, "wal"), wal=True)
+        self.assertEqual("wal", store._conn.execute("PRAGMA journal_mode").fetchone()[0])
+        store.close()
+
+    def test_migrate(self):
+        path = os.path.join(self.path, "migrate")
+        JsonHarvestStateStore(path).set_many([("resource_type1", "key1", "value1"), ("resource_type2", "key1", 3)])
+        store = SqliteHarvestStateStore(path)
+        self.assertEqual("value1", store.get_state("resource_type1", "key1"))
+        self.assertEqual(3, store.get_state("resource_type2", "key1"))
+        self.assertFalse(os.path.exists(os.path.join(path, "state.json")))
+        self.assertTrue(os.path.exists(os.path.join(path, "state.json.migrated")))
+        store.close()
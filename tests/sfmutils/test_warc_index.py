@@ -0,0 +1,61 @@
+from __future__ import absolute_import
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+from dateutil.parser import parse as date_parse
+from sfmutils.warc_index import WarcIndex, INDEX_SUFFIX
+from tests.sfmutils.test_warc_iter import TestableNotLineOrientedWarcIter
+
+FILENAME = "test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz"
+
+
+class TestWarcIndex(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.warc_filepath = os.path.join(self.path, FILENAME)
+        shutil.copyfile(os.path.join(os.path.dirname(__file__), "warcs", FILENAME), self.warc_filepath)
+        self.index_filepath = self.warc_filepath + INDEX_SUFFIX
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+    def test_build_and_reuse(self):
+        warc_iter = TestableNotLineOrientedWarcIter(self.warc_filepath)
+        self.assertEqual(1229, len(list(warc_iter.iter(use_index=True))))
+        self.assertTrue(os.path.exists(self.index_filepath))
+
+        index = WarcIndex.load(self.warc_filepath, warc_iter._iter_name())
+        self.assertIsNotNone(index)
+        self.assertEqual(1229, sum(len(record["ids"]) for record in index.records))
+        self.assertEqual(["twitter_status"], index.records[0]["types"])
+
+        # Using the index gives the same items.
+        self.assertEqual([item.id for item in warc_iter.iter()], [item.id for item in warc_iter.iter(use_index=True)])
+
+    def test_date_bounded(self):
+        item_date_start = date_parse("2015-11-26T16:17:14Z")
+        warc_iter = TestableNotLineOrientedWarcIter(self.warc_filepath)
+        list(warc_iter.iter(use_index=True))
+        index = WarcIndex.load(self.warc_filepath, warc_iter._iter_name())
+        self.assertTrue(len(index.offsets(item_date_start=item_date_start)) < len(index.records))
+        self.assertEqual(800, len(list(warc_iter.iter(use_index=True, item_date_start=item_date_start))))
+        self.assertEqual([], index.offsets(item_date_start=date_parse("2016-01-01T00:00:00Z")))
+        self.assertEqual([], index.offsets(limit_item_types=["not_twitter_status"]))
+
+    def test_stale(self):
+        warc_iter = TestableNotLineOrientedWarcIter(self.warc_filepath)
+        list(warc_iter.iter(use_index=True))
+        # Different iter
+        self.assertIsNone(WarcIndex.load(self.warc_filepath, "other.WarcIter"))
+        # Touched, but not changed
+        os.utime(self.warc_filepath, (0, 0))
+        self.assertIsNotNone(WarcIndex.load(self.warc_filepath, warc_iter._iter_name()))
+        # Changed
+        with open(self.warc_filepath, "ab") as f:
+            f.write(b"\n")
+        self.assertIsNone(WarcIndex.load(self.warc_filepath, warc_iter._iter_name()))
+
+    def test_no_index(self):
+        self.assertIsNone(WarcIndex.load(self.warc_filepath, "other.WarcIter"))
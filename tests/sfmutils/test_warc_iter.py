@@ -1,8 +1,18 @@
 from __future__ import absolute_import
 from unittest import TestCase
+from mock import patch
 import os
+import gzip
+import json
+import multiprocessing
+import subprocess
+import sys
+import shutil
+import tempfile
 from dateutil.parser import parse as date_parse
-from sfmutils.warc_iter import BaseWarcIter
+from sfmutils import warc_iter
+from sfmutils.warc_iter import BaseWarcIter, JSON_DECODERS, set_json_decoder
+from sfmutils.dedupe import DEDUPE_MODES
 
 
 class TestableNotLineOrientedWarcIter(BaseWarcIter):
@@ -66,6 +76,34 @@ class TestWarcIter(TestCase):
             self.assertTrue(status.item.get("id"))
         self.assertEqual(1229, count)
 
+    def test_position(self):
+        filepath = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        warc_iter = TestableNotLineOrientedWarcIter((filepath, filepath))
+        positions = [warc_iter.position for _ in warc_iter.iter(dedupe=True)]
+        # Duplicates in the second WARC are consumed, but not yielded.
+        self.assertEqual([(0, count) for count in range(1, 1230)], positions)
+        self.assertEqual((2, 0), warc_iter.position)
+
+    def test_start_position(self):
+        filepath = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        ids = [iter_item.id for iter_item in TestableNotLineOrientedWarcIter((filepath, filepath))]
+        warc_iter = TestableNotLineOrientedWarcIter((filepath, filepath))
+        iter_items = warc_iter.iter()
+        for _ in range(1500):
+            next(iter_items)
+        self.assertEqual((1, 271), warc_iter.position)
+
+        resumed_warc_iter = TestableNotLineOrientedWarcIter((filepath, filepath))
+        self.assertEqual(ids[1500:], [iter_item.id for iter_item in resumed_warc_iter.iter(
+            start_position=warc_iter.position)])
+        self.assertEqual((2, 0), resumed_warc_iter.position)
+
+    def test_dedupe_ids(self):
+        filepath = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        ids = [iter_item.id for iter_item in TestableNotLineOrientedWarcIter(filepath)]
+        self.assertEqual(ids[1000:], [iter_item.id for iter_item in TestableNotLineOrientedWarcIter(
+            (filepath, filepath)).iter(dedupe=True, dedupe_ids=ids[:1000])])
+
     def test_item_type_limit(self):
         self.assertEqual(1229, len(list(TestableNotLineOrientedWarcIter(
             self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")).iter(
@@ -114,3 +152,101 @@ class TestWarcIter(TestCase):
             self.assertTrue(status.item.get("id"))
             self.assertTrue(status.date <= item_date_end)
         self.assertEqual(430, count)
+
+    def test_workers(self):
+        filepath1 = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        filepath2 = self._warc_filepath("test_1-20151202200525007-00000-30033-GLSS-F0G5RP-8000.warc.gz")
+        warc_iter = TestableNotLineOrientedWarcIter((filepath2, filepath1, filepath1))
+        items = list(warc_iter.iter(workers=2))
+        self.assertEqual([item.id for item in warc_iter.iter()], [item.id for item in items])
+        self.assertEqual(1229 * 2, len(list(TestableNotLineOrientedWarcIter((filepath2, filepath1, filepath1)).iter(
+            workers=2, preserve_order=False))))
+
+    @patch("sfmutils.warc_iter.ITEM_QUEUE_CHUNKS", 2)
+    @patch("sfmutils.warc_iter.ITEM_CHUNK_SIZE", 10)
+    def test_workers_chunked(self):
+        filepath1 = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        filepath2 = self._warc_filepath("test_1-20151202200525007-00000-30033-GLSS-F0G5RP-8000.warc.gz")
+        warc_iter = TestableNotLineOrientedWarcIter((filepath1, filepath2, filepath1))
+        self.assertEqual([item.id for item in warc_iter.iter()], [item.id for item in warc_iter.iter(workers=2)])
+        self.assertEqual(1229 * 2, len(list(warc_iter.iter(workers=2, preserve_order=False))))
+
+        # Stopping part way kills the workers.
+        items = warc_iter.iter(workers=2)
+        next(items)
+        items.close()
+        self.assertEqual([], multiprocessing.active_children())
+
+    def test_workers_start_method(self):
+        filepath1 = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        filepath2 = self._warc_filepath("test_1-20151202200525007-00000-30033-GLSS-F0G5RP-8000.warc.gz")
+        warc_iter = TestableNotLineOrientedWarcIter((filepath1, filepath2, filepath1))
+        self.assertEqual([item.id for item in warc_iter.iter()],
+                         [item.id for item in warc_iter.iter(workers=2, start_method="forkserver")])
+
+    def test_workers_failure(self):
+        filepath = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        warc_iter = TestableNotLineOrientedWarcIter((filepath, os.path.join(tempfile.gettempdir(), "missing.warc.gz")))
+        self.assertRaises(Exception, list, warc_iter.iter(workers=2))
+        self.assertEqual([], multiprocessing.active_children())
+
+    def test_workers_dedupe(self):
+        filepath = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        self.assertEqual(1229 * 2, len(list(TestableNotLineOrientedWarcIter((filepath, filepath)).iter(workers=2))))
+        self.assertEqual(1229, len(list(TestableNotLineOrientedWarcIter((filepath, filepath)).iter(
+            workers=2, dedupe=True))))
+
+    def test_dedupe_modes(self):
+        filepath = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        for dedupe_mode in DEDUPE_MODES:
+            self.assertEqual(1229, len(list(TestableNotLineOrientedWarcIter((filepath, filepath)).iter(
+                dedupe=True, dedupe_mode=dedupe_mode, dedupe_max_ids_in_memory=100))))
+
+    def test_json_decoders(self):
+        filepath = self._warc_filepath("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz")
+        default_decoder_name = warc_iter.json_decoder_name
+        try:
+            set_json_decoder("json")
+            expected_items = list(TestableNotLineOrientedWarcIter(filepath))
+            for name in JSON_DECODERS:
+                set_json_decoder(name)
+                self.assertEqual(expected_items, list(TestableNotLineOrientedWarcIter(filepath)))
+        finally:
+            set_json_decoder(default_decoder_name)
+
+    def test_unavailable_json_decoder(self):
+        default_decoder_name = warc_iter.json_decoder_name
+        try:
+            with self.assertLogs("sfmutils.warc_iter", level="WARNING"):
+                set_json_decoder("bogus")
+            self.assertEqual("json", warc_iter.json_decoder_name)
+            self.assertIs(json.loads, warc_iter.loads)
+        finally:
+            set_json_decoder(default_decoder_name)
+
+    def test_unavailable_json_decoder_env(self):
+        env = dict(os.environ, SFM_JSON_DECODER="bogus")
+        output = subprocess.check_output(
+            [sys.executable, "-c", "from sfmutils import warc_iter; print(warc_iter.json_decoder_name)"],
+            env=env, stderr=subprocess.STDOUT, cwd=os.path.dirname(os.path.dirname(warc_iter.__file__)))
+        self.assertEqual("json", output.decode().strip().splitlines()[-1])
+
+    def test_json_decoder_fallback(self):
+        for loads in JSON_DECODERS.values():
+            self.assertEqual({"a": 2 ** 70}, loads(b'{"a": 1180591620717411303424}\r\n'))
+            self.assertRaises(ValueError, loads, b'{"a": ')
+
+    def test_uncompressed(self):
+        path = tempfile.mkdtemp()
+        try:
+            for filename in ("test_1-20151202190229530-00000-29525-GLSS-F0G5RP-8000.warc.gz",
+                             "test_1-20151202200525007-00000-30033-GLSS-F0G5RP-8000.warc.gz"):
+                filepath = os.path.join(path, filename[:-len(".gz")])
+                with gzip.open(self._warc_filepath(filename), "rb") as gz_f, open(filepath, "wb") as f:
+                    shutil.copyfileobj(gz_f, f)
+                self.assertEqual(list(TestableNotLineOrientedWarcIter(self._warc_filepath(filename))),
+                                 list(TestableNotLineOrientedWarcIter(filepath)))
+            self.assertEqual(111, len(list(TestableLineOrientedWarcIter(
+                os.path.join(path, "test_1-20151202200525007-00000-30033-GLSS-F0G5RP-8000.warc")))))
+        finally:
+            shutil.rmtree(path)
@@ -1,7 +1,7 @@
 from __future__ import absolute_import
 from unittest import TestCase
 from sfmutils.warcprox import warced, SubProcess
-from subprocess import Popen
+from subprocess import Popen, TimeoutExpired
 import os
 import socket
 import requests
@@ -46,6 +46,43 @@ class WarcedTest(TestCase):
             "-d /test -n test -p {} -i --rollover-time 60".format(w.ca_bundle, w.ca_dir, w.port),
             w._generate_commandline())
 
+        w = warced("test", "/test", interrupt=True, rollover_idle_time=5)
+        self.assertEqual(
+            "warcprox -c {} --certs-dir {} --dedup-db-file /dev/null --stats-db-file /dev/null "
+            "-d /test -n test -p {} -z -i --rollover-idle-time 5".format(w.ca_bundle, w.ca_dir, w.port),
+            w._generate_commandline())
+
+    @patch("sfmutils.warcprox.SubProcess", autospec=True)
+    def test_wait_for_ready(self, mock_subprocess_cls):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('localhost', 0))
+        server.listen(1)
+        try:
+            w = warced("test", "/test", port=server.getsockname()[1])
+            mock_subprocess_cls.return_value.proc = MagicMock(spec=Popen)
+            mock_subprocess_cls.return_value.proc.poll.return_value = None
+            with open(w.ca_bundle, "w") as f:
+                f.write("Fake CA")
+            w.__enter__()
+            w.__exit__(None, None, None)
+        finally:
+            server.close()
+
+    @patch("sfmutils.warcprox.SubProcess", autospec=True)
+    def test_wait_for_ready_exited(self, mock_subprocess_cls):
+        w = warced("test", "/test", port=warced._pick_a_port())
+        mock_subprocess_cls.return_value.proc = MagicMock(spec=Popen)
+        mock_subprocess_cls.return_value.proc.poll.return_value = 1
+        self.assertRaises(Exception, w.__enter__)
+        self.assertIsNone(os.environ.get("HTTP_PROXY"))
+
+    @patch("sfmutils.warcprox.SubProcess", autospec=True)
+    def test_wait_for_ready_timeout(self, mock_subprocess_cls):
+        w = warced("test", "/test", port=warced._pick_a_port(), startup_timeout_secs=.2)
+        mock_subprocess_cls.return_value.proc = MagicMock(spec=Popen)
+        mock_subprocess_cls.return_value.proc.poll.return_value = None
+        self.assertRaises(Exception, w.__enter__)
+
     def test_with(self):
         warc_dir = tempfile.mkdtemp()
         try:
@@ -82,8 +119,22 @@ class SubprocessTest(TestCase):
         subprocess = SubProcess("foo", terminate_wait_secs=2)
         mock_popen_cls.assert_called_once_with(["foo"], stdout=sys.stdout)
 
-        mock_popen.poll.return_value = None
+        mock_popen.wait.side_effect = [TimeoutExpired("foo", 2), 0]
         subprocess.cleanup()
 
         mock_popen.terminate.assert_called_once_with()
+        mock_popen.wait.assert_any_call(timeout=2)
         mock_popen.kill.assert_called_once_with()
+
+    @patch("sfmutils.warcprox.Popen", autospec=True)
+    def test_terminated(self, mock_popen_cls):
+        mock_popen = MagicMock(spec=Popen)
+        mock_popen_cls.side_effect = [mock_popen]
+
+        subprocess = SubProcess("foo", terminate_wait_secs=2)
+        mock_popen.wait.return_value = 0
+        subprocess.cleanup()
+
+        mock_popen.terminate.assert_called_once_with()
+        mock_popen.wait.assert_called_once_with(timeout=2)
+        self.assertFalse(mock_popen.kill.called)